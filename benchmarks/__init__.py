@@ -0,0 +1,5 @@
+"""
+Offline benchmarks: the real cogs driven with fake Discord objects against local
+stand-ins for every upstream. Run them from the repo root, e.g.
+``python -m benchmarks.commands``.
+"""
@@ -0,0 +1,363 @@
+"""
+Per-command benchmark: every network-bound hybrid command is invoked with a fake
+``Context`` against the local stand-ins of ``benchmarks/stubs.py``, without a Discord
+connection or any real upstream.
+
+Usage:
+  python -m benchmarks.commands [--iterations N] [--concurrency N] [--only weather,gemini]
+                                [--stub gemini.latency=0.2 --stub sd.error_rate=0.1 ...]
+                                [--latency-scale X] [--fast] [--no-trace-memory]
+                                [--output benchmarks/results/commands.json]
+
+For every command it reports the p50/p95/p99 latency, the throughput at the given
+concurrency, the peak memory allocated while it ran (tracemalloc, which slows Python
+code down; use --no-trace-memory for latency-only runs), the upstream requests and
+Discord calls per invocation and the failures. The results are also written to a JSON
+file so runs before and after a change can be compared.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from benchmarks.fakes import FakeAttachment, FakeChannel, FakeContext, FakeDiscord, FakeGuild
+from benchmarks.stubs import DEFAULT_SETTINGS, StubSettings, StubUpstreams
+from helpers.config import REPO_ROOT, Config
+from helpers.runtime import RuntimeProfile, install_runtime
+
+DEFAULT_OUTPUT = REPO_ROOT / "benchmarks" / "results" / "commands.json"
+
+
+@dataclass
+class Scenario:
+    """
+    :param name: The name the scenario is reported under.
+    :param command: The hybrid command that is invoked.
+    :param kwargs: The arguments of the command.
+    :param attachments: Number of CDN attachments on the invoking message.
+    :param attachment_type: Their content type; PNGs of the CDN payload size by default.
+    :param attachment_size: Their size, instead of the CDN payload size.
+    """
+
+    name: str
+    command: str
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    attachments: int = 0
+    attachment_type: str = "image/png"
+    attachment_size: Optional[int] = None
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("weather", "weather", {"town": "adelaide", "state": "sa"}),
+    Scenario("fuel", "fuel", {"town": "adelaide", "state": "sa"}),
+    Scenario("openports", "openports", {"ip": "1.1.1.1"}),
+    Scenario("redorblack", "redorblack"),
+    Scenario("shodan", "shodan", {"city": "Adelaide"}),
+    Scenario("mcserver", "mcserver", {"city": "Paris"}),
+    Scenario("shodan_query", "shodan_query", {"query": "port:80 show:list"}),
+    Scenario("mcstatus", "mcstatus"),
+    Scenario("gemini", "gemini", {"prompt": "Benchmark prompt"}),
+    Scenario("gemini+attachments", "gemini", {"prompt": "Describe these"}, attachments=3),
+    Scenario("gemini+video", "gemini", {"prompt": "Describe this"}, attachments=1, attachment_type="video/mp4", attachment_size=24 * 1024 * 1024),
+    Scenario("wizard", "wizard", {"prompt": "Benchmark prompt"}),
+    Scenario("sd", "sd", {"prompt": "a benchmark cat"}),
+]
+
+# The stand-ins each scenario talks to, for --stub shortcuts such as "sd.latency".
+SCENARIO_UPSTREAMS: Dict[str, str] = {
+    "weather": "bom",
+    "fuel": "fuelprice",
+    "openports": "internetdb",
+    "redorblack": "qrng",
+    "shodan": "shodan",
+    "mcserver": "shodan",
+    "shodan_query": "shodan",
+    "mcstatus": "minecraft",
+    "gemini": "gemini",
+    "wizard": "lmstudio",
+    "sd": "auto1111",
+}
+
+COGS = ("utility", "fun", "shodan", "sidepipe", "ai")
+
+
+@dataclass
+class Result:
+    name: str
+    iterations: int
+    concurrency: int
+    failures: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    max_ms: float
+    throughput: float
+    peak_memory_kb: Optional[float]
+    upstream_requests: Dict[str, float]
+    upstream_errors: Dict[str, int]
+    discord_calls: Dict[str, float]
+    errors: Dict[str, int]
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, min(len(ordered), math.ceil(q * len(ordered))))
+    return ordered[rank - 1]
+
+
+async def create_bot(stubs: StubUpstreams, runtime: RuntimeProfile, *, cache: bool = False, lazy=None):
+    """
+    A bot with the real cogs loaded whose HTTP client is pointed at ``stubs``. It never
+    logs in. The upstream caches are off unless ``cache`` is set; concurrent invocations
+    with the same arguments still share one stand-in request.
+
+    With ``lazy`` (a set of cog names, as ``LAZY_COGS``), every cog is loaded through
+    the ``ExtensionLoader`` instead of only the benchmarked ones.
+    """
+    import discord
+    from discord.ext import commands
+
+    from helpers.cache import CacheRegistry
+    from helpers.extensions import ExtensionLoader, LazyCommandTree
+    from helpers.gemini_context import ContextCache
+    from helpers.gemini_files import GeminiFiles
+    from helpers.history import ChannelHistory
+    from helpers.http import HTTPClient
+    from helpers.keypool import KeyPool
+    from helpers.media import MediaProcessor
+    from helpers.memory import MemoryBudget
+    from helpers.metrics import BotMetrics
+    from helpers.store import Store
+    from helpers.triggers import TriggerDispatcher
+
+    bot = commands.Bot(
+        command_prefix="!", intents=discord.Intents.none(), help_command=None, tree_cls=LazyCommandTree
+    )
+    bot.logger = logging.getLogger("Neurodivergence")
+    bot.config = Config(**stubs.config())
+    bot.runtime = runtime
+    bot.metrics = BotMetrics()
+    bot.http_client = HTTPClient(
+        trace_configs=[bot.metrics.http_trace_config()],
+        json_dumps=runtime.json_dumps,
+        json_loads=runtime.json_loads,
+        upstreams=stubs.upstreams(),
+    )
+    bot.store = Store(":memory:")
+    await bot.store.open()
+    bot.memory = MemoryBudget()
+    bot.caches = CacheRegistry(metrics=bot.metrics, store=bot.store, budget=bot.memory)
+    bot.caches.enabled = cache
+    bot.history = ChannelHistory(budget=bot.memory)
+    bot.media = MediaProcessor()
+    bot.gemini_files = GeminiFiles(bot.http_client, store=bot.store)
+    bot.gemini_context = ContextCache(bot.http_client, metrics=bot.metrics)
+    bot.gemini_keys = KeyPool("gemini", bot.config.gemini_keys, store=bot.store, metrics=bot.metrics)
+    bot.triggers = TriggerDispatcher()
+    if lazy is not None:
+        bot.extension_loader = ExtensionLoader(bot, REPO_ROOT / "cogs", lazy=set(lazy))
+        await bot.extension_loader.load_all()
+        return bot
+    for cog in COGS:
+        await bot.load_extension(f"cogs.{cog}")
+    return bot
+
+
+async def run_scenario(bot, stubs: StubUpstreams, scenario: Scenario, *, iterations: int, concurrency: int, trace_memory: bool) -> Result:
+    command = bot.get_command(scenario.command)
+    if command is None:
+        raise SystemExit(f"Unknown command '{scenario.command}'")
+    kwargs = dict(scenario.kwargs)
+    if scenario.command == "mcstatus":
+        kwargs["address"] = stubs.minecraft_address
+
+    discord_calls = FakeDiscord()
+    guild = FakeGuild()
+    channel = FakeChannel(discord_calls, guild)
+    requests_before = dict(stubs.requests)
+    errors_before = dict(stubs.errors)
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def invoke() -> None:
+        if scenario.attachment_size is None:
+            attachments = [
+                FakeAttachment(url=f"https://cdn.discordapp.com/attachments/1/{index}/image.png", size=stubs.settings["cdn"].payload_size)
+                for index in range(scenario.attachments)
+            ]
+        else:
+            filename = "file." + scenario.attachment_type.rpartition("/")[2]
+            attachments = [
+                FakeAttachment(
+                    url=f"https://cdn.discordapp.com/attachments/1/{index}/{filename}?size={scenario.attachment_size}",
+                    content_type=scenario.attachment_type,
+                    filename=filename,
+                    size=scenario.attachment_size,
+                )
+                for index in range(scenario.attachments)
+            ]
+        ctx = FakeContext(bot, command, discord=discord_calls, channel=channel, attachments=attachments)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await command.callback(command.cog, ctx, **kwargs)
+            except Exception as e:
+                name = type(e).__name__
+                errors[name] = errors.get(name, 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+    if trace_memory:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    await asyncio.gather(*(invoke() for _ in range(iterations)))
+    elapsed = time.perf_counter() - started
+    peak = (tracemalloc.get_traced_memory()[1] - baseline) / 1024 if trace_memory else None
+
+    ordered = sorted(latencies)
+    per_call = lambda count: round(count / iterations, 2)
+    return Result(
+        name=scenario.name,
+        iterations=iterations,
+        concurrency=concurrency,
+        failures=sum(errors.values()),
+        p50_ms=round(percentile(ordered, 0.50) * 1000, 2),
+        p95_ms=round(percentile(ordered, 0.95) * 1000, 2),
+        p99_ms=round(percentile(ordered, 0.99) * 1000, 2),
+        mean_ms=round(sum(ordered) / len(ordered) * 1000, 2),
+        max_ms=round(ordered[-1] * 1000, 2),
+        throughput=round(iterations / elapsed, 2),
+        peak_memory_kb=round(peak, 1) if peak is not None else None,
+        upstream_requests={
+            name: per_call(count - requests_before.get(name, 0))
+            for name, count in stubs.requests.items() if count != requests_before.get(name, 0)
+        },
+        upstream_errors={
+            name: count - errors_before.get(name, 0)
+            for name, count in stubs.errors.items() if count != errors_before.get(name, 0)
+        },
+        discord_calls={name: per_call(count) for name, count in discord_calls.calls.items()},
+        errors=errors,
+    )
+
+
+def parse_stub_overrides(values: List[str]) -> Dict[str, StubSettings]:
+    """
+    Parse ``--stub`` values such as ``gemini.latency=0.2`` or ``sd.payload_size=2097152``.
+    Command names are accepted for the stand-in they use.
+    """
+    settings: Dict[str, StubSettings] = {}
+    known = [f.name for f in fields(StubSettings)]
+    for value in values:
+        target, _, raw = value.partition("=")
+        upstream, _, key = target.partition(".")
+        upstream = SCENARIO_UPSTREAMS.get(upstream, upstream)
+        if upstream not in DEFAULT_SETTINGS or key not in known or not raw:
+            raise SystemExit(f"Invalid --stub '{value}', expected <upstream>.<{'|'.join(known)}>=<value>")
+        current = settings.setdefault(upstream, StubSettings(**vars(DEFAULT_SETTINGS[upstream])))
+        setattr(current, key, int(raw) if key in ("error_status", "payload_size") else float(raw))
+    return settings
+
+
+def print_table(results: List[Result]) -> None:
+    header = f"{'command':<20} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'cmd/s':>8} {'peak KiB':>10} {'fail':>5}  upstream/cmd"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        peak = f"{r.peak_memory_kb:.0f}" if r.peak_memory_kb is not None else "-"
+        upstream = ", ".join(f"{name} {count:g}" for name, count in r.upstream_requests.items()) or "-"
+        print(f"{r.name:<20} {r.p50_ms:>9.1f} {r.p95_ms:>9.1f} {r.p99_ms:>9.1f} {r.throughput:>8.2f} {peak:>10} {r.failures:>5}  {upstream}")
+
+
+async def run(args: argparse.Namespace, runtime: RuntimeProfile) -> Dict[str, Any]:
+    only = {name.strip() for name in args.only.split(",")} if args.only else None
+    scenarios = [s for s in SCENARIOS if only is None or s.name in only or s.command in only]
+    if not scenarios:
+        raise SystemExit(f"No scenario matches --only {args.only}")
+
+    stubs = StubUpstreams(parse_stub_overrides(args.stub), latency_scale=args.latency_scale, seed=args.seed)
+    await stubs.start()
+    bot = await create_bot(stubs, runtime, cache=args.cache)
+    results: List[Result] = []
+    if args.trace_memory:
+        tracemalloc.start()
+    try:
+        for scenario in scenarios:
+            result = await run_scenario(
+                bot, stubs, scenario, iterations=args.iterations, concurrency=args.concurrency, trace_memory=args.trace_memory
+            )
+            results.append(result)
+            print(f"{scenario.name}: p50 {result.p50_ms:.1f}ms, {result.throughput:.2f} cmd/s", file=sys.stderr)
+    finally:
+        if args.trace_memory:
+            tracemalloc.stop()
+        await bot.caches.close()
+        await bot.store.close()
+        await bot.gemini_context.close()
+        await bot.http_client.close()
+        await stubs.close()
+
+    print_table(results)
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": f"{platform.system()} {platform.release()}",
+        "runtime": runtime.describe(),
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+        "latency_scale": args.latency_scale,
+        "cache": args.cache,
+        "trace_memory": args.trace_memory,
+        "stubs": stubs.describe(),
+        "results": [vars(result) for result in results],
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Benchmark every network-bound command against local stand-ins.")
+    p.add_argument("--iterations", type=int, default=20, help="Invocations per command (default: 20).")
+    p.add_argument("--concurrency", type=int, default=4, help="Invocations running at the same time (default: 4).")
+    p.add_argument("--only", default=None, help="Comma-separated scenarios or commands to run.")
+    p.add_argument("--stub", action="append", default=[], help="Stand-in setting, e.g. gemini.latency=0.2 (repeatable).")
+    p.add_argument("--latency-scale", type=float, default=1.0, help="Multiply every stand-in latency (0 for CPU-only runs).")
+    p.add_argument("--seed", type=int, default=None, help="Seed of the error injection and jitter.")
+    p.add_argument("--cache", action="store_true", help="Enable the upstream response caches.")
+    p.add_argument("--fast", action="store_true", help="Use the FAST_RUNTIME profile (uvloop/orjson when installed).")
+    p.add_argument("--no-trace-memory", dest="trace_memory", action="store_false", help="Do not measure peak memory.")
+    p.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help=f"JSON results file (default: {DEFAULT_OUTPUT.relative_to(REPO_ROOT)}).")
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.iterations < 1 or args.concurrency < 1:
+        raise SystemExit("--iterations and --concurrency must be at least 1")
+    runtime = install_runtime(args.fast)
+    for note in runtime.notes:
+        print(f"FAST_RUNTIME: {note}", file=sys.stderr)
+    report = asyncio.run(run(args, runtime))
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nResults written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
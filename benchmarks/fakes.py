@@ -0,0 +1,150 @@
+"""
+Minimal stand-ins for the discord.py objects a command touches: the context, its message,
+author, guild and channel. Nothing is sent to Discord; every send, reply, edit and delete
+is counted on the ``FakeDiscord`` the objects share, so a benchmark can report how many
+Discord calls a command makes.
+"""
+
+from __future__ import annotations
+
+import collections
+import itertools
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+_ids = itertools.count(1_000_000_000_000_000_000)
+
+
+class FakeDiscord:
+    def __init__(self) -> None:
+        self.calls: Dict[str, int] = collections.Counter()
+        self.uploaded_bytes = 0
+
+    def record(self, call: str, kwargs: Dict[str, Any]) -> None:
+        self.calls[call] += 1
+        files = list(kwargs.get("files") or ()) + list(kwargs.get("attachments") or ())
+        if kwargs.get("file") is not None:
+            files.append(kwargs["file"])
+        for file in files:
+            fp = getattr(file, "fp", None)
+            if fp is not None and hasattr(fp, "getbuffer"):
+                self.uploaded_bytes += fp.getbuffer().nbytes
+
+
+@dataclass(eq=False)
+class FakeUser:
+    name: str = "bench-user"
+    id: int = field(default_factory=lambda: next(_ids))
+    bot: bool = False
+
+    def __str__(self) -> str:
+        return self.name
+
+
+@dataclass(eq=False)
+class FakeGuild:
+    name: str = "Bench Guild"
+    id: int = field(default_factory=lambda: next(_ids))
+
+
+@dataclass(eq=False)
+class FakeAttachment:
+    url: str
+    content_type: str = "image/png"
+    filename: str = "image.png"
+    size: int = 0
+    id: int = field(default_factory=lambda: next(_ids))
+
+
+class FakeMessage:
+    def __init__(self, discord: FakeDiscord, channel: "FakeChannel", author: FakeUser, content: str = "", attachments: Optional[List[FakeAttachment]] = None) -> None:
+        self._discord = discord
+        self.id = next(_ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.attachments = attachments or []
+        self.embeds: List[Any] = []
+
+    def _apply(self, kwargs: Dict[str, Any]) -> None:
+        if "content" in kwargs:
+            self.content = kwargs["content"] or ""
+        if kwargs.get("embed") is not None:
+            self.embeds = [kwargs["embed"]]
+
+    async def edit(self, **kwargs: Any) -> "FakeMessage":
+        self._discord.record("edit", kwargs)
+        self._apply(kwargs)
+        return self
+
+    async def delete(self, **kwargs: Any) -> None:
+        self._discord.record("delete", kwargs)
+
+    async def reply(self, content: Optional[str] = None, **kwargs: Any) -> "FakeMessage":
+        return await self.channel.send(content, _call="reply", **kwargs)
+
+
+class FakeChannel:
+    """
+    :param history: Number of messages ``history()`` yields, like a busy channel.
+    """
+
+    def __init__(self, discord: FakeDiscord, guild: Optional[FakeGuild], *, history: int = 50) -> None:
+        self._discord = discord
+        self.id = next(_ids)
+        self.name = "bench"
+        self.guild = guild
+        authors = [FakeUser(name=f"user{index}") for index in range(5)]
+        self._history = [
+            FakeMessage(discord, self, authors[index % len(authors)], f"message number {index} in the benchmark channel")
+            for index in range(history)
+        ]
+
+    async def send(self, content: Optional[str] = None, *, _call: str = "send", **kwargs: Any) -> FakeMessage:
+        self._discord.record(_call, kwargs)
+        message = FakeMessage(self._discord, self, FakeUser(name="bot", bot=True))
+        message._apply({"content": content, **kwargs})
+        return message
+
+    async def history(self, *, limit: Optional[int] = 100, **kwargs: Any):
+        self._discord.calls["history"] += 1
+        for message in reversed(self._history[-limit:] if limit else self._history):
+            yield message
+
+
+class FakeContext:
+    """
+    Stands in for ``commands.Context`` of a prefix invocation; ``interaction`` is None.
+    """
+
+    def __init__(self, bot, command, *, discord: FakeDiscord, channel: FakeChannel, author: Optional[FakeUser] = None, content: str = "", attachments: Optional[List[FakeAttachment]] = None) -> None:
+        self.bot = bot
+        self.command = command
+        self.cog = command.cog if command is not None else None
+        self.interaction = None
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author or FakeUser()
+        self.message = FakeMessage(discord, channel, self.author, content, attachments)
+        self._discord = discord
+
+    async def send(self, content: Optional[str] = None, **kwargs: Any) -> FakeMessage:
+        return await self.channel.send(content, **kwargs)
+
+    async def reply(self, content: Optional[str] = None, **kwargs: Any) -> FakeMessage:
+        return await self.channel.send(content, _call="reply", **kwargs)
+
+    async def defer(self, **kwargs: Any) -> None:
+        pass
+
+    def typing(self):
+        return _NullAsyncContext()
+
+
+class _NullAsyncContext:
+    async def __aenter__(self) -> None:
+        return None
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        return None
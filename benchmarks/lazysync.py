@@ -0,0 +1,126 @@
+"""
+Lazy cog check: the slash commands that ``sync`` sends to Discord must be the same
+whether the cogs are loaded eagerly or lazily (``LAZY_COGS``).
+
+Usage:
+  python -m benchmarks.lazysync [--lazy utility,fun] [--output benchmarks/results/lazysync.json]
+
+Two bots that never log in are built with the real cogs: one loads every cog eagerly,
+the other with ``--lazy`` (every cog that allows it by default). The lazy bot's pending
+cogs are then loaded with ``ExtensionLoader.materialize_all``, as the owner ``sync``
+command does, and the sync payloads of both command trees are compared. The load times
+and the slash commands missing before the lazy cogs are loaded are reported. The exit
+status is 1 when the payloads differ.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from benchmarks.commands import create_bot
+from benchmarks.stubs import StubUpstreams
+from helpers.config import REPO_ROOT
+from helpers.runtime import install_runtime
+
+DEFAULT_OUTPUT = REPO_ROOT / "benchmarks" / "results" / "lazysync.json"
+
+
+def sync_payload(bot) -> Dict[str, Any]:
+    """
+    The global commands of ``bot.tree`` as ``tree.sync()`` sends them, by name.
+    """
+    return {command.name: command.to_dict(bot.tree) for command in bot.tree.get_commands()}
+
+
+async def build(stubs: StubUpstreams, runtime, lazy: set) -> tuple:
+    started = time.perf_counter()
+    bot = await create_bot(stubs, runtime, lazy=lazy)
+    return bot, time.perf_counter() - started
+
+
+async def close(bot) -> None:
+    await bot.caches.close()
+    await bot.store.close()
+    await bot.http_client.close()
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    runtime = install_runtime(False)
+    lazy = {name.strip() for name in args.lazy.split(",") if name.strip()}
+    stubs = StubUpstreams()
+    await stubs.start()
+    try:
+        eager_bot, eager_seconds = await build(stubs, runtime, set())
+        try:
+            eager = sync_payload(eager_bot)
+        finally:
+            await close(eager_bot)
+
+        lazy_bot, lazy_seconds = await build(stubs, runtime, lazy)
+        try:
+            pending = sorted(lazy_bot.extension_loader.pending)
+            before = sync_payload(lazy_bot)
+            started = time.perf_counter()
+            failed = await lazy_bot.extension_loader.materialize_all()
+            materialize_seconds = time.perf_counter() - started
+            after = sync_payload(lazy_bot)
+        finally:
+            await close(lazy_bot)
+    finally:
+        await stubs.close()
+
+    differing = sorted(name for name in eager.keys() & after.keys() if eager[name] != after[name])
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "lazy": sorted(lazy),
+        "pending": pending,
+        "failed": failed,
+        "eager_load_ms": round(eager_seconds * 1000, 1),
+        "lazy_load_ms": round(lazy_seconds * 1000, 1),
+        "materialize_ms": round(materialize_seconds * 1000, 1),
+        "commands": len(eager),
+        "missing_before_materialize": sorted(eager.keys() - before.keys()),
+        "missing": sorted(eager.keys() - after.keys()),
+        "extra": sorted(after.keys() - eager.keys()),
+        "differing": differing,
+    }
+    report["match"] = not (failed or report["missing"] or report["extra"] or differing)
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Check that lazy cogs sync the same slash commands as eager ones.")
+    p.add_argument("--lazy", default="*", help="Comma-separated cogs to load lazily, as LAZY_COGS (default: *).")
+    p.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help=f"JSON results file (default: {DEFAULT_OUTPUT.relative_to(REPO_ROOT)}).")
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    print(
+        f"{report['commands']} slash commands; lazy cogs {', '.join(report['pending']) or '-'}; "
+        f"{len(report['missing_before_materialize'])} missing before they were loaded"
+    )
+    print(
+        f"load: eager {report['eager_load_ms']:.0f}ms, lazy {report['lazy_load_ms']:.0f}ms "
+        f"+ {report['materialize_ms']:.0f}ms to load the lazy cogs before a sync"
+    )
+    for problem in ("failed", "missing", "extra", "differing"):
+        if report[problem]:
+            print(f"{problem}: {', '.join(report[problem])}")
+    print("sync payloads match" if report["match"] else "sync payloads DIFFER")
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Results written to {args.output}")
+    return 0 if report["match"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
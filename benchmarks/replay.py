@@ -0,0 +1,477 @@
+"""
+Gateway event replay: load-test the message listeners without a real gateway.
+
+Usage:
+  python -m benchmarks.replay synthesize [--messages N] [--rate R] [--guilds N] [--channels N]
+                                         [--users N] [--trigger-ratio X] [--attachment-ratio X]
+                                         [--output benchmarks/results/traffic.jsonl]
+  python -m benchmarks.replay record [--duration SECONDS] [--limit N] [--output ...]
+  python -m benchmarks.replay replay [--input ...] [--speed N] [--fast] [--trace-memory]
+                                     [--stub gemini.latency=0.2 ...] [--output benchmarks/results/replay.json]
+
+A traffic file has one JSON event per line: ``{"t": seconds, "type": "MESSAGE_CREATE",
+"d": {...}}``, plus ``GUILD_CREATE`` events for the guilds the messages are in.
+``synthesize`` generates one with Poisson arrivals; ``record`` captures real traffic with
+its own gateway session using TOKEN (message contents are stored as sent, keep the file
+private).
+
+``replay`` starts the real ``DiscordBot`` from ``bot.py`` with every cog. discord.py's
+REST client is pointed at the Discord stand-in of ``benchmarks/stubs.py`` and
+``bot.http_client`` at the Gemini and CDN stand-ins, so nothing leaves the machine. The
+guilds are added to the cache, then every MESSAGE_CREATE is fed to discord.py's own
+parser at ``--speed`` times the recorded rate (0 for as fast as possible), exactly as if
+it came from the gateway. Every task spawned for a message (``on_message``, listeners and
+triggers) is followed until it finishes.
+
+It reports messages/sec processed, listener latency (all messages and the ones that
+fired a trigger), outbound calls per message to Discord, Gemini and the CDN, how far
+injection fell behind schedule, event loop lag and stalls, and memory growth (RSS, the
+message cache and, with --trace-memory, the Python heap).
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextvars
+import dataclasses
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from benchmarks.commands import parse_stub_overrides, percentile
+from benchmarks.stubs import StubUpstreams, message_payload, snowflake, user_payload
+import helpers.config as config_module
+from helpers.config import REPO_ROOT
+from helpers.memory import rss_bytes
+
+RESULTS_DIR = REPO_ROOT / "benchmarks" / "results"
+DEFAULT_TRAFFIC = RESULTS_DIR / "traffic.jsonl"
+DEFAULT_OUTPUT = RESULTS_DIR / "replay.json"
+
+# Synthesized chatter; TRIGGER_WORDS make the ai cog's "neuro" trigger fire.
+WORDS = (
+    "the a is it that lol yeah what when server game play tonight anyone know why how "
+    "just got new update broken fixed works thanks idea minecraft build base ping lag "
+    "music queue song weather hot cold rain tomorrow work school meme image link"
+).split()
+TRIGGER_WORDS = ("neuro", "neurodivergence")
+
+# Fields of GUILD_CREATE kept by the recorder; the rest (members, presences, ...) is
+# not needed to route messages.
+GUILD_FIELDS = ("id", "name", "owner_id", "member_count", "roles", "channels", "features", "large", "icon")
+
+_replayed_message: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("replayed_message", default=None)
+
+
+def read_events(path: Path) -> Iterator[Dict[str, Any]]:
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def guild_payload(guild_id: str, name: str, channel_ids: List[str]) -> Dict[str, Any]:
+    return {
+        "id": guild_id,
+        "name": name,
+        "owner_id": snowflake(),
+        "member_count": 1000,
+        "large": False,
+        "features": [],
+        "icon": None,
+        "roles": [{
+            "id": guild_id, "name": "@everyone", "permissions": "104324673", "position": 0, "color": 0,
+            "hoist": False, "managed": False, "mentionable": False, "flags": 0,
+        }],
+        "channels": [
+            {"id": channel_id, "type": 0, "name": f"channel-{index}", "position": index, "permission_overwrites": []}
+            for index, channel_id in enumerate(channel_ids)
+        ],
+        "emojis": [],
+        "stickers": [],
+    }
+
+
+def synthesize(args: argparse.Namespace) -> int:
+    rng = random.Random(args.seed)
+    guilds = []
+    with args.output.open("w", encoding="utf-8") as f:
+        for index in range(args.guilds):
+            guild_id = snowflake()
+            channel_ids = [snowflake() for _ in range(args.channels)]
+            guilds.append((guild_id, channel_ids))
+            f.write(json.dumps({"t": 0.0, "type": "GUILD_CREATE", "d": guild_payload(guild_id, f"Guild {index}", channel_ids)}) + "\n")
+        users = [user_payload(snowflake(), f"user{index}") for index in range(args.users)]
+
+        t = 0.0
+        triggered = 0
+        for _ in range(args.messages):
+            t += rng.expovariate(args.rate)
+            # A few busy guilds and channels get most of the traffic, like real servers.
+            guild_id, channel_ids = guilds[min(int(rng.paretovariate(1.2)) - 1, len(guilds) - 1)]
+            channel_id = channel_ids[min(int(rng.paretovariate(1.5)) - 1, len(channel_ids) - 1)]
+            words = rng.choices(WORDS, k=rng.randint(1, 25))
+            if rng.random() < args.trigger_ratio:
+                words.insert(rng.randrange(len(words) + 1), rng.choice(TRIGGER_WORDS))
+                triggered += 1
+            attachments = []
+            if rng.random() < args.attachment_ratio:
+                attachment_id = snowflake()
+                attachments.append({
+                    "id": attachment_id,
+                    "filename": "image.png",
+                    "size": 256 * 1024,
+                    "url": f"https://cdn.discordapp.com/attachments/{channel_id}/{attachment_id}/image.png",
+                    "proxy_url": f"https://media.discordapp.net/attachments/{channel_id}/{attachment_id}/image.png",
+                    "content_type": "image/png",
+                })
+            data = message_payload(channel_id, rng.choice(users), " ".join(words), guild_id=guild_id, attachments=attachments)
+            f.write(json.dumps({"t": round(t, 4), "type": "MESSAGE_CREATE", "d": data}) + "\n")
+    print(f"Wrote {args.messages} messages ({triggered} triggering) over {t:.0f}s in {args.guilds} guilds to {args.output}")
+    return 0
+
+
+async def _record(args: argparse.Namespace) -> int:
+    import discord
+
+    from helpers.config import load_config
+
+    config = load_config()
+    if not config.token:
+        raise SystemExit("TOKEN is not set")
+    intents = discord.Intents.default()
+    intents.message_content = True
+    client = discord.Client(intents=intents, enable_debug_events=True, max_messages=None)
+    recorded = 0
+    started: Optional[float] = None
+    done = asyncio.Event()
+
+    with args.output.open("w", encoding="utf-8") as f:
+
+        @client.event
+        async def on_socket_raw_receive(raw: str) -> None:
+            nonlocal recorded, started
+            payload = json.loads(raw)
+            event_type = payload.get("t")
+            if event_type == "GUILD_CREATE":
+                data = {key: payload["d"][key] for key in GUILD_FIELDS if key in payload["d"]}
+                f.write(json.dumps({"t": 0.0, "type": event_type, "d": data}) + "\n")
+            elif event_type == "MESSAGE_CREATE":
+                now = time.monotonic()
+                started = started if started is not None else now
+                f.write(json.dumps({"t": round(now - started, 4), "type": event_type, "d": payload["d"]}) + "\n")
+                recorded += 1
+                if args.limit and recorded >= args.limit:
+                    done.set()
+
+        async with client:
+            runner = asyncio.create_task(client.start(config.token))
+            try:
+                await asyncio.wait_for(done.wait(), timeout=args.duration)
+            except asyncio.TimeoutError:
+                pass
+            await client.close()
+            await asyncio.gather(runner, return_exceptions=True)
+    print(f"Recorded {recorded} messages to {args.output}")
+    return 0
+
+
+@dataclasses.dataclass
+class _Pending:
+    started: float
+    tasks: int = 0
+    triggered: bool = False
+
+
+class ListenerTracker:
+    """
+    Follows every task created while a replayed message is dispatched, and the tasks
+    those create in turn, through a task factory and a context variable. A message is
+    processed when the last of its tasks is done.
+    """
+
+    def __init__(self) -> None:
+        self.pending: Dict[int, _Pending] = {}
+        self.latencies: List[float] = []
+        self.triggered_latencies: List[float] = []
+        self.failures = 0
+        self.last_completed = 0.0
+        self._keys = iter(range(1, sys.maxsize))
+
+    def install(self, loop: asyncio.AbstractEventLoop) -> None:
+        def factory(loop, coro, **kwargs):
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+            context = kwargs.get("context")
+            key = context.get(_replayed_message) if context is not None else _replayed_message.get()
+            pending = self.pending.get(key) if key is not None else None
+            if pending is not None:
+                pending.tasks += 1
+                task.add_done_callback(lambda task, key=key: self._done(key, task))
+            return task
+
+        loop.set_task_factory(factory)
+
+    def inject(self, parser, data: Dict[str, Any]) -> None:
+        key = next(self._keys)
+        self.pending[key] = _Pending(started=time.perf_counter())
+        token = _replayed_message.set(key)
+        try:
+            parser(data)
+        finally:
+            _replayed_message.reset(token)
+        if self.pending[key].tasks == 0:
+            self._complete(key)
+
+    def _done(self, key: int, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self.failures += 1
+        pending = self.pending.get(key)
+        if pending is None:
+            return
+        # Tasks are named after the factory returns, so the name is only checked here.
+        pending.triggered = pending.triggered or task.get_name().startswith("trigger:")
+        pending.tasks -= 1
+        if pending.tasks == 0:
+            self._complete(key)
+
+    def _complete(self, key: int) -> None:
+        pending = self.pending.pop(key)
+        self.last_completed = time.perf_counter()
+        latency = self.last_completed - pending.started
+        self.latencies.append(latency)
+        if pending.triggered:
+            self.triggered_latencies.append(latency)
+
+
+def _latency_summary(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+async def _replay(args: argparse.Namespace, bot_module) -> Dict[str, Any]:
+    import discord
+
+    events = list(read_events(args.input))
+    guilds = [event["d"] for event in events if event["type"] == "GUILD_CREATE"]
+    messages = [event for event in events if event["type"] == "MESSAGE_CREATE"]
+    if not messages:
+        raise SystemExit(f"No MESSAGE_CREATE events in {args.input}")
+
+    stubs = StubUpstreams(parse_stub_overrides(args.stub), latency_scale=args.latency_scale, seed=args.seed)
+    await stubs.start()
+    discord.http.Route.BASE = stubs.discord_base()
+
+    tracker = ListenerTracker()
+    tracker.install(asyncio.get_running_loop())
+    bot = bot_module.DiscordBot()
+    bot.http_client.upstreams = stubs.upstreams()
+    bot.config = dataclasses.replace(bot.config, **stubs.config())
+    # The key pool was built from the configuration before it pointed at the stand-ins.
+    bot.gemini_keys.update(bot.config.gemini_keys)
+    await bot.login("bench-token")
+    state = bot._connection
+    for data in guilds:
+        state._add_guild_from_data(data)
+    parser = state.parsers["MESSAGE_CREATE"]
+
+    if args.trace_memory:
+        tracemalloc.start()
+    rss_start = rss_peak = rss_bytes()
+    stop_sampling = asyncio.Event()
+
+    async def sample_rss() -> None:
+        nonlocal rss_peak
+        while not stop_sampling.is_set():
+            rss_peak = max(rss_peak, rss_bytes())
+            try:
+                await asyncio.wait_for(stop_sampling.wait(), timeout=0.25)
+            except asyncio.TimeoutError:
+                pass
+
+    sampler = asyncio.create_task(sample_rss())
+    stubs.requests.clear()
+    stubs.discord_routes.clear()
+    first = messages[0]["t"]
+    behind = 0.0
+    started = time.perf_counter()
+    try:
+        for index, event in enumerate(messages):
+            if args.speed > 0:
+                delay = started + (event["t"] - first) / args.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    behind = max(behind, -delay)
+            tracker.inject(parser, event["d"])
+            if args.speed <= 0 or index % 50 == 0:
+                # Let the listeners run between injections, as gateway reads would.
+                await asyncio.sleep(0)
+        injected = time.perf_counter()
+
+        deadline = injected + args.drain_timeout
+        while tracker.pending and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+    finally:
+        stop_sampling.set()
+        await sampler
+        rss_end = rss_bytes()
+        heap = tracemalloc.get_traced_memory() if args.trace_memory else None
+        if args.trace_memory:
+            tracemalloc.stop()
+        lag_p99 = bot.loop_monitor.lag_percentile(0.99)
+        stalls = dict(bot.loop_monitor.stall_counts)
+        cached_messages = len(state._messages) if state._messages is not None else 0
+        await bot.close()
+        await stubs.close()
+
+    count = len(messages)
+    processed = len(tracker.latencies)
+    elapsed = (tracker.last_completed or time.perf_counter()) - started
+    per_message = lambda value: round(value / count, 3)
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "runtime": bot.runtime.describe(),
+        "input": str(args.input),
+        "speed": args.speed,
+        "latency_scale": args.latency_scale,
+        "guilds": len(guilds),
+        "messages": count,
+        "processed": processed,
+        "unfinished": len(tracker.pending),
+        "listener_failures": tracker.failures,
+        "recorded_duration_s": round(messages[-1]["t"] - first, 2),
+        "injection_s": round(injected - started, 2),
+        "elapsed_s": round(elapsed, 2),
+        "messages_per_second": round(processed / elapsed, 2) if elapsed > 0 else None,
+        "max_behind_schedule_ms": round(behind * 1000, 1),
+        "latency": _latency_summary(tracker.latencies),
+        "triggered_latency": _latency_summary(tracker.triggered_latencies),
+        "outbound_per_message": {name: per_message(value) for name, value in stubs.requests.items()},
+        "context_cache": {
+            "hit_rate": round(bot.gemini_context.stats.hit_rate, 3),
+            **dataclasses.asdict(bot.gemini_context.stats),
+            "gemini_input_tokens": stubs.tokens["prompt"],
+            "gemini_cached_tokens": stubs.tokens["cached"],
+        },
+        "discord_routes": dict(stubs.discord_routes),
+        "upstream_errors": dict(stubs.errors),
+        "loop_lag_p99_ms": round(lag_p99 * 1000, 1),
+        "loop_stalls": stalls,
+        "memory": {
+            "rss_start_mb": round(rss_start / 2**20, 1),
+            "rss_end_mb": round(rss_end / 2**20, 1),
+            "rss_peak_mb": round(rss_peak / 2**20, 1),
+            "rss_growth_mb": round((rss_end - rss_start) / 2**20, 1),
+            "heap_end_mb": round(heap[0] / 2**20, 1) if heap else None,
+            "heap_peak_mb": round(heap[1] / 2**20, 1) if heap else None,
+            "cached_messages": cached_messages,
+        },
+        "stubs": stubs.describe(),
+    }
+
+
+def replay(args: argparse.Namespace) -> int:
+    # bot.py reads its configuration when imported: keep the benchmark away from the
+    # production log file, state database, metrics port, logging channel and cluster settings.
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    overrides = {
+        "LOG_FILE": str(RESULTS_DIR / "replay.log"),
+        "STATE_DB": ":memory:",
+        "METRICS_PORT": "",
+        "LOGGING_CHANNEL": "",
+        "STATUSES": "",
+        "SHARDING": "false",
+        "SHARD_COUNT": "",
+        "SHARD_IDS": "",
+        "CLUSTER_ID": "",
+        "CLUSTER_IPC_ADDRESS": "",
+        "FAST_RUNTIME": "true" if args.fast else "false",
+    }
+    os.environ.update(overrides)
+    # helpers.config snapshots the environment when it is first imported, which already
+    # happened through benchmarks.commands.
+    config_module._PROCESS_ENV.update(overrides)
+    import bot as bot_module
+
+    report = asyncio.run(_replay(args, bot_module))
+    args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    latency, triggered = report["latency"], report["triggered_latency"]
+    print(f"\nReplayed {report['messages']} messages from {report['guilds']} guilds at {args.speed:g}x")
+    print(f"  processed        {report['processed']} ({report['unfinished']} unfinished, {report['listener_failures']} listener failures)")
+    print(f"  throughput       {report['messages_per_second']} msg/s, at most {report['max_behind_schedule_ms']}ms behind schedule")
+    print(f"  latency          p50 {latency['p50_ms']}ms  p95 {latency['p95_ms']}ms  p99 {latency['p99_ms']}ms  max {latency['max_ms']}ms")
+    print(f"  triggered ({triggered['count']:>4})  p50 {triggered['p50_ms']}ms  p95 {triggered['p95_ms']}ms  p99 {triggered['p99_ms']}ms")
+    print(f"  outbound/msg     {', '.join(f'{k} {v:g}' for k, v in report['outbound_per_message'].items()) or '-'}")
+    cache = report["context_cache"]
+    print(
+        f"  context cache    {cache['hit_rate']:.0%} hit rate, {cache['created']} created, "
+        f"{cache['gemini_cached_tokens']} of {cache['gemini_input_tokens']} Gemini input tokens cached"
+    )
+    print(f"  event loop       lag p99 {report['loop_lag_p99_ms']}ms, stalls {sum(report['loop_stalls'].values())}")
+    memory = report["memory"]
+    print(f"  memory           RSS {memory['rss_start_mb']} -> {memory['rss_end_mb']}MB (peak {memory['rss_peak_mb']}MB), {memory['cached_messages']} cached messages")
+    print(f"\nResults written to {args.output}")
+    return 0
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Record, synthesize and replay gateway message traffic.")
+    sub = p.add_subparsers(dest="action", required=True)
+
+    s = sub.add_parser("synthesize", help="Generate a traffic file.")
+    s.add_argument("--messages", type=int, default=5000, help="Number of messages (default: 5000).")
+    s.add_argument("--rate", type=float, default=20.0, help="Average messages per second (default: 20).")
+    s.add_argument("--guilds", type=int, default=20, help="Number of guilds (default: 20).")
+    s.add_argument("--channels", type=int, default=10, help="Text channels per guild (default: 10).")
+    s.add_argument("--users", type=int, default=500, help="Number of distinct authors (default: 500).")
+    s.add_argument("--trigger-ratio", type=float, default=0.01, help="Share of messages that fire the neuro trigger (default: 0.01).")
+    s.add_argument("--attachment-ratio", type=float, default=0.05, help="Share of messages with an image attachment (default: 0.05).")
+    s.add_argument("--seed", type=int, default=None)
+    s.add_argument("--output", type=Path, default=DEFAULT_TRAFFIC)
+
+    r = sub.add_parser("record", help="Record live traffic with a separate gateway session (uses TOKEN).")
+    r.add_argument("--duration", type=float, default=600.0, help="Seconds to record (default: 600).")
+    r.add_argument("--limit", type=int, default=None, help="Stop after this many messages.")
+    r.add_argument("--output", type=Path, default=DEFAULT_TRAFFIC)
+
+    y = sub.add_parser("replay", help="Replay a traffic file into the bot.")
+    y.add_argument("--input", type=Path, default=DEFAULT_TRAFFIC)
+    y.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier, 0 for as fast as possible (default: 1).")
+    y.add_argument("--stub", action="append", default=[], help="Stand-in setting, e.g. gemini.latency=0.2 (repeatable).")
+    y.add_argument("--latency-scale", type=float, default=1.0, help="Multiply every stand-in latency.")
+    y.add_argument("--drain-timeout", type=float, default=120.0, help="Seconds to wait for listeners after the last message.")
+    y.add_argument("--seed", type=int, default=None)
+    y.add_argument("--fast", action="store_true", help="Use the FAST_RUNTIME profile (uvloop/orjson when installed).")
+    y.add_argument("--trace-memory", action="store_true", help="Also measure the Python heap with tracemalloc (slow).")
+    y.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if getattr(args, "output", None) is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+    if args.action == "synthesize":
+        return synthesize(args)
+    if args.action == "record":
+        return asyncio.run(_record(args))
+    return replay(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
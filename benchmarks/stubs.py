@@ -0,0 +1,597 @@
+"""
+Local stand-ins for every upstream the commands call, for offline benchmarks.
+
+``StubUpstreams`` serves all HTTP upstreams from one aiohttp app, each under its own
+path prefix (``/gemini``, ``/bom``, ...), plus a Minecraft Server List Ping server on a
+separate TCP port. Every upstream has its own ``StubSettings``: the latency (and jitter)
+added before answering, the share of requests that fail and the size of the payload, so
+e.g. a Stable Diffusion image or a Shodan result set can be made as large as production.
+
+``upstreams()`` returns the URL prefix overrides for ``HTTPClient(upstreams=...)`` and
+``config()`` the host settings that point the AI cogs at the stand-ins. ``discord_base()``
+is a minimal Discord REST API (login, channel history, sending, editing and deleting
+messages) for discord.py's own HTTP client; it does not enforce rate limits.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import collections
+import io
+import itertools
+import json
+import random
+import re
+import time
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from aiohttp import web
+from PIL import Image
+
+
+@dataclass
+class StubSettings:
+    """
+    :param latency: Seconds waited before answering.
+    :param jitter: Up to this many seconds are added to the latency at random.
+    :param error_rate: Share of requests (0-1) answered with ``error_status``.
+    :param error_status: The status of failed requests; Minecraft closes the connection.
+    :param payload_size: Approximate size of the response in bytes (images, pages, results).
+    """
+
+    latency: float = 0.05
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    payload_size: int = 4 * 1024
+
+
+DEFAULT_SETTINGS: Dict[str, StubSettings] = {
+    "gemini": StubSettings(latency=0.8, jitter=0.4, error_status=429, payload_size=2 * 1024),
+    "lmstudio": StubSettings(latency=1.5, jitter=0.5, payload_size=2 * 1024),
+    "auto1111": StubSettings(latency=3.0, jitter=1.0, payload_size=1024 * 1024),
+    "bom": StubSettings(latency=0.15, jitter=0.05, payload_size=60 * 1024),
+    "fuelprice": StubSettings(latency=0.2, jitter=0.05, payload_size=40 * 1024),
+    "shodan": StubSettings(latency=0.5, jitter=0.2, payload_size=512 * 1024),
+    "internetdb": StubSettings(latency=0.05, jitter=0.02, payload_size=512),
+    "qrng": StubSettings(latency=0.1, jitter=0.05, payload_size=64),
+    "cdn": StubSettings(latency=0.05, jitter=0.02, payload_size=256 * 1024),
+    "minecraft": StubSettings(latency=0.02, jitter=0.01, payload_size=1024),
+    # payload_size is the length of the content of the messages returned as history.
+    "discord": StubSettings(latency=0.08, jitter=0.04, payload_size=80),
+}
+
+# Which production URL prefix each HTTP stand-in replaces. LM Studio and AUTO1111 are
+# configured hosts, see ``StubUpstreams.config()``.
+UPSTREAM_PREFIXES: Dict[str, str] = {
+    "gemini": "https://generativelanguage.googleapis.com",
+    "bom": "http://reg.bom.gov.au",
+    "fuelprice": "https://fuelprice.io",
+    "shodan": "https://api.shodan.io",
+    "internetdb": "https://internetdb.shodan.io",
+    "qrng": "http://qrng.anu.edu.au",
+    "cdn": "https://cdn.discordapp.com",
+}
+
+
+DISCORD_EPOCH = 1420070400000
+_increments = itertools.count()
+
+
+def snowflake() -> str:
+    return str(((int(time.time() * 1000) - DISCORD_EPOCH) << 22) | (next(_increments) & 0x3FFFFF))
+
+
+def user_payload(user_id: str, name: str, *, bot: bool = False) -> Dict[str, Any]:
+    return {"id": user_id, "username": name, "global_name": None, "discriminator": "0", "avatar": None, "bot": bot}
+
+
+def message_payload(
+    channel_id: str,
+    author: Dict[str, Any],
+    content: str,
+    *,
+    message_id: Optional[str] = None,
+    guild_id: Optional[str] = None,
+    attachments: Iterable[Dict[str, Any]] = (),
+) -> Dict[str, Any]:
+    """
+    A MESSAGE_CREATE payload (also the shape of the REST message object).
+    """
+    payload = {
+        "id": message_id or snowflake(),
+        "channel_id": channel_id,
+        "author": author,
+        "content": content,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S.000000+00:00", time.gmtime()),
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": list(attachments),
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+        "flags": 0,
+    }
+    if guild_id is not None:
+        payload["guild_id"] = guild_id
+        payload["member"] = {"roles": [], "joined_at": payload["timestamp"], "deaf": False, "mute": False, "flags": 0}
+    return payload
+
+
+def _filler_html(size: int) -> str:
+    # Real pages are mostly navigation and markup the scrapers have to parse past.
+    block = '<div class="nav-item"><a href="/x">Link</a><p>Lorem ipsum dolor sit amet, consectetur.</p></div>\n'
+    return block * max(0, size // len(block))
+
+
+class StubUpstreams:
+    """
+    :param settings: Per-upstream overrides of ``DEFAULT_SETTINGS``.
+    :param latency_scale: Multiplies every latency and jitter, e.g. ``0`` for CPU-only runs.
+    :param seed: Seed of the error injection and jitter.
+    """
+
+    def __init__(self, settings: Optional[Dict[str, StubSettings]] = None, *, latency_scale: float = 1.0, seed: Optional[int] = None) -> None:
+        self.settings: Dict[str, StubSettings] = {name: replace(value) for name, value in DEFAULT_SETTINGS.items()}
+        self.settings.update(settings or {})
+        self.latency_scale = latency_scale
+        self.requests: Dict[str, int] = collections.Counter()
+        self.errors: Dict[str, int] = collections.Counter()
+        self.discord_routes: Dict[str, int] = collections.Counter()
+        self.bot_user = user_payload(snowflake(), "bench-bot", bot=True)
+        self.base_url = ""
+        self.minecraft_address = ""
+        self._random = random.Random(seed)
+        self._payloads: Dict[Tuple[str, int], bytes] = {}
+        # Files API: upload ID -> (declared size, mime type), and file name -> file.
+        self._uploads: Dict[str, Tuple[int, str]] = {}
+        self._files: Dict[str, Dict[str, Any]] = {}
+        # cachedContents: name -> (prefix tokens, expiry as a Unix timestamp)
+        self._caches: Dict[str, Tuple[int, float]] = {}
+        # Input tokens of the generate requests, "prompt" and "cached" (served from caches).
+        self.tokens: Dict[str, int] = collections.Counter()
+        self._runner: Optional[web.AppRunner] = None
+        self._minecraft: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1") -> None:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        handlers = {
+            "gemini": self._gemini,
+            "lmstudio": self._lmstudio,
+            "auto1111": self._auto1111,
+            "bom": self._bom,
+            "fuelprice": self._fuelprice,
+            "shodan": self._shodan,
+            "internetdb": self._internetdb,
+            "qrng": self._qrng,
+            "cdn": self._cdn,
+            "discord": self._discord,
+        }
+        for name, handler in handlers.items():
+            app.router.add_route("*", f"/{name}/{{tail:.*}}", self._wrap(name, handler))
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+
+        self._minecraft = await asyncio.start_server(self._minecraft_client, host, 0)
+        self.minecraft_address = f"{host}:{self._minecraft.sockets[0].getsockname()[1]}"
+
+    async def close(self) -> None:
+        if self._minecraft is not None:
+            self._minecraft.close()
+            await self._minecraft.wait_closed()
+            self._minecraft = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def upstreams(self) -> Dict[str, str]:
+        """
+        The URL prefix overrides for ``HTTPClient(upstreams=...)``.
+        """
+        return {prefix: f"{self.base_url}/{name}" for name, prefix in UPSTREAM_PREFIXES.items()}
+
+    def discord_base(self) -> str:
+        """
+        The value for ``discord.http.Route.BASE``.
+        """
+        return f"{self.base_url}/discord/api/v10"
+
+    def config(self) -> Dict[str, object]:
+        """
+        ``Config`` fields that point the cogs at the stand-ins.
+        """
+        return {
+            "gemini_keys": ("bench-key-1", "bench-key-2", "bench-key-3"),
+            "lms_hosts": (f"{self.base_url}/lmstudio",),
+            "auto1111_hosts": (f"{self.base_url}/auto1111",),
+            "shodan_key": "bench-key",
+        }
+
+    def describe(self) -> Dict[str, dict]:
+        return {name: asdict(value) for name, value in self.settings.items()}
+
+    async def _delay(self, settings: StubSettings) -> None:
+        delay = (settings.latency + self._random.uniform(0, settings.jitter)) * self.latency_scale
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _fails(self, settings: StubSettings) -> bool:
+        return settings.error_rate > 0 and self._random.random() < settings.error_rate
+
+    def _wrap(self, name: str, handler):
+        async def handle(request: web.Request) -> web.StreamResponse:
+            settings = self.settings[name]
+            self.requests[name] += 1
+            streamed = request.query.get("alt") == "sse"
+            # A streamed answer spreads its latency over its chunks instead.
+            if not streamed:
+                await self._delay(settings)
+            if self._fails(settings):
+                self.errors[name] += 1
+                return web.json_response({"error": {"code": settings.error_status, "message": f"Injected {name} error"}}, status=settings.error_status)
+            return await handler(request, settings)
+
+        return handle
+
+    def _payload(self, kind: str, size: int, build) -> bytes:
+        # Payloads are built once per size, the benchmark measures the bot, not the stub.
+        key = (kind, size)
+        payload = self._payloads.get(key)
+        if payload is None:
+            payload = build(size)
+            self._payloads[key] = payload
+        return payload
+
+    def _text(self, size: int) -> str:
+        sentence = "THIS IS A STUB RESPONSE WITH PLENTY OF WORDS 🌶️✨ "
+        return (sentence * max(1, size // len(sentence)))[: max(1, size)]
+
+    async def _gemini(self, request: web.Request, settings: StubSettings) -> web.StreamResponse:
+        if "/files" in request.path:
+            return await self._gemini_files(request)
+        if "/cachedContents" in request.path:
+            return await self._gemini_caches(request)
+        body = await request.json()
+        # Four characters per token, like the key pool's estimate.
+        prompt_tokens = self._text_length(body.get("system_instruction")) // 4 + self._text_length(body.get("contents")) // 4
+        cached_tokens = 0
+        if "cachedContent" in body:
+            cached = self._caches.get(body["cachedContent"])
+            if cached is None or cached[1] < time.time():
+                return web.json_response({"error": {"code": 403, "message": "CachedContent not found (or permission denied)"}}, status=403)
+            cached_tokens = cached[0]
+        self.tokens["prompt"] += prompt_tokens + cached_tokens
+        self.tokens["cached"] += cached_tokens
+        if request.query.get("alt") == "sse":
+            usage = {"promptTokenCount": prompt_tokens + cached_tokens}
+            if cached_tokens:
+                usage["cachedContentTokenCount"] = cached_tokens
+            return await self._gemini_stream(request, settings, usage)
+        body = self._payload("gemini", settings.payload_size, lambda size: json.dumps({
+            "candidates": [{"content": {"parts": [{"text": self._text(min(size, 4000))}], "role": "model"}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": 100, "candidatesTokenCount": size // 4},
+        }).encode())
+        return web.Response(body=body, content_type="application/json")
+
+    async def _gemini_stream(self, request: web.Request, settings: StubSettings, usage: Dict[str, int], chunks: int = 10) -> web.StreamResponse:
+        """
+        streamGenerateContent: the text in ``chunks`` server-sent events, the first after a
+        tenth of the latency and the others spread over the rest, like a model generating.
+        """
+        text = self._text(min(settings.payload_size, 4000))
+        size = -(-len(text) // chunks)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        delay = (settings.latency + self._random.uniform(0, settings.jitter)) * self.latency_scale
+        for index in range(chunks):
+            await asyncio.sleep(delay / 10 if index == 0 else delay * 0.9 / (chunks - 1))
+            event = {"candidates": [{"content": {"parts": [{"text": text[index * size:(index + 1) * size]}], "role": "model"}}]}
+            if index == chunks - 1:
+                event["candidates"][0]["finishReason"] = "STOP"
+                event["usageMetadata"] = {
+                    **usage,
+                    "candidatesTokenCount": len(text) // 4,
+                    "totalTokenCount": usage["promptTokenCount"] + len(text) // 4,
+                }
+            await response.write(b"data: " + json.dumps(event).encode() + b"\r\n\r\n")
+        await response.write_eof()
+        return response
+
+    @classmethod
+    def _text_length(cls, value: Any) -> int:
+        # Characters of the "text" parts anywhere in a request body.
+        if isinstance(value, dict):
+            return sum(len(item) if key == "text" and isinstance(item, str) else cls._text_length(item) for key, item in value.items())
+        if isinstance(value, list):
+            return sum(cls._text_length(item) for item in value)
+        return 0
+
+    async def _gemini_caches(self, request: web.Request) -> web.Response:
+        """
+        cachedContents: create (refused under 1024 tokens, like Gemini), extend the ttl of
+        and delete cached prefixes.
+        """
+        name = "cachedContents/" + request.path.rpartition("/cachedContents")[2].strip("/")
+        if request.method == "DELETE":
+            self._caches.pop(name, None)
+            return web.json_response({})
+        body = await request.json()
+        ttl = float(str(body.get("ttl", "3600s")).rstrip("s"))
+        if request.method == "POST":
+            tokens = (self._text_length(body.get("systemInstruction")) + self._text_length(body.get("contents"))) // 4
+            if tokens < 1024:
+                message = f"Cached content is too small. total_token_count={tokens}, min_total_token_count=1024"
+                return web.json_response({"error": {"code": 400, "message": message}}, status=400)
+            name = f"cachedContents/{snowflake()}"
+        elif name in self._caches:
+            tokens = self._caches[name][0]
+        else:
+            return web.json_response({"error": {"code": 404, "message": "Not found"}}, status=404)
+        self._caches[name] = (tokens, time.time() + ttl)
+        return web.json_response({
+            "name": name,
+            "model": body.get("model"),
+            "expireTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + ttl)),
+            "usageMetadata": {"totalTokenCount": tokens},
+        })
+
+    async def _gemini_files(self, request: web.Request) -> web.Response:
+        """
+        The Files API: resumable uploads (a start request, then a single "upload, finalize"
+        request with the content) and ``files/{id}`` lookups. Videos are PROCESSING until
+        they are first looked up.
+        """
+        command = request.headers.get("X-Goog-Upload-Command", "")
+        if request.method == "POST" and command == "start":
+            await request.read()
+            upload_id = snowflake()
+            self._uploads[upload_id] = (
+                int(request.headers["X-Goog-Upload-Header-Content-Length"]),
+                request.headers["X-Goog-Upload-Header-Content-Type"],
+            )
+            return web.Response(headers={
+                "X-Goog-Upload-URL": f"{self.base_url}/gemini/upload/v1beta/files?upload_id={upload_id}",
+                "X-Goog-Upload-Status": "active",
+            })
+        if request.method == "POST" and "finalize" in command:
+            upload = self._uploads.pop(request.query.get("upload_id", ""), None)
+            if upload is None:
+                return web.json_response({"error": {"code": 404, "message": "Unknown upload"}}, status=404)
+            size, mime_type = upload
+            received = 0
+            async for chunk in request.content.iter_chunked(64 * 1024):
+                received += len(chunk)
+            if received != size:
+                return web.json_response({"error": {"code": 400, "message": f"Received {received} of {size} bytes"}}, status=400)
+            name = f"files/{snowflake()}"
+            self._files[name] = {
+                "name": name,
+                "uri": f"{UPSTREAM_PREFIXES['gemini']}/v1beta/{name}",
+                "mimeType": mime_type,
+                "sizeBytes": str(size),
+                "state": "PROCESSING" if mime_type.startswith("video/") else "ACTIVE",
+                "expirationTime": time.strftime("%Y-%m-%dT%H:%M:%S.000000000Z", time.gmtime(time.time() + 48 * 3600)),
+            }
+            return web.json_response({"file": self._files[name]})
+        file = self._files.get(request.path.split("/v1beta/", 1)[-1])
+        if file is None:
+            return web.json_response({"error": {"code": 404, "message": "File not found"}}, status=404)
+        file["state"] = "ACTIVE"
+        return web.json_response(file)
+
+    async def _lmstudio(self, request: web.Request, settings: StubSettings) -> web.Response:
+        await request.read()
+        body = self._payload("lmstudio", settings.payload_size, lambda size: json.dumps({
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": self._text(min(size, 4000))}, "finish_reason": "stop"}],
+        }).encode())
+        return web.Response(body=body, content_type="application/json")
+
+    async def _auto1111(self, request: web.Request, settings: StubSettings) -> web.Response:
+        await request.read()
+        # Random bytes do not compress, like a real JPEG.
+        body = self._payload("auto1111", settings.payload_size, lambda size: json.dumps({
+            "images": [base64.b64encode(random.randbytes(size)).decode("ascii")],
+            "parameters": {},
+            "info": "{}",
+        }).encode())
+        return web.Response(body=body, content_type="application/json")
+
+    async def _bom(self, request: web.Request, settings: StubSettings) -> web.Response:
+        body = self._payload("bom", settings.payload_size, lambda size: (
+            "<html><body>" + _filler_html(size) +
+            '<div class="day main"><h2>Forecast for the rest of Today</h2><dl><dd class="summary">Partly cloudy.</dd></dl>'
+            '<em class="max">24</em><em class="pop">30%</em><p>Partly cloudy. Slight chance of a shower.</p></div>'
+            "</body></html>"
+        ).encode())
+        return web.Response(body=body, content_type="text/html")
+
+    async def _fuelprice(self, request: web.Request, settings: StubSettings) -> web.Response:
+        def build(size: int) -> bytes:
+            stations = "".join(f"<li><strong>Servo {index}</strong> {180 + index}.9</li>" for index in range(10))
+            return ("<html><body>" + _filler_html(size) + f'<ul class="cheapest-stations">{stations}</ul></body></html>').encode()
+
+        return web.Response(body=self._payload("fuelprice", settings.payload_size, build), content_type="text/html")
+
+    async def _shodan(self, request: web.Request, settings: StubSettings) -> web.Response:
+        def build(size: int) -> bytes:
+            count = 100
+            screenshot = base64.b64encode(random.randbytes(max(1, size // count * 3 // 4))).decode("ascii")
+            matches = [
+                {
+                    "ip_str": f"10.0.{index // 256}.{index % 256}",
+                    "port": 25565 if index % 2 else 80,
+                    "org": "Stub Networks",
+                    "product": "stub",
+                    "asn": "AS64500",
+                    "hostnames": [f"host{index}.example"],
+                    "domains": ["example"],
+                    "transport": "tcp",
+                    "timestamp": "2024-01-01T00:00:00",
+                    "location": {"country_name": "Australia", "region_code": "SA", "city": "Adelaide"},
+                    "data": "HTTP/1.1 200 OK\r\nServer: stub\r\n\r\n",
+                    "screenshot": {"mime": "image/jpeg", "data": screenshot},
+                }
+                for index in range(count)
+            ]
+            return json.dumps({"matches": matches, "total": count}).encode()
+
+        return web.Response(body=self._payload("shodan", settings.payload_size, build), content_type="application/json")
+
+    async def _internetdb(self, request: web.Request, settings: StubSettings) -> web.Response:
+        return web.json_response({
+            "ip": request.match_info["tail"],
+            "hostnames": ["stub.example"],
+            "ports": [22, 80, 443],
+            "tags": [],
+            "cpes": ["cpe:/a:openbsd:openssh"],
+            "vulns": [],
+        })
+
+    async def _qrng(self, request: web.Request, settings: StubSettings) -> web.Response:
+        return web.json_response({"type": "uint8", "length": 1, "data": [self._random.randint(0, 255)], "success": True})
+
+    async def _cdn(self, request: web.Request, settings: StubSettings) -> web.Response:
+        # ``?size=`` overrides the payload size; files other than PNGs are random bytes.
+        size = int(request.query.get("size", settings.payload_size))
+        if not request.path.endswith(".png"):
+            # Written in chunks, as a large body written at once is copied into the
+            # transport's buffer.
+            body = memoryview(self._payload("cdn-file", size, random.randbytes))
+            response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+            response.content_length = size
+            await response.prepare(request)
+            try:
+                for start in range(0, size, 256 * 1024):
+                    await response.write(body[start:start + 256 * 1024])
+                await response.write_eof()
+            except ConnectionError:
+                # The client gave up on the download, e.g. its upload was refused.
+                pass
+            return response
+        body = self._payload("cdn", size, self._png)
+        return web.Response(body=body, content_type="image/png")
+
+    @staticmethod
+    def _png(size: int) -> bytes:
+        """
+        A PNG of random pixels (which do not compress, like a photo) of exactly ``size``
+        bytes, padded after its end.
+        """
+        side = max(1, int((size / 3.1) ** 0.5))
+        out = io.BytesIO()
+        Image.frombytes("RGB", (side, side), random.randbytes(side * side * 3)).save(out, "PNG", compress_level=1)
+        png = out.getvalue()
+        return png + bytes(max(0, size - len(png)))
+
+    @staticmethod
+    def _discord_json(data: Any, status: int = 200) -> web.Response:
+        # discord.py only decodes bodies whose Content-Type is exactly application/json.
+        return web.Response(body=json.dumps(data).encode(), status=status, content_type="application/json")
+
+    async def _discord(self, request: web.Request, settings: StubSettings) -> web.Response:
+        path = request.match_info["tail"].removeprefix("api/v10")
+        route = f"{request.method} {re.sub(r'/[0-9]{15,}', '/{id}', path)}"
+        self.discord_routes[route] += 1
+        parts = path.strip("/").split("/")
+
+        if route == "GET /users/@me":
+            return self._discord_json(self.bot_user)
+        if route == "GET /oauth2/applications/@me":
+            return self._discord_json({
+                "id": self.bot_user["id"],
+                "name": "bench",
+                "description": "",
+                "icon": None,
+                "bot_public": True,
+                "bot_require_code_grant": False,
+                "owner": user_payload(snowflake(), "bench-owner"),
+                "verify_key": "0" * 64,
+                "flags": 0,
+            })
+        if route == "GET /channels/{id}/messages":
+            limit = min(100, int(request.query.get("limit", 50)))
+            body = self._payload(f"history{limit}", settings.payload_size, lambda size: json.dumps([
+                message_payload(parts[1], user_payload(str(1000 + index % 7), f"user{index % 7}"), self._text(size))
+                for index in range(limit)
+            ]).encode())
+            return web.Response(body=body, content_type="application/json")
+        if route in ("POST /channels/{id}/messages", "PATCH /channels/{id}/messages/{id}"):
+            content = ""
+            if request.content_type == "application/json":
+                content = (await request.json()).get("content") or ""
+            else:
+                await request.read()
+            message_id = parts[3] if len(parts) > 3 else None
+            return self._discord_json(message_payload(parts[1], self.bot_user, content, message_id=message_id))
+        if request.method == "DELETE" or route.startswith("POST /channels/{id}/typing"):
+            return web.Response(status=204)
+        return self._discord_json({"message": "Unknown route", "code": 0}, status=404)
+
+    @staticmethod
+    async def _read_varint(reader: asyncio.StreamReader) -> int:
+        value = 0
+        for shift in range(0, 35, 7):
+            byte = (await reader.readexactly(1))[0]
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value
+        raise ValueError("VarInt is too big")
+
+    @staticmethod
+    def _varint(value: int) -> bytes:
+        out = bytearray()
+        while True:
+            byte = value & 0x7F
+            value >>= 7
+            if value:
+                out.append(byte | 0x80)
+            else:
+                out.append(byte)
+                return bytes(out)
+
+    def _packet(self, packet_id: int, payload: bytes) -> bytes:
+        data = self._varint(packet_id) + payload
+        return self._varint(len(data)) + data
+
+    async def _minecraft_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        settings = self.settings["minecraft"]
+        self.requests["minecraft"] += 1
+        try:
+            while True:
+                length = await self._read_varint(reader)
+                data = await reader.readexactly(length)
+                packet_id, payload = data[0], data[1:]
+                if packet_id == 0 and payload:
+                    continue  # handshake
+                if packet_id == 0:
+                    await self._delay(settings)
+                    if self._fails(settings):
+                        self.errors["minecraft"] += 1
+                        return
+                    players = max(1, settings.payload_size // 64)
+                    status = json.dumps({
+                        "version": {"name": "1.20.1", "protocol": 763},
+                        "players": {
+                            "max": 100,
+                            "online": players,
+                            "sample": [{"name": f"player{index}", "id": f"00000000-0000-0000-0000-{index:012d}"} for index in range(min(players, 12))],
+                        },
+                        "description": {"text": "§aA stub Minecraft server"},
+                    }).encode()
+                    writer.write(self._packet(0, self._varint(len(status)) + status))
+                elif packet_id == 1:
+                    writer.write(self._packet(1, payload[:8].ljust(8, b"\0")))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
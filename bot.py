@@ -1,111 +1,105 @@
-import json
+import time
+
+# Taken before any heavy import so the time to READY below covers the whole startup.
+_PROCESS_STARTED = time.perf_counter()
+
+import asyncio
+import atexit
 import logging
 import os
 import platform
 import random
+import signal
+import sys
 from pathlib import Path
 
-_REPO_ROOT = Path(__file__).resolve().parent
-
-
-def _load_repo_dotenv() -> None:
-    """
-    Load a repo-root .env into os.environ without overwriting existing variables.
-    Matches the behavior of refreshcmds.py so MUSIC_LOCAL_DIR and TOKEN work when
-    running `python bot.py` without manually exporting every key.
-    """
-    env_path = _REPO_ROOT / ".env"
-    if not env_path.is_file():
-        return
-
-    def _strip_quotes(value: str) -> str:
-        value = value.strip()
-        if len(value) >= 2 and ((value[0] == value[-1] == '"') or (value[0] == value[-1] == "'")):
-            return value[1:-1]
-        return value
-
-    for raw_line in env_path.read_text(encoding="utf-8").splitlines():
-        line = raw_line.strip()
-        if not line or line.startswith("#"):
-            continue
-        if "=" not in line:
-            continue
-        key, value = line.split("=", 1)
-        key = key.strip()
-        value = _strip_quotes(value)
-        if not key:
-            continue
-        os.environ.setdefault(key, value)
-
-
-_load_repo_dotenv()
+from helpers.config import Config, ConfigError, load_config
+
+# Load and validate the configuration before anything else so that malformed values
+# (e.g. AUTO1111_HOSTS that is not valid JSON) stop the bot at startup with a clear
+# message instead of crashing a cog later. The repo-root .env is applied to os.environ
+# without overwriting existing variables.
+try:
+    config = load_config()
+except ConfigError as e:
+    sys.exit("Invalid configuration:\n- " + "\n- ".join(e.problems))
 
 import discord
 from discord.ext import commands, tasks
 from discord.ext.commands import Context
 
+from helpers.audit import AuditSink
+from helpers.cache import CacheRegistry
+from helpers.extensions import ExtensionLoader, LazyCommandTree
+from helpers.gemini_context import ContextCache
+from helpers.gemini_files import GeminiFiles
+from helpers.http import HTTPClient
+from helpers.ipc import IPCClient
+from helpers.lifecycle import TaskTracker, TrackedContext
+from helpers.limiter import AdmissionController, AdmissionRejected
+from helpers.logger import setup_logging
+from helpers.history import ChannelHistory
+from helpers.keypool import KeyPool
+from helpers.loopmonitor import LoopMonitor
+from helpers.media import MediaProcessor
+from helpers.memory import MemoryBudget
+from helpers.metrics import BotMetrics
+from helpers.runtime import install_runtime
+from helpers.store import Store
+from helpers.triggers import TriggerDispatcher
+
 intents = discord.Intents.default()
 intents.message_content = True
 intents.voice_states = True
 
-# Setup both of the loggers
-
-
-class LoggingFormatter(logging.Formatter):
-    # Colors
-    black = "\x1b[30m"
-    red = "\x1b[31m"
-    green = "\x1b[32m"
-    yellow = "\x1b[33m"
-    blue = "\x1b[34m"
-    gray = "\x1b[38m"
-    # Styles
-    reset = "\x1b[0m"
-    bold = "\x1b[1m"
-
-    COLORS = {
-        logging.DEBUG: gray + bold,
-        logging.INFO: blue + bold,
-        logging.WARNING: yellow + bold,
-        logging.ERROR: red,
-        logging.CRITICAL: red + bold,
-    }
-
-    def format(self, record):
-        log_color = self.COLORS[record.levelno]
-        format = "(black){asctime}(reset) (levelcolor){levelname:<8}(reset) (green){name}(reset) {message}"
-        format = format.replace("(black)", self.black + self.bold)
-        format = format.replace("(reset)", self.reset)
-        format = format.replace("(levelcolor)", log_color)
-        format = format.replace("(green)", self.green + self.bold)
-        formatter = logging.Formatter(format, "%Y-%m-%d %H:%M:%S", style="{")
-        return formatter.format(record)
-
-
+# Setup the logger: records go through a bounded queue and are written to the console
+# and a rotating log file by a background thread (see helpers/logger.py).
 logger = logging.getLogger("Neurodivergence")
 logger.setLevel(logging.INFO)
-
-# Console handler
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(LoggingFormatter())
-# File handler
-file_handler = logging.FileHandler(filename="discord.log", encoding="utf-8", mode="w")
-file_handler_formatter = logging.Formatter(
-    "[{asctime}] [{levelname:<8}] {name}: {message}", "%Y-%m-%d %H:%M:%S", style="{"
+logging_pipeline = setup_logging(
+    logger,
+    filename=config.worker_log_file,
+    max_bytes=config.log_max_bytes,
+    backup_count=config.log_backup_count,
+    when=config.log_rotate_when,
+    compress=config.log_compress,
+    queue_size=config.log_queue_size,
 )
-file_handler.setFormatter(file_handler_formatter)
+atexit.register(logging_pipeline.stop)
+
+# FAST_RUNTIME selects uvloop and orjson when they are installed; this has to happen
+# before bot.run() creates the event loop.
+runtime = install_runtime(config.fast_runtime)
+
 
-# Add the handlers
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+# With SHARDING (or the shard range given to a cluster.py worker) the bot runs its
+# shards from a single AutoShardedBot, otherwise it keeps the single gateway connection.
+BotBase = commands.AutoShardedBot if config.sharded else commands.Bot
 
 
-class DiscordBot(commands.Bot):
+class DiscordBot(BotBase):
     def __init__(self) -> None:
+        shard_options = {}
+        if config.sharded:
+            shard_options = {
+                "shard_count": config.shard_count,
+                "shard_ids": list(config.shard_ids) or None,
+            }
+        # The cogs read messages with channel.history(), so the message cache only
+        # serves discord.py's own edit/delete events; MEMBER_CACHE=none also drops the
+        # members of voice channels. Without the members intent guilds are not chunked.
+        member_cache_flags = (
+            discord.MemberCacheFlags.none() if config.member_cache == "none" else discord.MemberCacheFlags.from_intents(intents)
+        )
         super().__init__(
             command_prefix=commands.when_mentioned_or(),
             intents=intents,
             help_command=None,
+            tree_cls=LazyCommandTree,
+            max_messages=config.max_messages or None,
+            member_cache_flags=member_cache_flags,
+            chunk_guilds_at_startup=False,
+            **shard_options,
         )
         """
         This creates custom bot variables so that we can access these variables in cogs more easily.
@@ -116,44 +110,71 @@ class DiscordBot(commands.Bot):
         - self.bot.config # In cogs
         """
         self.logger = logger
+        self.config: Config = config
+        self.logging_pipeline = logging_pipeline
+        self.metrics = BotMetrics()
+        self.runtime = runtime
+        self.http_client = HTTPClient(
+            trace_configs=[self.metrics.http_trace_config()],
+            json_dumps=self.runtime.json_dumps,
+            json_loads=self.runtime.json_loads,
+        )
+        self.audit = AuditSink(self, self.config.logging_channel)
+        self.tasks = TaskTracker()
+        self.store = Store(self.config.state_db_path)
+        self.triggers = TriggerDispatcher(tracker=self.tasks, store=self.store)
+        self.memory = MemoryBudget(self.config.memory_budget)
+        self.caches = CacheRegistry(metrics=self.metrics, store=self.store, budget=self.memory)
+        self.caches.enabled = self.config.cache_enabled
+        self.history = ChannelHistory(budget=self.memory)
+        self.media = MediaProcessor(self.config.media_workers)
+        self.gemini_files = GeminiFiles(self.http_client, store=self.store)
+        self.gemini_context = ContextCache(self.http_client, ttl=self.config.gemini_context_ttl, metrics=self.metrics)
+        self.gemini_context.enabled = self.config.gemini_context_cache
+        self.gemini_keys = KeyPool(
+            "gemini",
+            self.config.gemini_keys,
+            rpm=self.config.gemini_key_rpm,
+            tpm=self.config.gemini_key_tpm,
+            store=self.store,
+            metrics=self.metrics,
+        )
+        self.admission = AdmissionController(self.config.admission_max_in_flight, metrics=self.metrics)
+        self.loop_monitor = LoopMonitor(
+            threshold=self.config.loop_stall_threshold_ms / 1000, metrics=self.metrics
+        )
+        self.before_invoke(self.before_command)
+        self.after_invoke(self.admission.release)
+        self.extension_loader = ExtensionLoader(
+            self, Path(__file__).resolve().parent / "cogs", lazy=set(self.config.lazy_cogs)
+        )
+        self.ipc: IPCClient = None
+        self._ready_logged = False
+        self._shutting_down = False
 
     async def load_cogs(self) -> None:
         """
         The code in this function is executed whenever the bot will start.
+
+        Third-party imports of the cogs are warmed concurrently, cogs listed in
+        ``LAZY_COGS`` are only registered from their manifest, and per-extension timings
+        are kept on ``self.extension_loader.timings``.
         """
-        cogs_dir = Path(__file__).resolve().parent / "cogs"
-
-        for path in sorted(cogs_dir.iterdir()):
-            if path.is_file() and path.suffix == ".py" and not path.name.startswith("_"):
-                extension = path.stem
-                try:
-                    await self.load_extension(f"cogs.{extension}")
-                    self.logger.info(f"Loaded extension '{extension}'")
-                except Exception as e:
-                    exception = f"{type(e).__name__}: {e}"
-                    self.logger.error(
-                        f"Failed to load extension {extension}\n{exception}"
-                    )
-            elif path.is_dir() and not path.name.startswith("_"):
-                init_py = path / "__init__.py"
-                if init_py.is_file():
-                    ext = path.name
-                    try:
-                        await self.load_extension(f"cogs.{ext}")
-                        self.logger.info(f"Loaded extension '{ext}' (package)")
-                    except Exception as e:
-                        exception = f"{type(e).__name__}: {e}"
-                        self.logger.error(
-                            f"Failed to load extension {ext}\n{exception}"
-                        )
+        started = time.perf_counter()
+        timings = await self.extension_loader.load_all()
+        self.logger.info(
+            f"Loaded {sum(1 for t in timings.values() if not t.lazy and not t.error)} extensions "
+            f"({sum(1 for t in timings.values() if t.lazy)} lazy) in {(time.perf_counter() - started) * 1000:.0f}ms"
+        )
 
     @tasks.loop(minutes=1.0)
     async def status_task(self) -> None:
         """
         Setup the game status task of the bot.
         """
-        statuses = json.loads(os.environ['STATUSES'])
-        await self.change_presence(activity=discord.CustomActivity(name=random.choice(statuses)))
+        if not self.config.statuses:
+            return
+        await self.change_presence(activity=discord.CustomActivity(name=random.choice(self.config.statuses)))
 
     @status_task.before_loop
     async def before_status_task(self) -> None:
@@ -162,6 +183,69 @@ class DiscordBot(commands.Bot):
         """
         await self.wait_until_ready()
 
+    @tasks.loop(seconds=15.0)
+    async def ipc_heartbeat_task(self) -> None:
+        """
+        Report the state of this cluster worker to the launcher.
+        """
+        if self.ipc is None or not self.ipc.connected:
+            return
+        await self.ipc.heartbeat(
+            {
+                "pid": os.getpid(),
+                "shard_ids": sorted(self.shards) if isinstance(self, commands.AutoShardedBot) else [],
+                "guilds": len(self.guilds),
+                "latency_ms": round(self.latency * 1000) if self.is_ready() else None,
+                "in_flight": self.admission.in_flight,
+            }
+        )
+
+    def _on_ipc_message(self, topic: str, data) -> None:
+        """
+        Called for every message another cluster worker published. Each one is
+        dispatched as the ``on_ipc_<topic>(data)`` event.
+        """
+        if topic == "config_reload":
+            asyncio.create_task(self._reload_config_from_signal())
+        self.dispatch(f"ipc_{topic}", data)
+
+    async def on_ipc_cache_invalidate(self, data) -> None:
+        """
+        Another cluster worker cleared a cache (owner ``cacheclear`` command).
+        """
+        data = data or {}
+        prefix = data.get("prefix")
+        self.caches.invalidate(data.get("cache"), tuple(prefix) if prefix else None)
+
+    async def on_ipc_triggers_changed(self, data) -> None:
+        """
+        Another cluster worker changed the triggers of a guild (moderation ``trigger*``
+        commands); they are read again from the shared state store.
+        """
+        await self.triggers.reload_guild(int((data or {})["guild_id"]))
+
+    async def connect_ipc(self) -> None:
+        """
+        Connect to the IPC hub of cluster.py when running as one of its workers.
+        """
+        if not self.config.cluster_ipc_address or self.config.cluster_id is None:
+            return
+        self.ipc = IPCClient(
+            self.config.cluster_ipc_address,
+            self.config.cluster_ipc_token or "",
+            self.config.cluster_id,
+            self._on_ipc_message,
+        )
+        try:
+            await self.ipc.connect()
+        except OSError as e:
+            self.logger.error(f"Could not connect to the cluster IPC hub: {e}")
+            return
+        self.ipc_heartbeat_task.start()
+        self.logger.info(
+            f"Running as cluster {self.config.cluster_id} with shards {list(self.config.shard_ids)} of {self.config.shard_count}"
+        )
+
     async def setup_hook(self) -> None:
         """
         This will just be executed when the bot starts the first time.
@@ -172,9 +256,127 @@ class DiscordBot(commands.Bot):
         self.logger.info(
             f"Running on: {platform.system()} {platform.release()} ({os.name})"
         )
+        self.logger.info(
+            f"Runtime: {self.runtime.describe()}{' (FAST_RUNTIME)' if self.runtime.fast else ''}, "
+            f"discord.py JSON: {'orjson' if discord.utils.HAS_ORJSON else 'json'}"
+        )
+        for note in self.runtime.notes:
+            self.logger.warning(f"FAST_RUNTIME: {note}")
         self.logger.info("-------------------")
+        await self.store.open()
+        await self.gemini_keys.restore()
+        await self.triggers.restore()
         await self.load_cogs()
         self.status_task.start()
+        self.audit.start()
+        if self.config.loop_monitor:
+            self.loop_monitor.start()
+        await self.connect_ipc()
+        if self.config.metrics_port:
+            # Every cluster worker serves its own metrics on the next port.
+            port = self.config.metrics_port + (self.config.cluster_id or 0)
+            try:
+                await self.metrics.serve(self.config.metrics_host, port)
+            except OSError as e:
+                self.logger.error(f"Could not serve metrics on port {port}: {e}")
+        try:
+            loop = asyncio.get_running_loop()
+            loop.add_signal_handler(
+                signal.SIGHUP, lambda: asyncio.create_task(self._reload_config_from_signal())
+            )
+            loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.shutdown("SIGTERM")))
+        except (AttributeError, NotImplementedError, RuntimeError):
+            # No SIGHUP/SIGTERM handlers on Windows; use the owner `reloadconfig` command there.
+            pass
+
+    def reload_config(self) -> Config:
+        """
+        Re-read the configuration and swap it in without restarting. Cogs that cache
+        values derived from the configuration can react to the ``on_config_reload(old, new)``
+        event.
+
+        :raises ConfigError: If the new configuration is invalid; the old one stays active.
+        """
+        new_config = load_config(apply=False)
+        old_config = self.config
+        self.config = new_config
+        self.audit.channel_id = new_config.logging_channel
+        self.admission.max_in_flight = new_config.admission_max_in_flight
+        self.caches.enabled = new_config.cache_enabled
+        self.memory.limit = new_config.memory_budget
+        self.memory.enforce()
+        self.gemini_keys.update(new_config.gemini_keys, rpm=new_config.gemini_key_rpm, tpm=new_config.gemini_key_tpm)
+        self.gemini_context.enabled = new_config.gemini_context_cache
+        self.gemini_context.ttl = new_config.gemini_context_ttl
+        self.loop_monitor.threshold = new_config.loop_stall_threshold_ms / 1000
+        changed = old_config.changed_fields(new_config)
+        self.logger.info(
+            f"Configuration reloaded ({', '.join(changed) if changed else 'no changes'})"
+        )
+        self.dispatch("config_reload", old_config, new_config)
+        return new_config
+
+    async def _reload_config_from_signal(self) -> None:
+        try:
+            self.reload_config()
+        except ConfigError as e:
+            self.logger.error(f"Configuration reload failed, keeping the old configuration: {e}")
+
+    async def shutdown(self, reason: str) -> None:
+        """
+        Stop taking new work, let the running commands and triggers finish for up to
+        ``SHUTDOWN_TIMEOUT`` seconds, mark the ones that did not as interrupted, then close.
+
+        :param reason: Why the bot is shutting down, for the log.
+        """
+        if self._shutting_down:
+            return
+        self._shutting_down = True
+        self.logger.info(f"Shutting down ({reason}), {len(self.tasks)} tasks running")
+        self.admission.close("the bot is restarting, try again in a minute.")
+        started = time.perf_counter()
+        interrupted = await self.tasks.drain(self.config.shutdown_timeout)
+        self.logger.info(
+            f"Drained in {time.perf_counter() - started:.1f}s"
+            + (f", {interrupted} tasks interrupted" if interrupted else "")
+        )
+        await self.close()
+
+    async def get_context(self, origin, /, *, cls=TrackedContext):
+        """
+        Commands get a ``TrackedContext`` so a shutdown can find the messages they sent.
+        """
+        return await super().get_context(origin, cls=cls)
+
+    async def close(self) -> None:
+        """
+        Flush the audit log while still connected, close the Discord connection, then
+        commit the state store, let the pending Gemini context cache requests finish and
+        close the pooled HTTP sessions used by the cogs.
+        """
+        try:
+            await self.audit.close()
+            await super().close()
+        finally:
+            await self.loop_monitor.stop()
+            await self.caches.close()
+            await self.store.close()
+            self.media.close()
+            await self.gemini_context.close()
+            if self.ipc is not None:
+                await self.ipc.close()
+            await self.metrics.close()
+            await self.http_client.close()
+
+    async def on_ready(self) -> None:
+        """
+        The code in this event is executed when the bot is ready. Only the first READY
+        is logged, reconnects dispatch it again.
+        """
+        if self._ready_logged:
+            return
+        self._ready_logged = True
+        self.logger.info(f"Ready in {time.perf_counter() - _PROCESS_STARTED:.2f}s since process start")
 
     async def on_message(self, message: discord.Message) -> None:
         """
@@ -182,37 +384,103 @@ class DiscordBot(commands.Bot):
 
         :param message: The message that was sent.
         """
+        # Before the filter below: the bot's own replies are part of the AI context too.
+        self.history.add(message)
         if message.author == self.user or message.author.bot:
             return
+        # Keyword triggers registered by the cogs (see helpers/triggers.py) are matched
+        # here once, instead of by an on_message listener per cog.
+        self.triggers.dispatch(message)
         await self.process_commands(message)
 
+    async def before_command(self, context: Context) -> None:
+        """
+        Runs in the task of every command, after its checks passed and before it is invoked.
+
+        :param context: The context of the command that is being invoked.
+        """
+        self.loop_monitor.label_current_task(f"command {context.command.qualified_name}")
+        self.tasks.track_command(context)
+        await self.admission.acquire(context)
+
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        """
+        Keep the edits of the messages in the channel history buffers.
+
+        :param payload: The raw edit event, the message may not be cached.
+        """
+        if "content" in payload.data:
+            self.history.edit(payload.channel_id, payload.message_id, payload.data["content"])
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        self.history.delete(payload.channel_id, (payload.message_id,))
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> None:
+        self.history.delete(payload.channel_id, payload.message_ids)
+
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel) -> None:
+        self.history.forget(channel.id)
+
+    async def on_command(self, context: Context) -> None:
+        """
+        The code in this event is executed every time a command is about to be invoked.
+
+        :param context: The context of the command that is being invoked.
+        """
+        if context.command.extras.get("lazy_stub"):
+            return
+        self.metrics.command_started(context)
+
     async def on_command_completion(self, context: Context) -> None:
         """
         The code in this event is executed every time a normal command has been *successfully* executed.
 
         :param context: The context of the command that has been executed.
         """
+        if context.command.extras.get("lazy_stub"):
+            # The placeholder of a lazy cog re-dispatched to the real command, which
+            # reports its own completion.
+            return
+        if context.command_failed:
+            # discord.py swallows the CancelledError of a command interrupted by a
+            # shutdown and still dispatches its completion.
+            self.metrics.command_finished(context, asyncio.CancelledError())
+            self.logger.info(f"Interrupted {context.command.qualified_name} command by {context.author} (ID: {context.author.id})")
+            return
+        self.metrics.command_finished(context)
         full_command_name = context.command.qualified_name
         split = full_command_name.split(" ")
         executed_command = str(split[0])
-        logging_channel_id = os.getenv("LOGGING_CHANNEL")
-        log_channel = bot.get_channel(int(logging_channel_id)) if logging_channel_id else None
         if context.guild is not None:
             self.logger.info(
                 f"Executed {executed_command} command in {context.guild.name} (ID: {context.guild.id}) by {context.author} (ID: {context.author.id})"
             )
-            if log_channel:
-                embed = discord.Embed(title=f"Command run by {context.author}")
-                embed.add_field(name=f"in {context.guild.name}", value=context.message.content, inline=True)
-                await log_channel.send(embed=embed)
         else:
             self.logger.info(
                 f"Executed {executed_command} command by {context.author} (ID: {context.author.id}) in DMs"
             )
-            if log_channel:
-                embed = discord.Embed(title=f"Command run by {context.author}")
-                embed.add_field(name="in DMs", value=context.message.content, inline=True)
-                await log_channel.send(embed=embed)
+        self.audit_command(context)
+
+    def audit_command(self, context: Context, description: str = None) -> None:
+        """
+        Queue an embed describing the command for the logging channel. The embed is sent
+        in the background by ``self.audit``, so this never waits on Discord.
+
+        :param context: The context of the command that has been executed.
+        :param description: An optional description, e.g. why the command was refused.
+        """
+        if not self.audit.enabled:
+            return
+        content = context.message.content if context.message else ""
+        if not content:
+            content = f"/{context.command.qualified_name}" if context.command else "(unknown)"
+        location = f"in {context.guild.name}" if context.guild else "in DMs"
+        embed = discord.Embed(title=f"Command run by {context.author}", description=description)
+        embed.add_field(name=location, value=content[:1024], inline=True)
+        self.audit.submit(
+            embed,
+            key=(context.author.id, context.guild.id if context.guild else None, content, description),
+        )
 
     async def on_command_error(self, context: Context, error) -> None:
         """
@@ -221,7 +489,15 @@ class DiscordBot(commands.Bot):
         :param context: The context of the normal command that failed executing.
         :param error: The error that has been faced.
         """
-        if isinstance(error, commands.CommandOnCooldown):
+        self.metrics.command_finished(context, error)
+        await self.admission.release(context)
+        if isinstance(error, AdmissionRejected):
+            embed = discord.Embed(
+                description=f"**Too busy** - `/{error.command_name}`: {error.reason}",
+                color=0xE02B2B,
+            )
+            await context.send(embed=embed)
+        elif isinstance(error, commands.CommandOnCooldown):
             minutes, seconds = divmod(error.retry_after, 60)
             hours, minutes = divmod(minutes, 60)
             hours = hours % 24
@@ -231,8 +507,6 @@ class DiscordBot(commands.Bot):
             )
             await context.send(embed=embed)
         elif isinstance(error, commands.NotOwner):
-            logging_channel_id = os.getenv("LOGGING_CHANNEL")
-            log_channel = bot.get_channel(int(logging_channel_id)) if logging_channel_id else None
             embed = discord.Embed(
                 description="You are not the owner of the bot!", color=0xE02B2B
             )
@@ -241,18 +515,14 @@ class DiscordBot(commands.Bot):
                 self.logger.warning(
                     f"{context.author} (ID: {context.author.id}) tried to execute an owner only command in the guild {context.guild.name} (ID: {context.guild.id}), but the user is not an owner of the bot."
                 )
-                if log_channel:
-                    embed = discord.Embed(title=f"Command run by {context.author}", description="tried to execute an owner only command, but the user is not an owner of the bot.")
-                    embed.add_field(name=f"in {context.guild.name}", value=context.message.content, inline=True)
-                    await log_channel.send(embed=embed)
             else:
                 self.logger.warning(
                     f"{context.author} (ID: {context.author.id}) tried to execute an owner only command in the bot's DMs, but the user is not an owner of the bot."
                 )
-                if log_channel:
-                    embed = discord.Embed(title=f"Command run by {context.author}", description="tried to execute an owner only command, but the user is not an owner of the bot.")
-                    embed.add_field(name=f"in DMs", value=context.message.content, inline=True)
-                    await log_channel.send(embed=embed)
+            self.audit_command(
+                context,
+                description="tried to execute an owner only command, but the user is not an owner of the bot.",
+            )
         elif isinstance(error, commands.MissingPermissions):
             embed = discord.Embed(
                 description="You are missing the permission(s) `"
@@ -287,5 +557,6 @@ class DiscordBot(commands.Bot):
         else:
             raise error
 
-bot = DiscordBot()
-bot.run(os.getenv("TOKEN"))
\ No newline at end of file
+if __name__ == "__main__":
+    bot = DiscordBot()
+    bot.run(bot.config.token)
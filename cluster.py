@@ -0,0 +1,193 @@
+"""
+Run the bot as a cluster of worker processes, each owning a range of shards.
+
+Usage:
+  python cluster.py [--workers N] [--shards N]
+
+The total shard count is SHARD_COUNT, or Discord's recommendation from /gateway/bot.
+The shards are split into contiguous ranges across CLUSTER_WORKERS processes (default:
+one per CPU core, never more than the number of shards). Every worker is a normal
+`bot.py` process started with CLUSTER_ID, SHARD_IDS and SHARD_COUNT in its environment;
+it logs to its own file (e.g. discord.cluster0.log) and, when METRICS_PORT is set,
+serves its metrics on METRICS_PORT + CLUSTER_ID.
+
+Workers are connected to each other through a small IPC hub on the loopback interface
+(see helpers/ipc.py), used for owner commands and shared state such as configuration
+reloads and cache invalidation. A worker that exits is restarted with backoff. SIGHUP
+is forwarded to every worker (each reloads its configuration), SIGINT/SIGTERM stop them.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import secrets
+import signal
+import sys
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from helpers.config import REPO_ROOT, Config, ConfigError, load_config
+from helpers.ipc import IPCHub
+from helpers.logger import setup_logging
+
+GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+# Discord allows one IDENTIFY per 5 seconds per max_concurrency bucket.
+IDENTIFY_INTERVAL = 5.0
+
+logger = logging.getLogger("Neurodivergence")
+
+
+async def fetch_recommended_shards(token: str) -> Dict[str, int]:
+    headers = {"Authorization": f"Bot {token}"}
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_BOT_URL, headers=headers) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return {
+        "shards": data["shards"],
+        "max_concurrency": data.get("session_start_limit", {}).get("max_concurrency", 1),
+    }
+
+
+def split_shards(shard_count: int, workers: int) -> List[List[int]]:
+    """
+    Split ``range(shard_count)`` into ``workers`` contiguous, nearly equal ranges.
+    """
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for index in range(workers):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class Worker:
+    def __init__(self, cluster_id: int, shard_ids: List[int], env: Dict[str, str], start_delay: float) -> None:
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.env = env
+        self.start_delay = start_delay
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+
+    async def run(self, stopping: asyncio.Event) -> None:
+        await asyncio.sleep(self.start_delay)
+        backoff = 1.0
+        while not stopping.is_set():
+            logger.info(f"Starting cluster {self.cluster_id} (shards {self.shard_ids[0]}-{self.shard_ids[-1]})")
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, "-u", str(REPO_ROOT / "bot.py"), cwd=str(REPO_ROOT), env=self.env
+            )
+            returncode = await self.process.wait()
+            if stopping.is_set():
+                break
+            logger.warning(f"Cluster {self.cluster_id} exited with code {returncode}, restarting in {backoff:.0f}s")
+            self.restarts += 1
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            backoff = min(backoff * 2, 60.0)
+
+    def send_signal(self, signum: int) -> None:
+        if self.process is not None and self.process.returncode is None:
+            self.process.send_signal(signum)
+
+
+async def run_cluster(config: Config, workers: Optional[int], shards: Optional[int]) -> None:
+    max_concurrency = 1
+    shard_count = shards or config.shard_count
+    if not shard_count:
+        recommended = await fetch_recommended_shards(config.token)
+        shard_count = recommended["shards"]
+        max_concurrency = recommended["max_concurrency"]
+    ranges = split_shards(shard_count, workers or config.cluster_workers or os.cpu_count() or 1)
+    logger.info(f"Running {shard_count} shards on {len(ranges)} workers")
+
+    hub = IPCHub(secrets.token_hex(16))
+    await hub.start()
+
+    cluster: List[Worker] = []
+    shards_before = 0
+    for cluster_id, shard_ids in enumerate(ranges):
+        env = {
+            **os.environ,
+            "CLUSTER_ID": str(cluster_id),
+            "SHARD_IDS": "[" + ",".join(map(str, shard_ids)) + "]",
+            "SHARD_COUNT": str(shard_count),
+            "CLUSTER_IPC_ADDRESS": hub.address,
+            "CLUSTER_IPC_TOKEN": hub.token,
+        }
+        # Stagger the workers so their IDENTIFYs do not exceed the session start limit.
+        start_delay = IDENTIFY_INTERVAL * shards_before / max_concurrency
+        cluster.append(Worker(cluster_id, shard_ids, env, start_delay))
+        shards_before += len(shard_ids)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    def stop() -> None:
+        stopping.set()
+        for worker in cluster:
+            worker.send_signal(signal.SIGTERM)
+
+    def reload() -> None:
+        logger.info("Forwarding SIGHUP to every worker")
+        for worker in cluster:
+            worker.send_signal(signal.SIGHUP)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop)
+    loop.add_signal_handler(signal.SIGHUP, reload)
+
+    try:
+        await asyncio.gather(*(worker.run(stopping) for worker in cluster))
+    finally:
+        await hub.close()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Run the bot as a cluster of sharded worker processes.")
+    p.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CLUSTER_WORKERS or CPU count).")
+    p.add_argument("--shards", type=int, default=None, help="Total shard count (default: SHARD_COUNT or Discord's recommendation).")
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    try:
+        # Not applied to os.environ: workers inherit the real environment and read .env
+        # themselves, so a SIGHUP reload in a worker still picks up edits to .env.
+        config = load_config(apply=False)
+    except ConfigError as e:
+        print("Invalid configuration:\n- " + "\n- ".join(e.problems), file=sys.stderr)
+        return 2
+    if not config.token:
+        print("Missing TOKEN in environment/.env", file=sys.stderr)
+        return 2
+
+    logger.setLevel(logging.INFO)
+    root, ext = os.path.splitext(config.log_file)
+    pipeline = setup_logging(
+        logger,
+        filename=f"{root}.launcher{ext}",
+        max_bytes=config.log_max_bytes,
+        backup_count=config.log_backup_count,
+        when=config.log_rotate_when,
+        compress=config.log_compress,
+    )
+    try:
+        asyncio.run(run_cluster(config, args.workers, args.shards))
+    finally:
+        pipeline.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -6,11 +6,25 @@ import discord
 from discord.ext import commands
 from discord.ext.commands import Context
 
+from helpers.limiter import Priority, admission
 
+
+@admission(priority=Priority.MODERATION)
 class Moderation(commands.Cog, name="moderation"):
     def __init__(self, bot) -> None:
         self.bot = bot
 
+    async def publish_triggers(self, guild_id: int) -> None:
+        """
+        Tells the other cluster workers that the triggers of a guild changed, once the
+        change is committed to the state store they read it from.
+
+        :param guild_id: The guild whose triggers changed.
+        """
+        if self.bot.ipc is not None and self.bot.ipc.connected:
+            await self.bot.store.flush()
+            await self.bot.ipc.publish("triggers_changed", {"guild_id": guild_id})
+
     @commands.hybrid_command(
         name="purge",
         description="Delete a number of messages.",
@@ -132,5 +146,101 @@ class Moderation(commands.Cog, name="moderation"):
         await context.reply(file=f)
         os.remove(log_file)
 
+    @commands.hybrid_command(
+        name="triggeradd",
+        description="Reply with a message whenever a keyword is said in this server.",
+    )
+    @discord.app_commands.describe(
+        keyword="The word or phrase to respond to.",
+        response="The reply to send.",
+        channel="Only respond in this channel (defaults to every channel).",
+    )
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_guild=True)
+    async def triggeradd(self, context: Context, keyword: str, channel: Optional[discord.TextChannel] = None, *, response: str) -> None:
+        # Another cluster worker may have changed this guild's triggers meanwhile.
+        await self.bot.triggers.reload_guild(context.guild.id)
+        self.bot.triggers.add_responder(
+            context.guild.id, keyword, response, channel_id=channel.id if channel else None
+        )
+        await self.publish_triggers(context.guild.id)
+        where = channel.mention if channel else "this server"
+        embed = discord.Embed(
+            description=f"I will now reply to `{keyword}` in {where}.", color=0xBEBEFE
+        )
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="triggerremove",
+        description="Stop replying to a keyword in this server.",
+    )
+    @discord.app_commands.describe(
+        keyword="The keyword of the auto-responder to remove.",
+        channel="The channel the auto-responder was limited to, if any.",
+    )
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_guild=True)
+    async def triggerremove(self, context: Context, keyword: str, channel: Optional[discord.TextChannel] = None) -> None:
+        await self.bot.triggers.reload_guild(context.guild.id)
+        removed = self.bot.triggers.remove_responder(
+            context.guild.id, keyword, channel_id=channel.id if channel else None
+        )
+        if removed:
+            await self.publish_triggers(context.guild.id)
+            embed = discord.Embed(description=f"Removed the auto-responder for `{keyword}`.", color=0xBEBEFE)
+        else:
+            embed = discord.Embed(description=f"There is no auto-responder for `{keyword}`.", color=0xE02B2B)
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="triggertoggle",
+        description="Enable or disable one of the bot's built-in triggers in this server.",
+    )
+    @discord.app_commands.describe(
+        name="The name of the trigger, as shown by /triggers.",
+        enabled="Whether the trigger should be active in this server.",
+    )
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_guild=True)
+    async def triggertoggle(self, context: Context, name: str, enabled: bool) -> None:
+        dispatcher = self.bot.triggers
+        await dispatcher.reload_guild(context.guild.id)
+        known = {trigger.name for trigger in dispatcher.triggers_for(None)}
+        # A trigger disabled earlier can still be enabled after its cog was unloaded.
+        if name not in known and not (enabled and name in dispatcher.disabled_in(context.guild.id)):
+            embed = discord.Embed(
+                description=f"There is no built-in trigger named `{name}`, see `/triggers`.", color=0xE02B2B
+            )
+            await context.send(embed=embed)
+            return
+        dispatcher.set_enabled(context.guild.id, name, enabled)
+        await self.publish_triggers(context.guild.id)
+        embed = discord.Embed(
+            description=f"The `{name}` trigger is now {'enabled' if enabled else 'disabled'} in this server.",
+            color=0xBEBEFE,
+        )
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="triggers",
+        description="List the keyword triggers active in this server.",
+    )
+    @commands.guild_only()
+    async def triggers(self, context: Context) -> None:
+        dispatcher = self.bot.triggers
+        lines = []
+        for trigger in dispatcher.triggers_for(None):
+            state = "disabled" if trigger.name in dispatcher.disabled_in(context.guild.id) else "enabled"
+            lines.append(f"{trigger.name} ({state})")
+        for trigger in dispatcher.guild_triggers(context.guild.id):
+            channel = f" in <#{trigger.channel_id}>" if trigger.channel_id else ""
+            lines.append(f"{trigger.name}{channel}: {trigger.response or 'custom handler'}")
+        embed = discord.Embed(
+            title="Triggers",
+            description="\n".join(lines)[:4000] or "No triggers.",
+            color=0xBEBEFE,
+        )
+        await context.send(embed=embed)
+
 async def setup(bot) -> None:
     await bot.add_cog(Moderation(bot))
@@ -1,13 +1,39 @@
+import asyncio
+import tracemalloc
+
 import discord
 from discord import app_commands
 from discord.ext import commands
 from discord.ext.commands import Context
 
+from helpers.config import ConfigError
+from helpers.limiter import Priority, admission
+from helpers.memory import rss_bytes, top_allocations
+
 
+@admission(priority=Priority.OWNER)
 class Owner(commands.Cog, name="owner"):
     def __init__(self, bot) -> None:
         self.bot = bot
 
+    async def load_lazy_extensions(self, context: Context) -> bool:
+        """
+        Loads the pending lazy extensions, whose slash commands are not in the tree yet and
+        would be removed from Discord by a sync.
+
+        :param context: The command context.
+        :return: Whether the tree can be synced.
+        """
+        failed = await self.bot.extension_loader.materialize_all()
+        if failed:
+            embed = discord.Embed(
+                description=f"Could not load `{'`, `'.join(failed)}`, the slash commands were not synchronized.",
+                color=0xE02B2B,
+            )
+            await context.send(embed=embed)
+            return False
+        return True
+
     @commands.command(
         name="sync",
         description="Synchonizes the slash commands.",
@@ -22,6 +48,8 @@ class Owner(commands.Cog, name="owner"):
         :param scope: The scope of the sync. Can be `global` or `guild`.
         """
 
+        if scope in ("global", "guild") and not await self.load_lazy_extensions(context):
+            return
         if scope == "global":
             await context.bot.tree.sync()
             embed = discord.Embed(
@@ -60,6 +88,8 @@ class Owner(commands.Cog, name="owner"):
         :param scope: The scope of the sync. Can be `global`, `current_guild` or `guild`.
         """
 
+        if scope in ("global", "guild") and not await self.load_lazy_extensions(context):
+            return
         if scope == "global":
             context.bot.tree.clear_commands(guild=None)
             await context.bot.tree.sync()
@@ -97,7 +127,7 @@ class Owner(commands.Cog, name="owner"):
         :param cog: The name of the cog to load.
         """
         try:
-            await self.bot.load_extension(f"cogs.{cog}")
+            await self.bot.extension_loader.load(cog)
         except Exception:
             embed = discord.Embed(
                 description=f"Could not load the `{cog}` cog.", color=0xE02B2B
@@ -161,5 +191,294 @@ class Owner(commands.Cog, name="owner"):
         )
         await context.send(embed=embed)
 
+    @commands.hybrid_command(
+        name="reloadconfig",
+        description="Reloads the bot configuration (.env and environment).",
+    )
+    @commands.is_owner()
+    async def reloadconfig(self, context: Context) -> None:
+        """
+        The bot will re-read and validate its configuration without restarting.
+
+        :param context: The hybrid command context.
+        """
+        old_config = self.bot.config
+        try:
+            new_config = self.bot.reload_config()
+        except ConfigError as e:
+            embed = discord.Embed(
+                title="Configuration is invalid, keeping the old one.",
+                description="\n".join(f"- {problem}" for problem in e.problems),
+                color=0xE02B2B,
+            )
+            await context.send(embed=embed)
+            return
+        changed = old_config.changed_fields(new_config)
+        description = f"Successfully reloaded the configuration. Changed: {', '.join(f'`{name}`' for name in changed) if changed else 'nothing'}."
+        if self.bot.ipc is not None and self.bot.ipc.connected:
+            await self.bot.ipc.publish("config_reload")
+            description += " Reloading the other cluster workers too."
+        embed = discord.Embed(description=description, color=0xBEBEFE)
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="exttimings",
+        description="Shows how long each cog took to import and set up.",
+    )
+    @commands.is_owner()
+    async def exttimings(self, context: Context) -> None:
+        """
+        Shows the import and setup timings recorded by the extension loader.
+
+        :param context: The hybrid command context.
+        """
+        timings = sorted(
+            self.bot.extension_loader.timings.values(),
+            key=lambda timing: timing.total_seconds,
+            reverse=True,
+        )
+        lines = []
+        for timing in timings:
+            if timing.error:
+                state = f"failed: {timing.error}"
+            elif timing.lazy and timing.setup_seconds == 0:
+                state = "lazy, not loaded yet"
+            else:
+                state = f"imports {timing.import_seconds * 1000:.0f}ms, setup {timing.setup_seconds * 1000:.0f}ms"
+            lines.append(f"{timing.name}: {state}")
+        embed = discord.Embed(
+            title="Extension timings",
+            description="```" + ("\n".join(lines) or "No extensions loaded.") + "```",
+            color=0xBEBEFE,
+        )
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="cluster",
+        description="Shows the shards and cluster workers of the bot.",
+    )
+    @commands.is_owner()
+    async def cluster(self, context: Context) -> None:
+        """
+        Shows the state of every cluster worker, or of the local shards when not clustered.
+
+        :param context: The hybrid command context.
+        """
+        lines = []
+        if self.bot.ipc is not None and self.bot.ipc.connected:
+            status = await self.bot.ipc.request("status")
+            for cluster_id, worker in status.items():
+                shard_ids = worker.get("shard_ids") or []
+                shards = f"{shard_ids[0]}-{shard_ids[-1]}" if shard_ids else "-"
+                latency = f"{worker['latency_ms']}ms" if worker.get("latency_ms") is not None else "not ready"
+                state = "" if worker.get("connected") else " (disconnected)"
+                lines.append(
+                    f"cluster {cluster_id}: shards {shards}, {worker.get('guilds', 0)} guilds, {latency}, "
+                    f"{worker.get('in_flight', 0)} commands running{state}"
+                )
+        elif isinstance(self.bot, commands.AutoShardedBot):
+            for shard_id, shard in sorted(self.bot.shards.items()):
+                guilds = sum(1 for guild in self.bot.guilds if guild.shard_id == shard_id)
+                lines.append(f"shard {shard_id}: {guilds} guilds, {shard.latency * 1000:.0f}ms")
+        else:
+            lines.append(f"Not sharded: {len(self.bot.guilds)} guilds, {self.bot.latency * 1000:.0f}ms")
+        embed = discord.Embed(
+            title="Cluster",
+            description="```" + ("\n".join(lines) or "No workers reported yet.") + "```",
+            color=0xBEBEFE,
+        )
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="loophealth",
+        description="Shows event loop lag and the code that blocked it recently.",
+    )
+    @commands.is_owner()
+    async def loophealth(self, context: Context) -> None:
+        """
+        Shows the scheduling lag of the event loop and the most recent stalls.
+
+        :param context: The hybrid command context.
+        """
+        monitor = self.bot.loop_monitor
+        embed = discord.Embed(title="Event loop health", color=0xBEBEFE)
+        embed.add_field(
+            name="Lag",
+            value=(
+                f"p50 {monitor.lag_percentile(0.5) * 1000:.1f}ms, p99 {monitor.lag_percentile(0.99) * 1000:.1f}ms, "
+                f"max {monitor.max_lag * 1000:.0f}ms (stall threshold {monitor.threshold * 1000:.0f}ms)"
+            ),
+            inline=False,
+        )
+        if monitor.stall_counts:
+            worst = sorted(monitor.stall_counts.items(), key=lambda item: item[1], reverse=True)[:10]
+            embed.add_field(
+                name="Stalls by source",
+                value="\n".join(f"`{label}`: {count}" for label, count in worst)[:1024],
+                inline=False,
+            )
+        for stall in list(monitor.stalls)[-3:]:
+            embed.add_field(
+                name=f"{stall.duration * 1000:.0f}ms in {stall.label} <t:{int(stall.started_at)}:R>"[:256],
+                value="```" + "".join(stall.stack[-4:])[-1000:] + "```",
+                inline=False,
+            )
+        if not monitor.stall_counts:
+            embed.description = "No stalls recorded."
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="caches",
+        description="Shows the upstream response caches and their hit rates.",
+    )
+    @commands.is_owner()
+    async def caches(self, context: Context) -> None:
+        """
+        Shows the size and the hits, misses and evictions of every upstream cache.
+
+        :param context: The hybrid command context.
+        """
+        lines = []
+        for name, cache in sorted(self.bot.caches.caches.items()):
+            stats = cache.stats
+            lines.append(
+                f"{name}: {len(cache)} entries, {cache.size / 1024:.0f}KiB, {stats.hit_rate:.0%} hit rate "
+                f"({stats.hits} hits, {stats.stale_hits} stale, {stats.negative_hits} negative, "
+                f"{stats.misses} misses, {stats.coalesced} coalesced, {stats.restored} restored, {stats.evictions} evictions)"
+            )
+        embed = discord.Embed(
+            title="Caches" if self.bot.caches.enabled else "Caches (disabled)",
+            description="```" + ("\n".join(lines) or "Nothing cached yet.") + "```",
+            color=0xBEBEFE,
+        )
+        flights = self.bot.http_client.singleflight
+        embed.set_footer(text=f"Uncached lookups: {flights.started} started, {flights.shared} joined a running one")
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="cacheclear",
+        description="Clears an upstream response cache, or all of them.",
+    )
+    @app_commands.describe(name="The name of the cache to clear, all of them if empty")
+    @commands.is_owner()
+    async def cacheclear(self, context: Context, name: str = None) -> None:
+        """
+        Clears an upstream response cache on this worker and on the other cluster workers.
+
+        :param context: The hybrid command context.
+        :param name: The name of the cache to clear, all of them if empty.
+        """
+        if name is not None and name not in self.bot.caches.caches:
+            embed = discord.Embed(description=f"There is no `{name}` cache.", color=0xE02B2B)
+            await context.send(embed=embed)
+            return
+        removed = self.bot.caches.invalidate(name)
+        description = f"Cleared {removed} entries from {f'the `{name}` cache' if name else 'every cache'}."
+        if self.bot.ipc is not None and self.bot.ipc.connected:
+            await self.bot.ipc.publish("cache_invalidate", {"cache": name})
+            description += " Clearing it on the other cluster workers too."
+        embed = discord.Embed(description=description, color=0xBEBEFE)
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="keypool",
+        description="Shows the health of the Gemini API keys.",
+    )
+    @commands.is_owner()
+    async def keypool(self, context: Context) -> None:
+        """
+        Shows the status, load, remaining budget and outcomes of every Gemini API key.
+
+        :param context: The hybrid command context.
+        """
+        pool = self.bot.gemini_keys
+        lines = []
+        for row in pool.health():
+            lines.append(
+                f"{row['key']}: {row['status']}, {row['in_flight']} in flight, "
+                f"{row['requests_left']:.0%} requests / {row['tokens_left']:.0%} tokens left, "
+                f"{row['successes']} ok, {row['throttled']} throttled, {row['failures']} failed, {row['tokens_used']} tokens"
+            )
+            if row["last_error"]:
+                lines.append(f"  last error: {row['last_error']}")
+        embed = discord.Embed(
+            title="Gemini keys",
+            description="```" + ("\n".join(lines) or "No keys configured.")[:4000] + "```",
+            color=0xBEBEFE,
+        )
+        rpm = f"{pool.rpm} requests" if pool.rpm else "unlimited requests"
+        tpm = f"{pool.tpm} tokens" if pool.tpm else "unlimited tokens"
+        embed.set_footer(text=f"Per key and minute: {rpm}, {tpm}")
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="contextcache",
+        description="Shows the hit rate of the Gemini context caches.",
+    )
+    @commands.is_owner()
+    async def contextcache(self, context: Context) -> None:
+        """
+        Shows how often the neuro replies used a cached prompt prefix, and the share of
+        their input tokens served from the caches.
+
+        :param context: The hybrid command context.
+        """
+        cache = self.bot.gemini_context
+        stats = cache.stats
+        embed = discord.Embed(
+            title="Gemini context caches" if cache.enabled else "Gemini context caches (disabled)",
+            description=(
+                f"{len(cache)} caches, {stats.hit_rate:.0%} hit rate ({stats.hits} hits, {stats.misses} misses)\n"
+                f"{stats.created} created, {stats.extended} extended, {stats.failures} failed to create\n"
+                f"{stats.cached_tokens} of {stats.prompt_tokens} input tokens ({stats.cached_share:.0%}) served from the caches"
+            ),
+            color=0xBEBEFE,
+        )
+        embed.set_footer(text=f"Caches live {cache.ttl}s after their last extension")
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="memory",
+        description="Shows the memory used by the bot and its caches.",
+    )
+    @app_commands.describe(action="`trace` to start tracing allocations, `stop` to stop")
+    @commands.is_owner()
+    async def memory(self, context: Context, action: str = None) -> None:
+        """
+        Shows the RSS, the memory budget per consumer, the discord.py caches and, while
+        tracemalloc is tracing, the lines that allocated the most memory.
+
+        :param context: The hybrid command context.
+        :param action: `trace` to start tracing allocations, `stop` to stop.
+        """
+        if action not in (None, "trace", "stop"):
+            embed = discord.Embed(description="The action must be `trace` or `stop`.", color=0xE02B2B)
+            await context.send(embed=embed)
+            return
+        if action == "trace" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif action == "stop" and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        budget = self.bot.memory
+        limit = f"{budget.limit / 1024 / 1024:.0f}MiB" if budget.limit else "no limit"
+        lines = [
+            f"RSS: {rss_bytes() / 1024 / 1024:.1f}MiB",
+            f"Budget: {budget.used / 1024:.0f}KiB of {limit}, {budget.evictions} evictions",
+        ]
+        lines += [f"  {name}: {size / 1024:.0f}KiB" for name, size in budget.usage()]
+        lines.append(
+            f"discord.py: {len(self.bot.cached_messages)}/{self.bot.config.max_messages} messages, "
+            f"{sum(len(guild.members) for guild in self.bot.guilds)} members in {len(self.bot.guilds)} guilds"
+        )
+        embed = discord.Embed(title="Memory", description="```" + "\n".join(lines) + "```", color=0xBEBEFE)
+        if tracemalloc.is_tracing():
+            allocations = await asyncio.to_thread(top_allocations)
+            traced = "\n".join(f"{size / 1024:.0f}KiB {count} blocks {location}" for location, size, count in allocations)
+            embed.add_field(name="Top allocations", value="```" + (traced or "Nothing traced yet.")[:1000] + "```", inline=False)
+        else:
+            embed.set_footer(text="Run with `trace` to trace allocations (slows the bot down), `stop` to stop.")
+        await context.send(embed=embed)
+
 async def setup(bot) -> None:
     await bot.add_cog(Owner(bot))
@@ -1,15 +1,19 @@
+import asyncio
 import base64
 import io
-import os
 import random
-from typing import Any, Dict, Optional, Tuple, List
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, List
 
-import aiohttp
 import discord
 from discord.ext import commands
 
+from helpers.cache import cached
+from helpers.http import UpstreamError
+
 SHODAN_SEARCH_URL = "https://api.shodan.io/shodan/host/search"
 SHODAN_HOST_URL = "https://www.shodan.io/host"
+# Seconds a result view waits for its matches before deferring the button interaction.
+LOAD_WAIT = 2.0
 
 def _safe_join(items, limit: int = 3) -> str:
     if not items or not isinstance(items, (list, tuple)):
@@ -35,6 +39,11 @@ def _extract_screenshot(match: Dict[str, Any]) -> Optional[Tuple[bytes, str]]:
     except Exception:
         return None
 
+def _has_screenshot(match: Dict[str, Any]) -> bool:
+    """Whether the match carries screenshot data, without decoding it."""
+    screenshot = match.get("screenshot")
+    return isinstance(screenshot, dict) and bool(screenshot.get("data"))
+
 def _get_data_str(match: Dict[str, Any]) -> Optional[str]:
     """Returns the raw data as a string if available, else None."""
     data = match.get("data")
@@ -89,6 +98,7 @@ class ShodanPageView(discord.ui.View):
         screenshots: bool = False,
         query: str = "",
         timeout: float = 120.0,
+        loader: Optional[Callable[[], Awaitable[List[Dict[str, Any]]]]] = None,
     ):
         super().__init__(timeout=timeout)
         self.requester_id = getattr(requester, "id", None)
@@ -97,9 +107,19 @@ class ShodanPageView(discord.ui.View):
         self.page = page
         self.screenshots = screenshots
         self.query = query
+        # Reads the matches again from the search cache, so the view does not keep them
+        # alive next to the cache between button presses.
+        self.loader = loader
 
         self.total_pages = max(1, (len(matches) + page_size - 1) // page_size)
 
+    def release(self) -> None:
+        """
+        Drop the matches once a page is rendered, if the loader can read them again.
+        """
+        if self.loader is not None:
+            self.matches = None
+
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if self.requester_id is not None and interaction.user.id != self.requester_id:
             await interaction.response.send_message(
@@ -119,6 +139,27 @@ class ShodanPageView(discord.ui.View):
         await self._update_message(interaction)
 
     async def _update_message(self, interaction: discord.Interaction):
+        respond = interaction.response.edit_message
+        if self.matches is None:
+            # Normally a hit of the search cache. A search that dropped out of it runs
+            # again, which may take longer than the 3 seconds Discord waits for an answer.
+            loading = asyncio.create_task(self.loader())
+            done, _ = await asyncio.wait((loading,), timeout=LOAD_WAIT)
+            if not done:
+                await interaction.response.defer()
+                respond = interaction.edit_original_response
+            try:
+                matches = await loading
+            except Exception as e:
+                await self._notify(interaction, f"Could not load the results again: `{type(e).__name__}`")
+                return
+            if not matches:
+                await self._notify(interaction, "The search has no results any more.")
+                return
+            self.matches = matches
+            self.total_pages = max(1, (len(matches) + self.page_size - 1) // self.page_size)
+            self.page = max(0, min(self.page, self.total_pages - 1))
+
         for item in self.children:
             item.disabled = False
         if self.page <= 0:
@@ -127,12 +168,20 @@ class ShodanPageView(discord.ui.View):
             self.next_page.disabled = True
 
         embed, files = await self.format_embed_and_files()
-        await interaction.response.edit_message(
+        self.release()
+        await respond(
             embed=embed,
             attachments=files if files else [],
             view=self
         )
 
+    @staticmethod
+    async def _notify(interaction: discord.Interaction, message: str) -> None:
+        if interaction.response.is_done():
+            await interaction.followup.send(message, ephemeral=True)
+        else:
+            await interaction.response.send_message(message, ephemeral=True)
+
     async def on_timeout(self):
         for item in self.children:
             item.disabled = True
@@ -270,12 +319,57 @@ class Shodan(commands.Cog, name="shodan"):
     def __init__(self, bot) -> None:
         self.bot = bot
 
+    def matches_loader(self, query: str, screenshots: bool) -> Optional[Callable[[], Awaitable[List[Dict[str, Any]]]]]:
+        """
+        Reads the matches of a search again for a result view, or ``None`` when the upstream
+        caches are off: every search costs query credits, so the view keeps its matches.
+        """
+        caches = getattr(self.bot, "caches", None)
+        if caches is None or not caches.enabled:
+            return None
+        return lambda: self.load_matches(query, screenshots)
+
+    async def load_matches(self, query: str, screenshots: bool) -> List[Dict[str, Any]]:
+        """
+        The matches of a search, normally from the search cache.
+        """
+        payload = await self.search(query)
+        matches = payload.get("matches") if isinstance(payload, dict) else None
+        if not isinstance(matches, list):
+            return []
+        if screenshots:
+            return [m for m in matches if _has_screenshot(m)]
+        return matches
+
+    @cached("shodan", ttl=3600, max_entries=64, max_bytes=128 * 1024 * 1024, persist=True, key=lambda query: " ".join(query.split()))
+    async def search(self, query: str) -> Dict[str, Any]:
+        """
+        Run a Shodan host search (first 100 results). Every search costs query credits,
+        so results are cached for an hour, across restarts.
+
+        :raises UpstreamError: If Shodan does not answer with 200, with its error message.
+        """
+        params = {
+            "key": self.bot.config.shodan_key,
+            "query": query,
+            "limit": 100,
+        }
+        async with self.bot.http_client.get(SHODAN_SEARCH_URL, params=params) as resp:
+            if resp.status != 200:
+                try:
+                    err = await resp.json()
+                    err_msg = err.get("error") or err.get("message") or str(err)
+                except Exception:
+                    err_msg = await resp.text()
+                raise UpstreamError(resp.status, err_msg)
+            return await resp.json()
+
     @commands.hybrid_command(
         name="shodan",
         description='Search Shodan for a city screenshot (query: city:"<city>" has_screenshot:true)',
     )
     async def shodan(self, ctx, city: str = ""):
-        key = os.getenv("SHODAN_KEY")
+        key = self.bot.config.shodan_key
         if not key:
             embed = discord.Embed(
                 title="Shodan",
@@ -297,28 +391,15 @@ class Shodan(commands.Cog, name="shodan"):
         embed = discord.Embed(title="Shodan", description=f"Searching: `{query}`\nPlease wait...")
         msg = await ctx.reply(embed=embed)
 
-        params = {
-            "key": key,
-            "query": query,
-            "limit": 100,
-        }
-
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(SHODAN_SEARCH_URL, params=params) as resp:
-                    if resp.status != 200:
-                        try:
-                            err = await resp.json()
-                            err_msg = err.get("error") or err.get("message") or str(err)
-                        except Exception:
-                            err_msg = await resp.text()
-                        embed = discord.Embed(
-                            title="Shodan",
-                            description=f"Error from Shodan: `{resp.status}`\n{err_msg}",
-                        )
-                        await msg.edit(embed=embed)
-                        return
-                    payload = await resp.json()
+            payload = await self.search(query)
+        except UpstreamError as e:
+            embed = discord.Embed(
+                title="Shodan",
+                description=f"Error from Shodan: `{e.status}`\n{e.message}",
+            )
+            await msg.edit(embed=embed)
+            return
         except Exception as e:
             embed = discord.Embed(title="Shodan", description=f"Request failed: `{type(e).__name__}`")
             await msg.edit(embed=embed)
@@ -330,7 +411,7 @@ class Shodan(commands.Cog, name="shodan"):
             await msg.edit(embed=embed)
             return
 
-        screenshot_matches = [m for m in matches if _extract_screenshot(m)]
+        screenshot_matches = [m for m in matches if _has_screenshot(m)]
         if not screenshot_matches:
             embed = discord.Embed(
                 title="Shodan",
@@ -346,8 +427,10 @@ class Shodan(commands.Cog, name="shodan"):
             page=0,
             screenshots=True,
             query=query,
+            loader=self.matches_loader(query, True),
         )
         embed, files = await view.format_embed_and_files()
+        view.release()
         await msg.edit(embed=embed, attachments=files if files else [], view=view)
 
     @commands.hybrid_command(
@@ -355,7 +438,7 @@ class Shodan(commands.Cog, name="shodan"):
         description='Search Shodan for public Minecraft servers in a given city (query: city:"<city>" port:25565)',
     )
     async def mcserver(self, ctx, city: str = ""):
-        key = os.getenv("SHODAN_KEY")
+        key = self.bot.config.shodan_key
         if not key:
             embed = discord.Embed(
                 title="Shodan",
@@ -377,28 +460,15 @@ class Shodan(commands.Cog, name="shodan"):
         embed = discord.Embed(title="Minecraft Server Finder", description=f"Searching: `{query}`\nPlease wait...")
         msg = await ctx.reply(embed=embed)
 
-        params = {
-            "key": key,
-            "query": query,
-            "limit": 100,
-        }
-
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(SHODAN_SEARCH_URL, params=params) as resp:
-                    if resp.status != 200:
-                        try:
-                            err = await resp.json()
-                            err_msg = err.get("error") or err.get("message") or str(err)
-                        except Exception:
-                            err_msg = await resp.text()
-                        embed = discord.Embed(
-                            title="Minecraft Server Finder",
-                            description=f"Error from Shodan: `{resp.status}`\n{err_msg}",
-                        )
-                        await msg.edit(embed=embed)
-                        return
-                    payload = await resp.json()
+            payload = await self.search(query)
+        except UpstreamError as e:
+            embed = discord.Embed(
+                title="Minecraft Server Finder",
+                description=f"Error from Shodan: `{e.status}`\n{e.message}",
+            )
+            await msg.edit(embed=embed)
+            return
         except Exception as e:
             embed = discord.Embed(title="Minecraft Server Finder", description=f"Request failed: `{type(e).__name__}`")
             await msg.edit(embed=embed)
@@ -418,8 +488,10 @@ class Shodan(commands.Cog, name="shodan"):
             page=0,
             screenshots=False,
             query=query,
+            loader=self.matches_loader(query, False),
         )
         embed, files = await view.format_embed_and_files()
+        view.release()
         await msg.edit(embed=embed, attachments=files if files else [], view=view)
 
     @commands.hybrid_command(
@@ -427,7 +499,7 @@ class Shodan(commands.Cog, name="shodan"):
         description="Search Shodan with a custom query.",
     )
     async def shodan_query(self, ctx, *, query: str = ""):
-        key = os.getenv("SHODAN_KEY")
+        key = self.bot.config.shodan_key
         if not key:
             embed = discord.Embed(
                 title="Shodan",
@@ -456,28 +528,15 @@ class Shodan(commands.Cog, name="shodan"):
         embed = discord.Embed(title="Shodan", description=f"Searching: `{query}`\nPlease wait...")
         msg = await ctx.reply(embed=embed)
 
-        params = {
-            "key": key,
-            "query": query,
-            "limit": 100,
-        }
-
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(SHODAN_SEARCH_URL, params=params) as resp:
-                    if resp.status != 200:
-                        try:
-                            err = await resp.json()
-                            err_msg = err.get("error") or err.get("message") or str(err)
-                        except Exception:
-                            err_msg = await resp.text()
-                        embed = discord.Embed(
-                            title="Shodan",
-                            description=f"Error from Shodan: `{resp.status}`\n{err_msg}",
-                        )
-                        await msg.edit(embed=embed)
-                        return
-                    payload = await resp.json()
+            payload = await self.search(query)
+        except UpstreamError as e:
+            embed = discord.Embed(
+                title="Shodan",
+                description=f"Error from Shodan: `{e.status}`\n{e.message}",
+            )
+            await msg.edit(embed=embed)
+            return
         except Exception as e:
             embed = discord.Embed(title="Shodan", description=f"Request failed: `{type(e).__name__}`")
             await msg.edit(embed=embed)
@@ -490,7 +549,7 @@ class Shodan(commands.Cog, name="shodan"):
             return
 
         if screenshots:
-            screenshot_matches = [m for m in matches if _extract_screenshot(m)]
+            screenshot_matches = [m for m in matches if _has_screenshot(m)]
             if not screenshot_matches:
                 embed = discord.Embed(
                     title="Shodan",
@@ -506,8 +565,10 @@ class Shodan(commands.Cog, name="shodan"):
                 page=0,
                 screenshots=True,
                 query=query_orig,
+                loader=self.matches_loader(query, True),
             )
             embed, files = await view.format_embed_and_files()
+            view.release()
             await msg.edit(embed=embed, attachments=files if files else [], view=view)
         else:
             page_size = 10
@@ -518,8 +579,10 @@ class Shodan(commands.Cog, name="shodan"):
                 page=0,
                 screenshots=False,
                 query=query_orig,
+                loader=self.matches_loader(query, False),
             )
             embed, files = await view.format_embed_and_files()
+            view.release()
             await msg.edit(embed=embed, attachments=files if files else [], view=view)
 
 async def setup(bot) -> None:
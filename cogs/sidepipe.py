@@ -1,20 +1,15 @@
-import json
 import logging
-import os
 import re
 
 import discord
 from discord.ext import commands, tasks
 from discord.ext.commands import Context
-import aiohttp
 import io
 from mcstatus import JavaServer
+from helpers.cache import cached
 
 logger = logging.getLogger("Neurodivergence")
 
-POLL_INTERVAL = int(os.getenv("MINECRAFT_POLL_INTERVAL", "30"))
-OFFLINE_THRESHOLD = int(os.getenv("MINECRAFT_OFFLINE_THRESHOLD", "3"))  # consecutive failures before declaring offline
-
 # Minecraft § formatting code to hex color mapping (Java Edition)
 MC_COLOR_MAP = {
     "0": 0x000000,  # black
@@ -61,26 +56,81 @@ class Sidepipe(commands.Cog, name="sidepipe"):
         self.mc_servers = {}  # address -> set of player names
         self.mc_server_online = {}  # address -> bool
         self.mc_fail_count = {}  # address -> consecutive failure count
+        self.state = bot.store.namespace("sidepipe")
+        self._saved_mc_state = None
         self._load_mc_servers()
 
     def _load_mc_servers(self):
-        raw = os.getenv("MINECRAFT_SERVERS", "[]")
-        addresses = json.loads(raw)
+        addresses = self.bot.config.minecraft_servers
+        for addr in list(self.mc_servers):
+            if addr not in addresses:
+                del self.mc_servers[addr]
+                del self.mc_server_online[addr]
+                del self.mc_fail_count[addr]
         for addr in addresses:
-            self.mc_servers[addr] = set()
-            self.mc_server_online[addr] = None
-            self.mc_fail_count[addr] = 0
+            if addr not in self.mc_servers:
+                self.mc_servers[addr] = set()
+                self.mc_server_online[addr] = None
+                self.mc_fail_count[addr] = 0
+
+    async def _restore_mc_state(self):
+        """
+        Restore the players and online flags saved before the last restart, so the first
+        poll reports what changed in the meantime instead of starting over.
+        """
+        saved = await self.state.get("minecraft", {})
+        if not isinstance(saved, dict):
+            logger.warning(f"Ignoring the saved Minecraft server state, expected an object: {saved!r:.100}")
+            return
+        for addr, server in saved.items():
+            if addr not in self.mc_servers:
+                continue
+            players = server.get("players") if isinstance(server, dict) else None
+            if not isinstance(players, list):
+                logger.warning(f"Ignoring the saved state of Minecraft server {addr}: {server!r:.100}")
+                continue
+            online = server.get("online")
+            fails = server.get("fails", 0)
+            self.mc_servers[addr] = {str(player) for player in players}
+            self.mc_server_online[addr] = online if isinstance(online, bool) else None
+            self.mc_fail_count[addr] = fails if isinstance(fails, int) else 0
+        self._saved_mc_state = saved
+
+    def _save_mc_state(self):
+        state = {
+            addr: {
+                "players": sorted(players),
+                "online": self.mc_server_online[addr],
+                "fails": self.mc_fail_count[addr],
+            }
+            for addr, players in self.mc_servers.items()
+        }
+        if state != self._saved_mc_state:
+            self.state.set("minecraft", state)
+            self._saved_mc_state = state
 
     def _get_mc_channel(self):
-        channel_id = os.getenv("MINECRAFT_CHANNEL")
+        channel_id = self.bot.config.minecraft_channel
         if channel_id:
-            return self.bot.get_channel(int(channel_id))
+            return self.bot.get_channel(channel_id)
         return None
 
     async def cog_load(self):
+        await self._restore_mc_state()
+        self.poll_mc_servers.change_interval(seconds=self.bot.config.minecraft_poll_interval)
         if self.mc_servers:
             self.poll_mc_servers.start()
 
+    @commands.Cog.listener()
+    async def on_config_reload(self, old_config, new_config):
+        self._load_mc_servers()
+        if new_config.minecraft_poll_interval != old_config.minecraft_poll_interval:
+            self.poll_mc_servers.change_interval(seconds=new_config.minecraft_poll_interval)
+        if self.mc_servers and not self.poll_mc_servers.is_running():
+            self.poll_mc_servers.start()
+        elif not self.mc_servers and self.poll_mc_servers.is_running():
+            self.poll_mc_servers.cancel()
+
     async def cog_unload(self):
         self.poll_mc_servers.cancel()
 
@@ -99,25 +149,24 @@ class Sidepipe(commands.Cog, name="sidepipe"):
         embed = discord.Embed(title=f"CCTV Selfie - Camera {camera}", description=f"Please wait...")
         msg = await ctx.reply(embed=embed)
 
-        async with aiohttp.ClientSession() as session:
-                url = os.getenv("HASS_URL")
-                headers = {'Authorization': f'Bearer {os.getenv("HASS_TOKEN")}'}
-                async with session.get(url=f"{url}/api/camera_proxy/camera.{camera}", headers=headers) as response:
-                    if response.status != 200:
-                        embed = discord.Embed(title=f"CCTV Selfie - Camera {camera}", description=f"Error fetching image. f{response.status}")
-                        await msg.edit(embed=embed)
-                        return
-                    image_data = io.BytesIO(await response.read())
-                    await ctx.reply(file=discord.File(image_data, filename=f"{ctx.message.id}.jpg"))
-                    await msg.delete()
-
-    @tasks.loop(seconds=POLL_INTERVAL)
+        url = self.bot.config.hass_url
+        headers = {'Authorization': f'Bearer {self.bot.config.hass_token}'}
+        async with self.bot.http_client.get(f"{url}/api/camera_proxy/camera.{camera}", headers=headers) as response:
+            if response.status != 200:
+                embed = discord.Embed(title=f"CCTV Selfie - Camera {camera}", description=f"Error fetching image. f{response.status}")
+                await msg.edit(embed=embed)
+                return
+            image_data = io.BytesIO(await response.read())
+            await ctx.reply(file=discord.File(image_data, filename=f"{ctx.message.id}.jpg"))
+            await msg.delete()
+
+    @tasks.loop(seconds=30)
     async def poll_mc_servers(self):
         channel = self._get_mc_channel()
         if not channel:
             return
 
-        for address in self.mc_servers:
+        for address in list(self.mc_servers):
             try:
                 server = await JavaServer.async_lookup(address)
                 status = await server.async_status()
@@ -171,10 +220,10 @@ class Sidepipe(commands.Cog, name="sidepipe"):
                 self.mc_fail_count[address] += 1
                 logger.warning(
                     f"Failed to poll Minecraft server {address} "
-                    f"({self.mc_fail_count[address]}/{OFFLINE_THRESHOLD}): {e}"
+                    f"({self.mc_fail_count[address]}/{self.bot.config.minecraft_offline_threshold}): {e}"
                 )
 
-                if self.mc_fail_count[address] >= OFFLINE_THRESHOLD:
+                if self.mc_fail_count[address] >= self.bot.config.minecraft_offline_threshold:
                     if self.mc_server_online[address] is True:
                         embed = discord.Embed(
                             description=f"**{address}** appears to be offline",
@@ -184,10 +233,21 @@ class Sidepipe(commands.Cog, name="sidepipe"):
                     self.mc_server_online[address] = False
                     self.mc_servers[address] = set()
 
+        self._save_mc_state()
+
     @poll_mc_servers.before_loop
     async def before_mc_poll(self):
         await self.bot.wait_until_ready()
 
+    @cached("mcstatus", ttl=15, max_entries=128)
+    async def fetch_server_status(self, address: str):
+        """
+        Ping a Minecraft server. Successful answers are cached briefly so a channel asking
+        at once only pings the server once; the poll loop always pings.
+        """
+        server = await JavaServer.async_lookup(address)
+        return await server.async_status()
+
     @commands.hybrid_command(
         name="mcstatus",
         description="Check the status of a monitored Minecraft server",
@@ -201,8 +261,7 @@ class Sidepipe(commands.Cog, name="sidepipe"):
 
         for addr in targets:
             try:
-                server = await JavaServer.async_lookup(addr)
-                status = await server.async_status()
+                status = await self.fetch_server_status(addr)
 
                 motd_raw = str(status.description) if status.description else ""
                 motd_color = get_motd_color(motd_raw)
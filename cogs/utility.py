@@ -1,11 +1,12 @@
 import discord
 from discord.ext import commands
 from discord.ext.commands import Context
-import aiohttp
 from bs4 import BeautifulSoup
 import re
-import os
 import urllib.parse
+from typing import List, Optional, Tuple
+from helpers.cache import cached
+from helpers.http import UpstreamError
 
 headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:133.0) Gecko/20100101 Firefox/133.0'}
 
@@ -13,6 +14,33 @@ class Utility(commands.Cog, name="utility"):
     def __init__(self, bot) -> None:
         self.bot = bot
 
+    @cached("weather", ttl=600, stale_ttl=1800, negative_ttl=300, persist=True)
+    async def fetch_weather(self, town: str, state: str) -> Optional[dict]:
+        """
+        Scrape today's forecast from the BOM. Returns None when the page has no forecast.
+
+        :raises UpstreamError: If the BOM does not answer with 200.
+        """
+        url = f"http://reg.bom.gov.au/{state}/forecasts/{town}.shtml"
+        async with self.bot.http_client.get(url, headers=headers) as response:
+            if response.status != 200:
+                raise UpstreamError(response.status)
+            html = await response.text()
+        soup = BeautifulSoup(html, "html.parser")
+
+        # Find the main weather div
+        div_element = soup.find("div", class_="day main")
+        if not div_element:
+            return None
+
+        # Extract weather information
+        return {
+            "summary": div_element.find('dd', class_="summary").text,
+            "max_temp": div_element.find('em', class_="max").text,
+            "rainfall_chance": div_element.find('em', class_="pop").text,
+            "description": div_element.find('p').text,
+        }
+
     @commands.hybrid_command(
         name="weather",
         description="See the current weather (Australia)",
@@ -21,34 +49,23 @@ class Utility(commands.Cog, name="utility"):
         embed = discord.Embed(title=f"BOM Weather - {town.capitalize()}", description="Please wait...")
         msg = await ctx.send(embed=embed)
 
-        async with aiohttp.ClientSession() as session:
-            url = f"http://reg.bom.gov.au/{state}/forecasts/{town}.shtml"
-            async with session.get(url, headers=headers) as response:
-                if response.status != 200:
-                    embed = discord.Embed(title="Weather", description=f"Failed to retrieve weather. {response.status}")
-                    await msg.edit(embed=embed)
-                    return
-                soup = BeautifulSoup(await response.text(), "html.parser")
-
-                # Find the main weather div
-                div_element = soup.find("div", class_="day main")
-                if not div_element:
-                    embed = discord.Embed(title="Weather", description="No weather information found for this location.")
-                    await msg.edit(embed=embed)
-                    return
-
-                # Extract weather information
-                summary = div_element.find('dd', class_="summary").text
-                max_temp = div_element.find('em', class_="max").text
-                rainfall_chance = div_element.find('em', class_="pop").text
-                description = div_element.find('p').text
-
-                # Create and send the embed with weather information
-                embed = discord.Embed(title=f"BOM Weather - {town.capitalize()}")
-                embed.add_field(name="Max Temp", value=f"{max_temp}°C", inline=True)
-                embed.add_field(name="Chance of any rain", value=f"{rainfall_chance}", inline=True)
-                embed.add_field(name=f"{summary}", value=f"{description}", inline=False)
-                await msg.edit(embed=embed)
+        try:
+            forecast = await self.fetch_weather(town, state)
+        except UpstreamError as e:
+            embed = discord.Embed(title="Weather", description=f"Failed to retrieve weather. {e.status}")
+            await msg.edit(embed=embed)
+            return
+        if forecast is None:
+            embed = discord.Embed(title="Weather", description="No weather information found for this location.")
+            await msg.edit(embed=embed)
+            return
+
+        # Create and send the embed with weather information
+        embed = discord.Embed(title=f"BOM Weather - {town.capitalize()}")
+        embed.add_field(name="Max Temp", value=f"{forecast['max_temp']}°C", inline=True)
+        embed.add_field(name="Chance of any rain", value=f"{forecast['rainfall_chance']}", inline=True)
+        embed.add_field(name=f"{forecast['summary']}", value=f"{forecast['description']}", inline=False)
+        await msg.edit(embed=embed)
 
     @commands.hybrid_command(
         name="pl",
@@ -58,30 +75,59 @@ class Utility(commands.Cog, name="utility"):
         embed = discord.Embed(title=f"Person Lookup - {query.capitalize()}", description="Please wait...")
         msg = await ctx.reply(embed=embed)
 
-        async with aiohttp.ClientSession() as session:
-            url = f"https://personlookup.com.au/search?page=1&q={query}&suburb={suburb}&state={state}"
-            async with session.get(url, headers=headers, proxy=os.getenv("HTTP_PROXY")) as response:
-                if response.status != 200:
-                    embed = discord.Embed(title=f"Person Lookup - {query.capitalize()}", description=f"Error fetching results. {response.status}")
-                    await msg.edit(embed=embed)
-                    return
-                soup = BeautifulSoup(await response.text(), "html.parser")
-
-                # Find all profile divs
-                profile_divs = soup.find("div", class_="col-12 col-md-8 order-first order-md-last mb-4 mb-md-0").find_all("div", class_="buttons-fix")
-                if not profile_divs:
-                    embed = discord.Embed(title=f"Person Lookup - {query.capitalize()}", description="No results found.")
-                    await msg.edit(embed=embed)
-                    return
-
-                # Iterate over each profile div and extract the relevant information then add to embed
-                embed = discord.Embed(title=f"Person Lookup - {query.capitalize()}")
-                for profile in profile_divs:
-                    name = profile.find("a", class_="stretched-link").text.strip()
-                    address = profile.find("div", class_="col-12 col-sm-6 col-md-8 col-lg-9 col-xl-6 mb-2 mb-sm-0").text.strip()
-                    phone = profile.find("div", class_="col-12 offset-0 col-sm-6 offset-sm-0 col-md-8 offset-md-4 col-lg-9 offset-lg-3 col-xl-3 offset-xl-0").text.strip()
-                    embed.add_field(name=name, value=f"{address}\n{phone}", inline=False)
+        url = f"https://personlookup.com.au/search?page=1&q={query}&suburb={suburb}&state={state}"
+        async with self.bot.http_client.get(url, headers=headers, proxy=self.bot.config.http_proxy) as response:
+            if response.status != 200:
+                embed = discord.Embed(title=f"Person Lookup - {query.capitalize()}", description=f"Error fetching results. {response.status}")
                 await msg.edit(embed=embed)
+                return
+            soup = BeautifulSoup(await response.text(), "html.parser")
+
+            # Find all profile divs
+            profile_divs = soup.find("div", class_="col-12 col-md-8 order-first order-md-last mb-4 mb-md-0").find_all("div", class_="buttons-fix")
+            if not profile_divs:
+                embed = discord.Embed(title=f"Person Lookup - {query.capitalize()}", description="No results found.")
+                await msg.edit(embed=embed)
+                return
+
+            # Iterate over each profile div and extract the relevant information then add to embed
+            embed = discord.Embed(title=f"Person Lookup - {query.capitalize()}")
+            for profile in profile_divs:
+                name = profile.find("a", class_="stretched-link").text.strip()
+                address = profile.find("div", class_="col-12 col-sm-6 col-md-8 col-lg-9 col-xl-6 mb-2 mb-sm-0").text.strip()
+                phone = profile.find("div", class_="col-12 offset-0 col-sm-6 offset-sm-0 col-md-8 offset-md-4 col-lg-9 offset-lg-3 col-xl-3 offset-xl-0").text.strip()
+                embed.add_field(name=name, value=f"{address}\n{phone}", inline=False)
+            await msg.edit(embed=embed)
+
+    @cached("fuel", ttl=900, stale_ttl=1800, negative_ttl=300, persist=True)
+    async def fetch_fuel_prices(self, town: str, state: str) -> Optional[List[Tuple[str, str]]]:
+        """
+        Scrape the cheapest stations from fuelprice.io as (name, price) pairs, low to high.
+        Returns None when the page lists no stations.
+
+        :raises UpstreamError: If fuelprice.io does not answer with 200.
+        """
+        url = f"https://fuelprice.io/{state}/{town}"
+        async with self.bot.http_client.get(url, headers=headers, proxy=self.bot.config.http_proxy) as response:
+            if response.status != 200:
+                raise UpstreamError(response.status)
+            html = await response.text()
+        soup = BeautifulSoup(html, "html.parser")
+
+        # Find all price divs
+        results_box = soup.find("ul", class_="cheapest-stations")
+        servo_divs = results_box.find_all("li") if results_box else []
+        if not servo_divs:
+            return None
+
+        # Iterate over each price div and extract the relevant information
+        prices = []
+        for servo in servo_divs:
+            name = servo.find("strong").text.strip()
+            price_text = servo.get_text(strip=True)
+            price = re.search(r'(\d+(?:\.\d+)?)', price_text).group()
+            prices.append((name, price))
+        return prices
 
     @commands.hybrid_command(
         name="fuel",
@@ -91,31 +137,34 @@ class Utility(commands.Cog, name="utility"):
         embed = discord.Embed(title=f"Fuel Prices - {town.capitalize()}", description="Please wait...")
         msg = await ctx.reply(embed=embed)
 
-        async with aiohttp.ClientSession() as session:
-            url = f"https://fuelprice.io/{state}/{town}"
-            async with session.get(url, headers=headers, proxy=os.getenv("HTTP_PROXY")) as response:
-                if response.status != 200:
-                    embed = discord.Embed(title=f"Fuel Prices - {town.capitalize()}", description=f"Error fetching fuel prices. {response.status}")
-                    await msg.edit(embed=embed)
-                    return
-            soup = BeautifulSoup(await response.text(), "html.parser")
+        try:
+            prices = await self.fetch_fuel_prices(town, state)
+        except UpstreamError as e:
+            embed = discord.Embed(title=f"Fuel Prices - {town.capitalize()}", description=f"Error fetching fuel prices. {e.status}")
+            await msg.edit(embed=embed)
+            return
+        if not prices:
+            embed = discord.Embed(title=f"Fuel Prices - {town.capitalize()}", description="No results found.")
+            await msg.edit(embed=embed)
+            return
 
-            # Find all price divs
-            results_box = soup.find("ul", class_="cheapest-stations")
-            servo_divs = results_box.find_all("li")
-            if not servo_divs:
-                embed = discord.Embed(title=f"Fuel Prices - {town.capitalize()}", description="No results found.")
-                await msg.edit(embed=embed)
-                return
+        embed = discord.Embed(title=f"Fuel Prices - {town.capitalize()}", description="low to high")
+        for name, price in prices:
+            embed.add_field(name=name, value=price, inline=False)
+        await msg.edit(embed=embed)
 
-            # Iterate over each price div and extract the relevant information then add to embed
-            embed = discord.Embed(title=f"Fuel Prices - {town.capitalize()}", description="low to high")
-            for servo in servo_divs:
-                name = servo.find("strong").text.strip()
-                price_text = servo.get_text(strip=True)
-                price = re.search(r'(\d+(?:\.\d+)?)', price_text).group()
-                embed.add_field(name=name, value=price, inline=False)
-            await msg.edit(embed=embed)
+    @cached("internetdb", ttl=3600, stale_ttl=3600, negative_ttl=600, persist=True)
+    async def fetch_internetdb(self, ip: str) -> dict:
+        """
+        Look an IP address up in Shodan InternetDB.
+
+        :raises UpstreamError: If InternetDB does not answer with 200 (404: nothing known).
+        """
+        url = f"https://internetdb.shodan.io/{ip}"
+        async with self.bot.http_client.get(url) as response:
+            if response.status != 200:
+                raise UpstreamError(response.status)
+            return await response.json()
 
     @commands.hybrid_command(
         name="openports",
@@ -125,19 +174,16 @@ class Utility(commands.Cog, name="utility"):
         embed = discord.Embed(title=f"Open ports - {ip}", description="Please wait...")
         msg = await ctx.reply(embed=embed)
 
-        async with aiohttp.ClientSession() as session:
-            url = f"https://internetdb.shodan.io/{ip}"
-            async with session.get(url) as response:
-                if response.status == 404:
-                    embed = discord.Embed(title=f"Open ports - {ip}", description="No information available for this IP address.")
-                    await msg.edit(embed=embed)
-                    return
-                elif response.status != 200:
-                    # Handle other potential errors
-                    embed = discord.Embed(title=f"Open ports - {ip}", description=f"An error occurred while fetching data. {response.status}")
-                    await msg.edit(embed=embed)
-                    return
-                shodan_json = await response.json()
+        try:
+            shodan_json = await self.fetch_internetdb(ip)
+        except UpstreamError as e:
+            if e.status == 404:
+                embed = discord.Embed(title=f"Open ports - {ip}", description="No information available for this IP address.")
+            else:
+                # Handle other potential errors
+                embed = discord.Embed(title=f"Open ports - {ip}", description=f"An error occurred while fetching data. {e.status}")
+            await msg.edit(embed=embed)
+            return
 
         if "detail" in shodan_json and shodan_json["detail"] == "No information available":
             embed = discord.Embed(title=f"Open ports - {ip}", description="No information available for this IP address.")
@@ -159,15 +205,14 @@ class Utility(commands.Cog, name="utility"):
         cleaned_plate = str(plate).strip().upper().replace(" ", "")
         embed = discord.Embed(title=f"Check Registration - {plate}", description="Please wait...")
         msg = await ctx.reply(embed=embed)
-        async with aiohttp.ClientSession() as session:
-            url = "https://account.ezyreg.sa.gov.au/r/veh/an/checkRegistration"
-            data = {"plateNumber": cleaned_plate, "registrationType": "VEHICLE"}
-            async with session.post(url, json=data) as response:
-                if response.status != 200:
-                    embed = discord.Embed(title=f"Check Registration - {plate}", description="No results found.")
-                    await msg.edit(embed=embed)
-                    return
-                ezyreg_json = await response.json()
+        url = "https://account.ezyreg.sa.gov.au/r/veh/an/checkRegistration"
+        data = {"plateNumber": cleaned_plate, "registrationType": "VEHICLE"}
+        async with self.bot.http_client.post(url, json=data) as response:
+            if response.status != 200:
+                embed = discord.Embed(title=f"Check Registration - {plate}", description="No results found.")
+                await msg.edit(embed=embed)
+                return
+            ezyreg_json = await response.json()
         if not ezyreg_json.get("checkRegistrationDetails") or not ezyreg_json["checkRegistrationDetails"]:
             embed = discord.Embed(title=f"Check Registration - {plate}", description="No results found.")
             await msg.edit(embed=embed)
@@ -0,0 +1,6 @@
+"""
+Shared building blocks used by ``bot.py`` and the cogs.
+
+Modules in here are plain Python (no ``setup()`` entry point), so they are never
+picked up by the cog loader.
+"""
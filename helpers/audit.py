@@ -0,0 +1,172 @@
+"""
+Batched command audit log for ``LOGGING_CHANNEL``.
+
+Command events are buffered in memory and flushed to the logging channel every few
+seconds, packing up to 10 embeds into one message, so running a command never waits on
+the logging channel's rate limit. Identical consecutive events are coalesced and, when
+the buffer overflows, the dropped/coalesced counts are reported with the next flush.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+from dataclasses import dataclass
+from typing import Deque, List, Optional
+
+import discord
+
+logger = logging.getLogger("Neurodivergence")
+
+# Discord limits for a single message.
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+
+
+@dataclass
+class AuditEvent:
+    key: tuple
+    embed: discord.Embed
+    count: int = 1
+
+    def render(self) -> discord.Embed:
+        if self.count > 1:
+            self.embed.set_footer(text=f"x{self.count}")
+        return self.embed
+
+
+class AuditSink:
+    """
+    Buffers audit embeds and sends them to a channel in the background.
+
+    :param bot: The bot, used to resolve the channel.
+    :param channel_id: The ID of the logging channel, or ``None`` to disable the sink.
+    :param flush_interval: Seconds between flushes.
+    :param max_buffer: Number of events kept before new events are dropped.
+    """
+
+    def __init__(self, bot, channel_id: Optional[int], *, flush_interval: float = 5.0, max_buffer: int = 200) -> None:
+        self.bot = bot
+        self.channel_id = channel_id
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: Deque[AuditEvent] = collections.deque()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self._unreported_dropped = 0
+        self._unreported_coalesced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.channel_id is not None
+
+    def submit(self, embed: discord.Embed, *, key: Optional[tuple] = None) -> None:
+        """
+        Queue an embed for the logging channel. Never blocks and never raises.
+
+        :param embed: The embed to send.
+        :param key: Events with the same key as the newest buffered event are merged into it.
+        """
+        if not self.enabled:
+            return
+        if key is not None and self._buffer and self._buffer[-1].key == key:
+            self._buffer[-1].count += 1
+            self.coalesced += 1
+            self._unreported_coalesced += 1
+            return
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            self._unreported_dropped += 1
+            return
+        self._buffer.append(AuditEvent(key=key or (id(embed),), embed=embed))
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="audit-sink")
+
+    async def close(self) -> None:
+        """
+        Stop the background task and send whatever is still buffered.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning(f"Could not flush the audit log on shutdown: {type(e).__name__}: {e}")
+
+    async def _run(self) -> None:
+        await self.bot.wait_until_ready()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Audit log flush failed: {type(e).__name__}: {e}")
+
+    def _take_batch(self) -> List[AuditEvent]:
+        batch: List[AuditEvent] = []
+        chars = 0
+        while self._buffer and len(batch) < MAX_EMBEDS_PER_MESSAGE:
+            size = len(self._buffer[0].embed)
+            if batch and chars + size > MAX_EMBED_CHARS_PER_MESSAGE:
+                break
+            chars += size
+            batch.append(self._buffer.popleft())
+        return batch
+
+    def _overflow_embed(self) -> Optional[discord.Embed]:
+        if not self._unreported_dropped:
+            return None
+        embed = discord.Embed(
+            title="Audit log overflow",
+            description=f"Dropped **{self._unreported_dropped}** and coalesced **{self._unreported_coalesced}** command events since the last report.",
+            color=0xE02B2B,
+        )
+        self._unreported_dropped = 0
+        self._unreported_coalesced = 0
+        return embed
+
+    async def flush(self) -> None:
+        """
+        Send every buffered event, backing off when Discord rate limits the channel.
+        """
+        if not self._buffer and not self._unreported_dropped:
+            return
+        channel = self.bot.get_channel(self.channel_id) if self.channel_id else None
+        if channel is None:
+            return
+
+        overflow = self._overflow_embed()
+        if overflow is not None:
+            self._buffer.appendleft(AuditEvent(key=("overflow",), embed=overflow))
+
+        backoff = 1.0
+        while self._buffer:
+            batch = self._take_batch()
+            try:
+                await channel.send(embeds=[event.render() for event in batch])
+            except discord.RateLimited as e:
+                self._buffer.extendleft(reversed(batch))
+                await asyncio.sleep(e.retry_after)
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    self._buffer.extendleft(reversed(batch))
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 60.0)
+                    continue
+                self.dropped += len(batch)
+                logger.warning(f"Dropping {len(batch)} audit event(s): {e.status} {e.text}")
+            else:
+                self.sent += len(batch)
+                backoff = 1.0
@@ -0,0 +1,445 @@
+"""
+In-memory TTL + LRU cache for upstream lookups.
+
+Cogs decorate the method that fetches and parses an upstream instead of caching in the
+command itself::
+
+    @cached("weather", ttl=600, stale_ttl=1800, negative_ttl=300)
+    async def fetch_weather(self, town: str, state: str) -> Optional[dict]:
+        ...
+
+The caches live on ``bot.caches`` (a ``CacheRegistry``), so their contents survive a cog
+reload. Each one has its own TTL and evicts the least recently used entries once it
+holds more than ``max_entries`` entries or ``max_bytes`` (estimated) bytes.
+
+- A fresh entry is returned without calling the upstream.
+- An entry younger than ``ttl + stale_ttl`` is returned at once and refreshed in the
+  background (stale-while-revalidate), so only the first caller after a long pause pays
+  for the scrape.
+- ``None`` results and ``UpstreamError``s with a status in ``negative_statuses`` (404 by
+  default) are cached for ``negative_ttl``; the error is raised again on a hit. Other
+  errors are never cached.
+
+Concurrent misses of the same key share one upstream request (``helpers/singleflight.py``);
+with the cache disabled the lookups are still coalesced through ``bot.http_client``.
+
+Caches created with ``persist=True`` also write their values to the state store
+(``helpers/store.py``) and look a miss up there before calling the upstream, so a
+restart or a redeploy does not start them cold. Only values ``json`` can encode persist.
+
+Hits, misses and evictions are counted per cache (``bot_cache_requests_total`` and the
+owner ``caches`` command). ``CACHE_ENABLED=false`` bypasses every cache. Cluster workers
+clear a cache on each other through the ``cache_invalidate`` IPC topic.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import functools
+import json
+import logging
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from helpers.http import UpstreamError
+from helpers.singleflight import SingleFlight
+
+logger = logging.getLogger("Neurodivergence")
+
+
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """
+    Rough number of bytes a parsed upstream payload takes: ``sys.getsizeof`` of the value
+    and, for containers, of their contents.
+    """
+    size = sys.getsizeof(value, 64)
+    if _depth > 6:
+        return size
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _depth + 1) for item in value)
+    elif hasattr(value, "__dict__"):
+        size += estimate_size(vars(value), _depth + 1)
+    return size
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    stale_hits: int = 0
+    negative_hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    restored: int = 0
+    refreshes: int = 0
+    refresh_errors: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        hits = self.hits + self.stale_hits + self.negative_hits + self.coalesced + self.restored
+        total = hits + self.misses
+        return hits / total if total else 0.0
+
+
+@dataclass
+class _Entry:
+    value: Any
+    stored_at: float
+    expires_at: float
+    stale_until: float
+    size: int
+    error: Optional[UpstreamError] = None
+    used_at: float = 0.0
+
+
+@dataclass
+class CachePolicy:
+    """
+    :param ttl: Seconds an entry is fresh.
+    :param stale_ttl: Seconds after ``ttl`` during which the stale entry is still served
+        while it is refreshed in the background.
+    :param negative_ttl: Seconds ``None`` results and negative errors are kept.
+    :param max_entries: Entries kept before the least recently used ones are evicted.
+    :param max_bytes: Estimated bytes kept before the least recently used ones are evicted.
+    :param negative_statuses: ``UpstreamError`` statuses that are cached.
+    :param persist: Also keep the values in the state store, across restarts.
+    """
+
+    ttl: float
+    stale_ttl: float = 0.0
+    negative_ttl: float = 0.0
+    max_entries: int = 256
+    max_bytes: Optional[int] = None
+    negative_statuses: Tuple[int, ...] = (404,)
+    persist: bool = False
+
+
+def _persisted_key(key: Hashable) -> str:
+    return json.dumps(list(key) if isinstance(key, tuple) else key, separators=(",", ":"))
+
+
+class AsyncTTLCache:
+    def __init__(self, name: str, policy: CachePolicy, *, registry: Optional["CacheRegistry"] = None) -> None:
+        self.name = name
+        self.policy = policy
+        self.stats = CacheStats()
+        self.size = 0
+        self._entries: "collections.OrderedDict[Hashable, _Entry]" = collections.OrderedDict()
+        self._refreshing: Dict[Hashable, asyncio.Task] = {}
+        self._inflight = SingleFlight(f"cache:{name}")
+        self._registry = registry
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def _persisted(self):
+        store = getattr(self._registry, "store", None)
+        if store is None or not self.policy.persist:
+            return None
+        return store.namespace(f"cache:{self.name}")
+
+    def _count(self, result: str) -> None:
+        if self._registry is not None:
+            self._registry.count(self.name, result)
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the cached value of ``key``, calling ``fetch`` on a miss.
+        """
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if now < entry.expires_at:
+                self._entries.move_to_end(key)
+                entry.used_at = now
+                if entry.error is not None or entry.value is None:
+                    self.stats.negative_hits += 1
+                    self._count("negative_hit")
+                else:
+                    self.stats.hits += 1
+                    self._count("hit")
+                return self._unwrap(entry)
+            if now < entry.stale_until:
+                self._entries.move_to_end(key)
+                entry.used_at = now
+                self.stats.stale_hits += 1
+                self._count("stale_hit")
+                self._refresh(key, fetch)
+                return self._unwrap(entry)
+            self._remove(key)
+
+        if self._inflight.pending(key):
+            self.stats.coalesced += 1
+            self._count("coalesced")
+        else:
+            self.stats.misses += 1
+            self._count("miss")
+        return await self._inflight.do(key, lambda: self._restore_or_fetch(key, fetch))
+
+    async def _restore_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        persisted = self._persisted
+        if persisted is not None:
+            try:
+                saved = await persisted.get(_persisted_key(key))
+            except Exception as e:
+                logger.warning(f"Reading cache '{self.name}' from the state store failed: {type(e).__name__}: {e}")
+                saved = None
+            if saved is not None:
+                age = max(0.0, time.time() - saved["fetched_at"])
+                if age < self.policy.ttl + self.policy.stale_ttl:
+                    self.stats.restored += 1
+                    self._count("restored")
+                    self._store(key, saved["value"], age=age, persist=False)
+                    if age >= self.policy.ttl:
+                        self._refresh(key, fetch)
+                    return saved["value"]
+        return await self._fetch(key, fetch)
+
+    @staticmethod
+    def _unwrap(entry: _Entry) -> Any:
+        if entry.error is not None:
+            # A new exception per hit, re-raising the cached one would chain tracebacks.
+            raise UpstreamError(entry.error.status, entry.error.message)
+        return entry.value
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await fetch()
+        except UpstreamError as e:
+            if e.status in self.policy.negative_statuses and self.policy.negative_ttl > 0:
+                self._store(key, None, error=e)
+            raise
+        self._store(key, value)
+        return value
+
+    def _refresh(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> None:
+        if key in self._refreshing:
+            return
+
+        async def refresh() -> None:
+            try:
+                await self._inflight.do(key, lambda: self._fetch(key, fetch))
+                self.stats.refreshes += 1
+            except Exception as e:
+                # The stale entry keeps being served until it runs out.
+                self.stats.refresh_errors += 1
+                logger.warning(f"Refreshing cache '{self.name}' failed: {type(e).__name__}: {e}")
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.create_task(refresh(), name=f"cache-refresh:{self.name}")
+
+    def _store(
+        self, key: Hashable, value: Any, *, error: Optional[UpstreamError] = None, age: float = 0.0, persist: bool = True
+    ) -> None:
+        now = time.monotonic()
+        negative = error is not None or value is None
+        if negative:
+            if self.policy.negative_ttl <= 0:
+                self._remove(key)
+                return
+            expires_at = stale_until = now + self.policy.negative_ttl
+        else:
+            expires_at = now + self.policy.ttl - age
+            stale_until = expires_at + self.policy.stale_ttl
+            persisted = self._persisted if persist else None
+            if persisted is not None:
+                persisted.set(
+                    _persisted_key(key),
+                    {"fetched_at": time.time() - age, "value": value},
+                    ttl=self.policy.ttl + self.policy.stale_ttl,
+                )
+        size = estimate_size(value) if error is None else 256
+        self._remove(key)
+        self._entries[key] = _Entry(value, now, expires_at, stale_until, size, error, used_at=now)
+        self.size += size
+        self._evict()
+        budget = getattr(self._registry, "budget", None)
+        if budget is not None:
+            budget.enforce()
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def _evict(self) -> None:
+        max_bytes = self.policy.max_bytes
+        while self._entries and (
+            len(self._entries) > self.policy.max_entries or (max_bytes is not None and self.size > max_bytes)
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self.size -= entry.size
+            self.stats.evictions += 1
+            self._count("eviction")
+
+    def lru_timestamp(self) -> Optional[float]:
+        for entry in self._entries.values():
+            return entry.used_at
+        return None
+
+    def evict_lru(self) -> int:
+        """
+        Drop the least recently used entry for the bot-wide memory budget.
+        """
+        if not self._entries:
+            return 0
+        _, entry = self._entries.popitem(last=False)
+        self.size -= entry.size
+        self.stats.evictions += 1
+        self._count("eviction")
+        return entry.size
+
+    def invalidate(self, prefix: Optional[Tuple] = None) -> int:
+        """
+        Drop every entry, or those whose key starts with the items of ``prefix``.
+        """
+        persisted = self._persisted
+        if prefix is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            self.size = 0
+            if persisted is not None:
+                persisted.clear()
+            return removed
+        if persisted is not None:
+            # '["adelaide"' matches the keys '["adelaide"]' and '["adelaide","sa"]'.
+            persisted.clear(_persisted_key(tuple(prefix))[:-1])
+        keys = [key for key in self._entries if isinstance(key, tuple) and key[:len(prefix)] == tuple(prefix)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    async def close(self) -> None:
+        tasks = list(self._refreshing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class CacheRegistry:
+    """
+    Every cache of the bot, by name.
+
+    :param metrics: Optional ``BotMetrics`` to count cache requests in.
+    :param store: Optional ``Store`` the caches created with ``persist=True`` write to.
+    :param budget: Optional ``MemoryBudget`` every cache is registered with.
+    """
+
+    def __init__(self, *, metrics=None, store=None, budget=None) -> None:
+        self.caches: Dict[str, AsyncTTLCache] = {}
+        self.enabled = True
+        self.store = store
+        self.budget = budget
+        self._requests = None
+        if metrics is not None:
+            self._requests = metrics.registry.counter(
+                "bot_cache_requests_total", "Cache lookups by cache and result.", ("cache", "result")
+            )
+
+    def count(self, name: str, result: str) -> None:
+        if self._requests is not None:
+            self._requests.inc(cache=name, result=result)
+
+    def get(self, name: str, policy: CachePolicy) -> AsyncTTLCache:
+        """
+        Return the cache called ``name``, creating it with ``policy`` on first use. A cog
+        that is reloaded with a new policy keeps the entries and uses the new policy.
+        """
+        cache = self.caches.get(name)
+        if cache is None:
+            cache = AsyncTTLCache(name, policy, registry=self)
+            self.caches[name] = cache
+            if self.budget is not None:
+                self.budget.register(f"cache:{name}", cache)
+        elif cache.policy != policy:
+            cache.policy = policy
+            cache._evict()
+        return cache
+
+    def invalidate(self, name: Optional[str] = None, prefix: Optional[Tuple] = None) -> int:
+        """
+        Clear one cache (optionally only the keys starting with ``prefix``) or all of them.
+        Returns the number of entries dropped.
+        """
+        if name is None:
+            return sum(cache.invalidate() for cache in self.caches.values())
+        cache = self.caches.get(name)
+        if cache is None:
+            # Not used since the restart, but it may still have persisted values.
+            if self.store is not None:
+                self.store.clear(f"cache:{name}", _persisted_key(tuple(prefix))[:-1] if prefix else None)
+            return 0
+        return cache.invalidate(prefix)
+
+    async def close(self) -> None:
+        for cache in self.caches.values():
+            await cache.close()
+
+
+def _normalize(value: Any) -> Hashable:
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(item) for item in value)
+    return value
+
+
+def cached(
+    name: str,
+    *,
+    ttl: float,
+    stale_ttl: float = 0.0,
+    negative_ttl: float = 0.0,
+    max_entries: int = 256,
+    max_bytes: Optional[int] = None,
+    negative_statuses: Tuple[int, ...] = (404,),
+    persist: bool = False,
+    key: Optional[Callable[..., Hashable]] = None,
+):
+    """
+    Cache the results of an ``async def fetch_x(self, ...)`` method of a cog in
+    ``self.bot.caches``.
+
+    :param name: The name of the cache, e.g. ``"weather"``.
+    :param key: Builds the cache key from the call's arguments (without ``self``). By
+        default the positional and keyword arguments, with strings stripped and
+        lowercased, so ``Adelaide`` and ``adelaide `` share an entry.
+
+    See ``CachePolicy`` for the other parameters.
+    """
+    policy = CachePolicy(
+        ttl=ttl,
+        stale_ttl=stale_ttl,
+        negative_ttl=negative_ttl,
+        max_entries=max_entries,
+        max_bytes=max_bytes,
+        negative_statuses=tuple(negative_statuses),
+        persist=persist,
+    )
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args: Any, **kwargs: Any) -> Any:
+            if key is not None:
+                cache_key = key(*args, **kwargs)
+            else:
+                cache_key = tuple(_normalize(arg) for arg in args) + tuple(sorted((k, _normalize(v)) for k, v in kwargs.items()))
+            registry: Optional[CacheRegistry] = getattr(self.bot, "caches", None)
+            if registry is None or not registry.enabled:
+                http_client = getattr(self.bot, "http_client", None)
+                if http_client is None:
+                    return await func(self, *args, **kwargs)
+                return await http_client.coalesce((name, cache_key), lambda: func(self, *args, **kwargs))
+            return await registry.get(name, policy).get(cache_key, lambda: func(self, *args, **kwargs))
+
+        wrapper.__cache_name__ = name
+        return wrapper
+
+    return decorator
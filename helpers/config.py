@@ -0,0 +1,375 @@
+"""
+Typed bot configuration, parsed and validated once.
+
+``load_config()`` reads the repo-root ``.env`` (without overriding variables that are
+already set in the process environment), parses every value into the ``Config``
+dataclass and raises ``ConfigError`` listing every malformed value. The running bot keeps
+the result on ``bot.config``; ``DiscordBot.reload_config()`` (SIGHUP or the owner
+``reloadconfig`` command) builds a new ``Config`` and swaps it in without a restart.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_ENV_FILE = REPO_ROOT / ".env"
+
+# The process environment as it was before any .env file was applied. Reloads merge the
+# .env file under this snapshot so edits to .env are picked up while real environment
+# variables keep priority, as they do at startup.
+_PROCESS_ENV: Dict[str, str] = dict(os.environ)
+
+
+class ConfigError(Exception):
+    """
+    Raised when one or more configuration values are malformed.
+    """
+
+    def __init__(self, problems: List[str]) -> None:
+        self.problems = problems
+        super().__init__("; ".join(problems))
+
+
+def _strip_quotes(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and ((value[0] == value[-1] == '"') or (value[0] == value[-1] == "'")):
+        return value[1:-1]
+    return value
+
+
+def load_env_file(env_path: Path) -> Dict[str, str]:
+    """
+    Minimal .env loader.
+
+    - Supports KEY=VALUE pairs
+    - Ignores empty lines and lines starting with '#'
+    - Strips surrounding single/double quotes from values
+    - Does not expand variables
+    """
+    if not env_path.is_file():
+        return {}
+
+    loaded: Dict[str, str] = {}
+    for raw_line in env_path.read_text(encoding="utf-8").splitlines():
+        line = raw_line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        key = key.strip()
+        value = _strip_quotes(value)
+        if not key:
+            continue
+        loaded[key] = value
+    return loaded
+
+
+def apply_env(overrides: Mapping[str, str]) -> None:
+    """
+    Apply loaded .env values into os.environ without overwriting existing vars.
+    """
+    for k, v in overrides.items():
+        os.environ.setdefault(k, v)
+
+
+class _Parser:
+    """
+    Collects every problem instead of stopping at the first one.
+    """
+
+    def __init__(self, env: Mapping[str, str]) -> None:
+        self.env = env
+        self.problems: List[str] = []
+
+    def get_str(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        value = self.env.get(key)
+        if value is None or value.strip() == "":
+            return default
+        return value.strip()
+
+    def get_int(self, key: str, default: Optional[int] = None) -> Optional[int]:
+        value = self.get_str(key)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            self.problems.append(f"{key} must be an integer, got {value!r}")
+            return default
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        value = self.get_str(key)
+        if value is None:
+            return default
+        lowered = value.lower()
+        if lowered in ("1", "true", "yes", "on"):
+            return True
+        if lowered in ("0", "false", "no", "off"):
+            return False
+        self.problems.append(f"{key} must be a boolean, got {value!r}")
+        return default
+
+    def get_list(self, key: str, allow_wildcard: bool = False) -> Tuple[str, ...]:
+        value = self.get_str(key)
+        if value is None:
+            return ()
+        if allow_wildcard and value == "*":
+            return ("*",)
+        try:
+            parsed = json.loads(value)
+        except json.JSONDecodeError as e:
+            self.problems.append(f"{key} is not valid JSON ({e.msg} at position {e.pos})")
+            return ()
+        if not isinstance(parsed, list) or not all(isinstance(item, str) for item in parsed):
+            self.problems.append(f"{key} must be a JSON array of strings")
+            return ()
+        return tuple(parsed)
+
+    def get_int_list(self, key: str) -> Tuple[int, ...]:
+        value = self.get_str(key)
+        if value is None:
+            return ()
+        try:
+            parsed = json.loads(value)
+        except json.JSONDecodeError as e:
+            self.problems.append(f"{key} is not valid JSON ({e.msg} at position {e.pos})")
+            return ()
+        if not isinstance(parsed, list) or not all(isinstance(item, int) for item in parsed):
+            self.problems.append(f"{key} must be a JSON array of integers")
+            return ()
+        return tuple(parsed)
+
+
+@dataclass(frozen=True)
+class Config:
+    token: Optional[str] = field(default=None, repr=False)
+    statuses: Tuple[str, ...] = ()
+    logging_channel: Optional[int] = None
+
+    # Sharding / cluster mode. CLUSTER_* values are set by cluster.py for its workers.
+    sharding: bool = False
+    shard_count: Optional[int] = None
+    shard_ids: Tuple[int, ...] = ()
+    cluster_workers: Optional[int] = None
+    cluster_id: Optional[int] = None
+    cluster_ipc_address: Optional[str] = None
+    cluster_ipc_token: Optional[str] = field(default=None, repr=False)
+
+    # Extensions
+    lazy_cogs: Tuple[str, ...] = ()
+
+    # AI
+    gemini_keys: Tuple[str, ...] = field(default=(), repr=False)
+    gemini_key_rpm: Optional[int] = None
+    gemini_key_tpm: Optional[int] = None
+    media_workers: int = 2
+    gemini_context_cache: bool = True
+    gemini_context_ttl: int = 600
+    auto1111_hosts: Tuple[str, ...] = ()
+    lms_hosts: Tuple[str, ...] = ()
+
+    # Utility / Shodan
+    http_proxy: Optional[str] = None
+    geowifi_url: Optional[str] = None
+    shodan_key: Optional[str] = field(default=None, repr=False)
+
+    # Sidepipe
+    hass_url: Optional[str] = None
+    hass_token: Optional[str] = field(default=None, repr=False)
+    minecraft_servers: Tuple[str, ...] = ()
+    minecraft_channel: Optional[int] = None
+    minecraft_poll_interval: int = 30
+    minecraft_offline_threshold: int = 3
+
+    # Admission control
+    admission_max_in_flight: int = 50
+
+    # Seconds a SIGTERM waits for running commands before interrupting them
+    shutdown_timeout: int = 30
+
+    # Upstream response cache
+    cache_enabled: bool = True
+
+    # Memory (helpers/memory.py)
+    max_messages: int = 1000
+    member_cache: str = "voice"
+    memory_budget_mb: Optional[int] = None
+
+    # Persistent state (helpers/store.py)
+    state_db: str = "state/bot.db"
+
+    # Runtime
+    fast_runtime: bool = False
+
+    # Event loop monitor
+    loop_monitor: bool = True
+    loop_stall_threshold_ms: int = 250
+
+    # Metrics
+    metrics_host: str = "127.0.0.1"
+    metrics_port: Optional[int] = None
+
+    # Logging
+    log_file: str = "discord.log"
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backup_count: int = 5
+    log_rotate_when: Optional[str] = None
+    log_compress: bool = False
+    log_queue_size: int = 10000
+
+    source: Optional[str] = field(default=None, compare=False)
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str], *, source: Optional[str] = None) -> "Config":
+        """
+        Parse a configuration from an environment mapping.
+
+        :param env: The mapping to read, usually ``os.environ`` merged with ``.env``.
+        :param source: A description of where the values came from, for diagnostics.
+        :raises ConfigError: If any value is malformed.
+        """
+        p = _Parser(env)
+        gemini_keys = p.get_list("GEMINI_KEYS")
+        if not gemini_keys and p.get_str("GEMINI_KEY"):
+            gemini_keys = (p.get_str("GEMINI_KEY"),)
+        config = cls(
+            token=p.get_str("TOKEN"),
+            statuses=p.get_list("STATUSES"),
+            logging_channel=p.get_int("LOGGING_CHANNEL"),
+            sharding=p.get_bool("SHARDING"),
+            shard_count=p.get_int("SHARD_COUNT"),
+            shard_ids=p.get_int_list("SHARD_IDS"),
+            cluster_workers=p.get_int("CLUSTER_WORKERS"),
+            cluster_id=p.get_int("CLUSTER_ID"),
+            cluster_ipc_address=p.get_str("CLUSTER_IPC_ADDRESS"),
+            cluster_ipc_token=p.get_str("CLUSTER_IPC_TOKEN"),
+            lazy_cogs=p.get_list("LAZY_COGS", allow_wildcard=True),
+            gemini_keys=gemini_keys,
+            gemini_key_rpm=p.get_int("GEMINI_KEY_RPM"),
+            gemini_key_tpm=p.get_int("GEMINI_KEY_TPM"),
+            media_workers=p.get_int("MEDIA_WORKERS", 2),
+            gemini_context_cache=p.get_bool("GEMINI_CONTEXT_CACHE", True),
+            gemini_context_ttl=p.get_int("GEMINI_CONTEXT_TTL", 600),
+            auto1111_hosts=p.get_list("AUTO1111_HOSTS"),
+            lms_hosts=p.get_list("LMS_HOSTS"),
+            http_proxy=p.get_str("HTTP_PROXY"),
+            geowifi_url=p.get_str("GEOWIFI_URL"),
+            shodan_key=p.get_str("SHODAN_KEY"),
+            hass_url=p.get_str("HASS_URL"),
+            hass_token=p.get_str("HASS_TOKEN"),
+            minecraft_servers=p.get_list("MINECRAFT_SERVERS"),
+            minecraft_channel=p.get_int("MINECRAFT_CHANNEL"),
+            minecraft_poll_interval=p.get_int("MINECRAFT_POLL_INTERVAL", 30),
+            minecraft_offline_threshold=p.get_int("MINECRAFT_OFFLINE_THRESHOLD", 3),
+            admission_max_in_flight=p.get_int("ADMISSION_MAX_IN_FLIGHT", 50),
+            shutdown_timeout=p.get_int("SHUTDOWN_TIMEOUT", 30),
+            cache_enabled=p.get_bool("CACHE_ENABLED", True),
+            max_messages=p.get_int("MAX_MESSAGES", 1000),
+            member_cache=(p.get_str("MEMBER_CACHE", "voice") or "").lower(),
+            memory_budget_mb=p.get_int("MEMORY_BUDGET_MB"),
+            state_db=p.get_str("STATE_DB", "state/bot.db"),
+            fast_runtime=p.get_bool("FAST_RUNTIME"),
+            loop_monitor=p.get_bool("LOOP_MONITOR", True),
+            loop_stall_threshold_ms=p.get_int("LOOP_STALL_THRESHOLD_MS", 250),
+            metrics_host=p.get_str("METRICS_HOST", "127.0.0.1"),
+            metrics_port=p.get_int("METRICS_PORT"),
+            log_file=p.get_str("LOG_FILE", "discord.log"),
+            log_max_bytes=p.get_int("LOG_MAX_BYTES", 10 * 1024 * 1024),
+            log_backup_count=p.get_int("LOG_BACKUP_COUNT", 5),
+            log_rotate_when=p.get_str("LOG_ROTATE_WHEN"),
+            log_compress=p.get_bool("LOG_COMPRESS"),
+            log_queue_size=p.get_int("LOG_QUEUE_SIZE", 10000),
+            source=source,
+        )
+        if config.minecraft_poll_interval is not None and config.minecraft_poll_interval <= 0:
+            p.problems.append("MINECRAFT_POLL_INTERVAL must be positive")
+        if config.shard_ids and not config.shard_count:
+            p.problems.append("SHARD_IDS requires SHARD_COUNT")
+        if config.shard_count and any(not 0 <= shard_id < config.shard_count for shard_id in config.shard_ids):
+            p.problems.append("SHARD_IDS must be between 0 and SHARD_COUNT - 1")
+        if config.loop_stall_threshold_ms is not None and config.loop_stall_threshold_ms <= 0:
+            p.problems.append("LOOP_STALL_THRESHOLD_MS must be positive")
+        if config.admission_max_in_flight is not None and config.admission_max_in_flight < 0:
+            p.problems.append("ADMISSION_MAX_IN_FLIGHT must not be negative")
+        if config.shutdown_timeout is not None and config.shutdown_timeout < 0:
+            p.problems.append("SHUTDOWN_TIMEOUT must not be negative")
+        for name in ("gemini_key_rpm", "gemini_key_tpm"):
+            if getattr(config, name) is not None and getattr(config, name) <= 0:
+                p.problems.append(f"{name.upper()} must be positive")
+        if config.media_workers is not None and config.media_workers <= 0:
+            p.problems.append("MEDIA_WORKERS must be positive")
+        if config.gemini_context_ttl is not None and config.gemini_context_ttl <= 0:
+            p.problems.append("GEMINI_CONTEXT_TTL must be positive")
+        if config.max_messages is not None and config.max_messages < 0:
+            p.problems.append("MAX_MESSAGES must not be negative")
+        if config.member_cache not in ("voice", "none"):
+            p.problems.append(f"MEMBER_CACHE must be 'voice' or 'none', got {config.member_cache!r}")
+        if config.memory_budget_mb is not None and config.memory_budget_mb <= 0:
+            p.problems.append("MEMORY_BUDGET_MB must be positive")
+        if p.problems:
+            raise ConfigError(p.problems)
+        return config
+
+    @property
+    def sharded(self) -> bool:
+        """
+        Whether the bot runs as an ``AutoShardedBot``.
+        """
+        return self.sharding or bool(self.shard_count) or bool(self.shard_ids)
+
+    @property
+    def worker_log_file(self) -> str:
+        """
+        The log file of this process; cluster workers each get their own.
+        """
+        if self.cluster_id is None:
+            return self.log_file
+        root, ext = os.path.splitext(self.log_file)
+        return f"{root}.cluster{self.cluster_id}{ext}"
+
+    @property
+    def memory_budget(self) -> Optional[int]:
+        """
+        ``MEMORY_BUDGET_MB`` in bytes.
+        """
+        return self.memory_budget_mb * 1024 * 1024 if self.memory_budget_mb else None
+
+    @property
+    def state_db_path(self) -> str:
+        """
+        ``STATE_DB`` resolved against the repo root, or ``:memory:``.
+        """
+        if self.state_db == ":memory:":
+            return self.state_db
+        return str(REPO_ROOT / self.state_db)
+
+    def changed_fields(self, other: "Config") -> List[str]:
+        """
+        Return the names of the fields that differ between two configurations.
+        """
+        return [
+            f.name for f in fields(self)
+            if f.compare and getattr(self, f.name) != getattr(other, f.name)
+        ]
+
+
+def load_config(env_file: Path = DEFAULT_ENV_FILE, *, apply: bool = True) -> Config:
+    """
+    Read ``env_file`` and the process environment into a validated ``Config``.
+
+    :param env_file: The .env file to read. A missing file is not an error.
+    :param apply: Also copy the .env values into ``os.environ`` (without overriding).
+    :raises ConfigError: If any value is malformed.
+    """
+    file_values = load_env_file(env_file)
+    merged = {**file_values, **_PROCESS_ENV}
+    config = Config.from_env(merged, source=str(env_file))
+    if apply:
+        apply_env(file_values)
+    return config
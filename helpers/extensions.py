@@ -0,0 +1,344 @@
+"""
+Concurrent, instrumented cog loading with an optional lazy mode.
+
+Each cog file is scanned with ``ast`` (without importing it) to build a lightweight
+manifest: the cog name, its commands and descriptions, the third-party modules it
+imports and whether it has listeners or ``cog_load`` logic.
+
+Eager cogs have their third-party dependencies (bs4, PIL, mcstatus, ...) imported
+concurrently in worker threads before the extensions themselves are set up, so the
+slow imports overlap instead of running one after another. Import and setup timings
+are logged and kept on ``bot.extension_loader.timings``.
+
+Lazy cogs (``LAZY_COGS``) are registered from the manifest as placeholder prefix
+commands and the real module is only imported the first time one of its commands is
+used, either as a prefix command or through a slash command interaction. Cogs with
+listeners or a ``cog_load`` hook always load eagerly, since they must run without
+being invoked.
+
+The placeholders are prefix commands only, so the slash commands of a lazy cog are not
+in ``bot.tree`` until it is loaded. ``materialize_all`` must be awaited before the tree
+is synced, otherwise the sync removes those slash commands from Discord.
+"""
+
+from __future__ import annotations
+
+import ast
+import asyncio
+import importlib
+import logging
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+logger = logging.getLogger("Neurodivergence")
+
+_LOCAL_PACKAGES = {"cogs", "helpers"}
+
+
+@dataclass
+class CommandSpec:
+    name: str
+    description: str
+    hybrid: bool
+
+
+@dataclass
+class ExtensionManifest:
+    name: str
+    path: Path
+    cog_name: Optional[str] = None
+    commands: List[CommandSpec] = field(default_factory=list)
+    dependencies: Set[str] = field(default_factory=set)
+    needs_eager_load: bool = False
+
+    @property
+    def qualified_name(self) -> str:
+        return f"cogs.{self.name}"
+
+
+@dataclass
+class ExtensionTiming:
+    name: str
+    import_seconds: float = 0.0
+    setup_seconds: float = 0.0
+    lazy: bool = False
+    error: Optional[str] = None
+
+    @property
+    def total_seconds(self) -> float:
+        return self.import_seconds + self.setup_seconds
+
+
+def _decorator_name(node: ast.expr) -> Tuple[Optional[str], Optional[ast.Call]]:
+    call = node if isinstance(node, ast.Call) else None
+    func = call.func if call else node
+    if isinstance(func, ast.Attribute):
+        return func.attr, call
+    if isinstance(func, ast.Name):
+        return func.id, call
+    return None, call
+
+
+def _constant_kwarg(call: Optional[ast.Call], name: str) -> Optional[str]:
+    if call is None:
+        return None
+    for keyword in call.keywords:
+        if keyword.arg == name and isinstance(keyword.value, ast.Constant) and isinstance(keyword.value.value, str):
+            return keyword.value.value
+    return None
+
+
+def scan_extension(name: str, path: Path) -> ExtensionManifest:
+    """
+    Build the manifest of a cog module without importing it.
+
+    :param name: The extension name (the module name inside ``cogs``).
+    :param path: The ``.py`` file, or the package ``__init__.py``.
+    """
+    manifest = ExtensionManifest(name=name, path=path)
+    tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                manifest.dependencies.add(alias.name)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            manifest.dependencies.add(node.module)
+        elif isinstance(node, ast.ClassDef) and manifest.cog_name is None:
+            cog_name = next(
+                (kw.value.value for kw in node.keywords
+                 if kw.arg == "name" and isinstance(kw.value, ast.Constant)),
+                None,
+            )
+            if cog_name is None and not any(
+                isinstance(base, ast.Attribute) and base.attr == "Cog" for base in node.bases
+            ):
+                continue
+            manifest.cog_name = cog_name or node.name
+            for item in node.body:
+                if not isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    continue
+                if item.name in ("cog_load", "cog_unload"):
+                    manifest.needs_eager_load = True
+                for decorator in item.decorator_list:
+                    decorator_name, call = _decorator_name(decorator)
+                    if decorator_name == "listener":
+                        manifest.needs_eager_load = True
+                    elif decorator_name in ("hybrid_command", "command", "hybrid_group", "group"):
+                        manifest.commands.append(CommandSpec(
+                            name=_constant_kwarg(call, "name") or item.name,
+                            description=_constant_kwarg(call, "description") or "",
+                            hybrid=decorator_name.startswith("hybrid"),
+                        ))
+
+    # Only keep third-party modules; local packages and already imported modules
+    # (discord, stdlib used by the bot itself) need no warming.
+    manifest.dependencies = {
+        dependency for dependency in manifest.dependencies
+        if dependency.split(".")[0] not in _LOCAL_PACKAGES
+    }
+    return manifest
+
+
+def discover_extensions(cogs_dir: Path) -> List[ExtensionManifest]:
+    """
+    Find every cog module (``cogs/name.py``) or package (``cogs/name/__init__.py``).
+    """
+    manifests = []
+    for path in sorted(cogs_dir.iterdir()):
+        if path.is_file() and path.suffix == ".py" and not path.name.startswith("_"):
+            manifests.append(scan_extension(path.stem, path))
+        elif path.is_dir() and not path.name.startswith("_"):
+            init_py = path / "__init__.py"
+            if init_py.is_file():
+                manifests.append(scan_extension(path.name, init_py))
+    return manifests
+
+
+def _import_dependencies(dependencies: Set[str]) -> None:
+    for dependency in sorted(dependencies):
+        if dependency in sys.modules:
+            continue
+        try:
+            importlib.import_module(dependency)
+        except ImportError:
+            # The extension itself will fail to load and report the error properly.
+            pass
+
+
+class LazyCommandTree(app_commands.CommandTree):
+    """
+    Command tree that imports a lazy cog before an interaction for one of its slash
+    commands is looked up.
+    """
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.type in (discord.InteractionType.application_command, discord.InteractionType.autocomplete):
+            name = (interaction.data or {}).get("name")
+            loader = getattr(self.client, "extension_loader", None)
+            if name and loader is not None and self.get_command(name) is None:
+                await loader.materialize_command(name)
+        return True
+
+
+class ExtensionLoader:
+    """
+    Loads the cogs of a bot and keeps per-extension timings.
+
+    :param bot: The bot to load the cogs into.
+    :param cogs_dir: The directory containing the cogs.
+    :param lazy: Names of the cogs to load lazily, or ``{"*"}`` for every cog that allows it.
+    """
+
+    def __init__(self, bot: commands.Bot, cogs_dir: Path, lazy: Optional[Set[str]] = None) -> None:
+        self.bot = bot
+        self.cogs_dir = cogs_dir
+        self.lazy = set(lazy or ())
+        self.manifests: Dict[str, ExtensionManifest] = {}
+        self.timings: Dict[str, ExtensionTiming] = {}
+        self.pending: Dict[str, ExtensionManifest] = {}
+        self._command_index: Dict[str, str] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _wants_lazy(self, manifest: ExtensionManifest) -> bool:
+        if manifest.name == "owner":
+            return False
+        if manifest.name not in self.lazy and "*" not in self.lazy:
+            return False
+        if manifest.needs_eager_load or not manifest.commands or not manifest.cog_name:
+            if manifest.name in self.lazy:
+                logger.warning(f"Extension '{manifest.name}' has listeners or load hooks, loading it eagerly")
+            return False
+        return True
+
+    async def load_all(self) -> Dict[str, ExtensionTiming]:
+        """
+        Load every extension, importing the dependencies of eager ones concurrently.
+        """
+        self.manifests = {manifest.name: manifest for manifest in discover_extensions(self.cogs_dir)}
+        eager = [m for m in self.manifests.values() if not self._wants_lazy(m)]
+        lazy = [m for m in self.manifests.values() if self._wants_lazy(m)]
+
+        async def warm(manifest: ExtensionManifest) -> None:
+            started = time.perf_counter()
+            await asyncio.to_thread(_import_dependencies, manifest.dependencies)
+            self.timings[manifest.name] = ExtensionTiming(
+                name=manifest.name, import_seconds=time.perf_counter() - started
+            )
+
+        await asyncio.gather(*(warm(manifest) for manifest in eager))
+
+        # Setting up cogs stays sequential so `bot.cogs` (and the `cmds` listing) keep
+        # a stable, alphabetical order.
+        for manifest in eager:
+            await self._load(manifest)
+        for manifest in lazy:
+            await self._register_lazy(manifest)
+        return self.timings
+
+    async def _load(self, manifest: ExtensionManifest) -> bool:
+        timing = self.timings.setdefault(manifest.name, ExtensionTiming(name=manifest.name))
+        started = time.perf_counter()
+        try:
+            await self.bot.load_extension(manifest.qualified_name)
+        except Exception as e:
+            timing.error = f"{type(e).__name__}: {e}"
+            self.bot.logger.error(f"Failed to load extension {manifest.name}\n{timing.error}")
+            return False
+        finally:
+            timing.setup_seconds = time.perf_counter() - started
+        self.bot.logger.info(
+            f"Loaded extension '{manifest.name}' "
+            f"(imports {timing.import_seconds * 1000:.0f}ms, setup {timing.setup_seconds * 1000:.0f}ms)"
+        )
+        return True
+
+    async def _register_lazy(self, manifest: ExtensionManifest) -> None:
+        loader = self
+
+        class LazyCog(commands.Cog, name=manifest.cog_name):
+            async def placeholder(self, context: commands.Context, *, arguments: Optional[str] = None) -> None:
+                await loader.materialize(manifest.name)
+                new_context = await loader.bot.get_context(context.message)
+                await loader.bot.invoke(new_context)
+
+        stub_commands = []
+        for spec in manifest.commands:
+            stub = commands.Command(
+                LazyCog.placeholder,
+                name=spec.name,
+                description=spec.description,
+                extras={"lazy_stub": True},
+            )
+            stub_commands.append(stub)
+            self._command_index[spec.name] = manifest.name
+
+        cog = LazyCog()
+        cog.__cog_commands__ = tuple(stub_commands)
+        await self.bot.add_cog(cog)
+        self.pending[manifest.name] = manifest
+        self.timings[manifest.name] = ExtensionTiming(name=manifest.name, lazy=True)
+        self.bot.logger.info(f"Registered lazy extension '{manifest.name}' ({len(stub_commands)} commands)")
+
+    async def materialize(self, name: str) -> bool:
+        """
+        Replace the placeholder commands of a lazy extension with the real cog.
+
+        :param name: The extension name.
+        :return: Whether the real extension is loaded afterwards.
+        """
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            manifest = self.pending.get(name)
+            if manifest is None:
+                return f"cogs.{name}" in self.bot.extensions
+            started = time.perf_counter()
+            await asyncio.to_thread(_import_dependencies, manifest.dependencies)
+            self.timings[name].import_seconds = time.perf_counter() - started
+            await self.bot.remove_cog(manifest.cog_name)
+            del self.pending[name]
+            loaded = await self._load(manifest)
+            if not loaded:
+                # Put the placeholders back so the next invocation can try again.
+                await self._register_lazy(manifest)
+            return loaded
+
+    async def materialize_all(self) -> List[str]:
+        """
+        Load every pending lazy extension, so that ``bot.tree`` holds all the slash
+        commands before it is synced.
+
+        :return: The extensions that failed to load.
+        """
+        failed = []
+        for name in list(self.pending):
+            if not await self.materialize(name):
+                failed.append(name)
+        return failed
+
+    async def materialize_command(self, command_name: str) -> bool:
+        """
+        Load the lazy extension that provides ``command_name``, if there is one.
+        """
+        name = self._command_index.get(command_name)
+        if name is None or name not in self.pending:
+            return False
+        return await self.materialize(name)
+
+    async def load(self, name: str) -> None:
+        """
+        Load an extension by name, replacing its placeholders if it was registered lazily.
+        Used by the owner ``load`` command.
+        """
+        if name in self.pending:
+            if not await self.materialize(name):
+                raise commands.ExtensionFailed(f"cogs.{name}", RuntimeError(self.timings[name].error))
+            return
+        await self.bot.load_extension(f"cogs.{name}")
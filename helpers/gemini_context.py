@@ -0,0 +1,341 @@
+"""
+Cached prompt prefixes for Gemini, through the cachedContents API.
+
+Every neuro reply sends the same persona and nearly the same chat history. ``ContextCache``
+keeps that prefix (the system instruction and the history up to some message) in a Gemini
+cached content per channel, so a mention only sends the messages that arrived since::
+
+    cached = await self.bot.gemini_context.resolve(lease, model, prefix)
+    if cached is not None:
+        data = {"cachedContent": cached.name, "contents": [{"parts": [{"text": cached.delta + prompt}]}]}
+
+- A channel's prefix is cached on its second mention within ``ttl`` seconds. A channel
+  mentioned once is sent in full, as creating a cache bills its tokens once more.
+- The prefix is used while fewer than ``refresh_after`` messages arrived after it. Past
+  that, it is cached again with the current history and the old cache is deleted. Its
+  lifetime is extended by ``ttl`` when it is used in the second half of it.
+- Cached contents belong to the project of the API key, so prefixes are kept per key.
+  ``keys_for`` tells the key pool which keys already hold one for a channel.
+- ``resolve`` returns ``None`` when the request should be sent in full, as before: the
+  channel is cold, the prefix is under ``MIN_TOKENS`` (Gemini refuses it), or Gemini
+  refused to cache for that key and model recently.
+
+The owner ``contextcache`` command shows the hit rate and the input tokens served from the
+caches.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiohttp
+
+from helpers.http import UpstreamError
+from helpers.singleflight import SingleFlight
+
+logger = logging.getLogger("Neurodivergence")
+
+CACHE_URL = "https://generativelanguage.googleapis.com/v1beta/cachedContents"
+# Gemini does not cache prefixes of fewer tokens.
+MIN_TOKENS = 1024
+# A cache this close to its expiry is not used any more.
+EXPIRY_MARGIN = 30.0
+# Seconds Gemini's refusal to cache is remembered for.
+REFUSED_FOR = 600.0
+HISTORY_HEADER = "\n\nhere's the recent chat history for context:\n\n"
+NEWER_HEADER = "newer messages in the chat:\n\n"
+
+
+def _lines(history) -> str:
+    return "\n".join(f"{author}: {content}" for _, author, content in history)
+
+
+def _newer(prefix: "PromptPrefix", entry: "_Entry") -> list:
+    return [message for message in prefix.history if message[0] > entry.last_id]
+
+
+def _cached(entry: "_Entry", delta: list) -> "CachedPrefix":
+    return CachedPrefix(entry.name, NEWER_HEADER + _lines(delta) + "\n\n" if delta else "")
+
+
+@dataclass(frozen=True)
+class PromptPrefix:
+    """
+    The stable start of a request.
+
+    :param scope: What the prefix is cached per, the channel ID.
+    :param system: The system instruction.
+    :param history: The channel's messages as (message ID, author name, content), oldest first.
+    """
+
+    scope: int
+    system: str
+    history: Tuple[Tuple[int, str, str], ...]
+
+    def full_text(self) -> str:
+        """
+        The system instruction with the whole history, for requests sent in full.
+        """
+        return self.system + HISTORY_HEADER + _lines(self.history)
+
+
+@dataclass(frozen=True)
+class CachedPrefix:
+    """
+    :param name: The cached content to refer to, ``cachedContents/...``.
+    :param delta: The messages after the cached ones, to send before the prompt.
+    """
+
+    name: str
+    delta: str
+
+
+@dataclass
+class _Entry:
+    name: str
+    key: str
+    model: str
+    system: str
+    last_id: int
+    tokens: int
+    expires_at: float
+    extending: bool = False
+
+
+@dataclass
+class ContextCacheStats:
+    hits: int = 0
+    misses: int = 0
+    created: int = 0
+    extended: int = 0
+    failures: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def cached_share(self) -> float:
+        """
+        The share of the input tokens that were served from the caches.
+        """
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+
+class ContextCache:
+    """
+    :param http_client: The bot's ``HTTPClient``.
+    :param ttl: Seconds a cache lives after it is created or extended.
+    :param refresh_after: Messages after the cached ones before the prefix is cached again.
+    :param max_scopes: Channels with caches at once; the least recently used are dropped.
+    :param metrics: Optional ``BotMetrics`` the outcomes are counted in.
+    """
+
+    def __init__(self, http_client, *, ttl: int = 600, refresh_after: int = 25, max_scopes: int = 256, metrics=None) -> None:
+        self.http_client = http_client
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.max_scopes = max_scopes
+        self.enabled = True
+        self.stats = ContextCacheStats()
+        # scope -> key fingerprint -> entry, least recently used scope first
+        self._scopes: "collections.OrderedDict[int, Dict[str, _Entry]]" = collections.OrderedDict()
+        # scope -> time.monotonic() of its last request
+        self._seen: "collections.OrderedDict[int, float]" = collections.OrderedDict()
+        # (key fingerprint, model or scope) -> time.monotonic() until which caching is not tried
+        self._refused: Dict[Tuple[str, object], float] = {}
+        self._creating = SingleFlight("gemini_context")
+        self._background: Set[asyncio.Task] = set()
+        self._closed = False
+        self._outcomes = None
+        if metrics is not None:
+            self._outcomes = metrics.registry.counter(
+                "bot_gemini_context_cache_total", "Gemini requests by use of a cached prefix.", ("outcome",)
+            )
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._scopes.values())
+
+    def keys_for(self, scope: int) -> List[str]:
+        """
+        The keys that hold a cache of ``scope``'s prefix.
+        """
+        now = time.monotonic()
+        return [entry.key for entry in self._scopes.get(scope, {}).values() if entry.expires_at - EXPIRY_MARGIN > now]
+
+    async def resolve(self, lease, model: str, prefix: PromptPrefix) -> Optional[CachedPrefix]:
+        """
+        The cached prefix to use for a request with ``lease``'s key, creating or
+        refreshing it when worthwhile, or ``None`` to send the request in full.
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        fingerprint = lease.state.fingerprint
+        seen = self._seen.pop(prefix.scope, None)
+        self._seen[prefix.scope] = now
+        while len(self._seen) > self.max_scopes * 4:
+            self._seen.popitem(last=False)
+
+        entries = self._scopes.get(prefix.scope)
+        entry = entries.get(fingerprint) if entries else None
+        if entries is not None:
+            self._scopes.move_to_end(prefix.scope)
+        if entry is not None and entry.model == model and entry.system == prefix.system and entry.expires_at - EXPIRY_MARGIN > now:
+            delta = _newer(prefix, entry)
+            if len(delta) < self.refresh_after:
+                self._count("hit")
+                if entry.expires_at - now < self.ttl / 2 and not entry.extending:
+                    entry.extending = True
+                    self._spawn(self._extend(lease.key, entry))
+                return _cached(entry, delta)
+
+        if seen is None or now - seen > self.ttl:
+            return self._miss("cold")
+        if self._refused.get((fingerprint, model), 0) > now or self._refused.get((fingerprint, prefix.scope), 0) > now:
+            return self._miss("refused")
+        if not prefix.history or lease.pool.estimate_tokens(prefix.full_text()) < MIN_TOKENS:
+            return self._miss("small")
+        try:
+            created = await self._creating.do(
+                (fingerprint, prefix.scope), lambda: self._create(lease.key, fingerprint, model, prefix)
+            )
+        except (UpstreamError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.info(f"Could not cache the Gemini context of {prefix.scope}, sending it in full: {e}")
+            self.stats.failures += 1
+            return self._miss("failed")
+        if created.model != model or created.system != prefix.system:
+            # Joined the creation of another request whose prefix does not fit this one.
+            return self._miss("mismatch")
+        self._miss("created")
+        # Requests that joined the creation may have messages newer than the cached ones.
+        return _cached(created, _newer(prefix, created))
+
+    def invalidate(self, lease, scope: int) -> None:
+        """
+        Forget the cache of ``scope`` for ``lease``'s key, e.g. Gemini no longer has it.
+        """
+        entries = self._scopes.get(scope)
+        if entries is not None:
+            entries.pop(lease.state.fingerprint, None)
+
+    def record_usage(self, usage: dict) -> None:
+        """
+        Count the input tokens of a response's ``usageMetadata``.
+        """
+        self.stats.prompt_tokens += usage.get("promptTokenCount", 0)
+        self.stats.cached_tokens += usage.get("cachedContentTokenCount", 0)
+
+    def _miss(self, outcome: str) -> None:
+        self._count(outcome)
+        return None
+
+    def _count(self, outcome: str) -> None:
+        if outcome == "hit":
+            self.stats.hits += 1
+        else:
+            self.stats.misses += 1
+        if self._outcomes is not None:
+            self._outcomes.inc(outcome=outcome)
+
+    async def _create(self, key: str, fingerprint: str, model: str, prefix: PromptPrefix) -> _Entry:
+        body = {
+            "model": f"models/{model}",
+            "systemInstruction": {"parts": [{"text": prefix.system}]},
+            "contents": [{"role": "user", "parts": [{"text": HISTORY_HEADER.lstrip() + _lines(prefix.history)}]}],
+            "ttl": f"{self.ttl}s",
+        }
+        async with self.http_client.post(f"{CACHE_URL}?key={key}", json=body, pool="ai") as response:
+            if response.status != 200:
+                message = await response.text()
+                now = time.monotonic()
+                if len(self._refused) > 1024:
+                    self._refused = {name: until for name, until in self._refused.items() if until > now}
+                if response.status == 400:
+                    # Usually a prefix under the model's minimum: retry once the channel grew.
+                    self._refused[(fingerprint, prefix.scope)] = now + REFUSED_FOR
+                elif response.status in (403, 404):
+                    # The model or the key's project cannot cache.
+                    self._refused[(fingerprint, model)] = now + REFUSED_FOR
+                raise UpstreamError(response.status, message)
+            cached = await response.json()
+
+        entry = _Entry(
+            name=cached["name"],
+            key=key,
+            model=model,
+            system=prefix.system,
+            last_id=prefix.history[-1][0],
+            tokens=cached.get("usageMetadata", {}).get("totalTokenCount", 0),
+            expires_at=time.monotonic() + self.ttl,
+        )
+        entries = self._scopes.setdefault(prefix.scope, {})
+        self._scopes.move_to_end(prefix.scope)
+        previous = entries.get(fingerprint)
+        entries[fingerprint] = entry
+        self.stats.created += 1
+        if previous is not None:
+            self._spawn(self._delete(previous))
+        while len(self._scopes) > self.max_scopes:
+            _, dropped = self._scopes.popitem(last=False)
+            for old in dropped.values():
+                self._spawn(self._delete(old))
+        return entry
+
+    async def _extend(self, key: str, entry: _Entry) -> None:
+        try:
+            async with self.http_client.request(
+                "PATCH", f"{CACHE_URL}/{entry.name.rpartition('/')[2]}?key={key}", json={"ttl": f"{self.ttl}s"}, pool="ai"
+            ) as response:
+                if response.status != 200:
+                    raise UpstreamError(response.status, await response.text())
+        except (UpstreamError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug(f"Could not extend the Gemini cache {entry.name}: {e}")
+            return
+        finally:
+            entry.extending = False
+        entry.expires_at = time.monotonic() + self.ttl
+        self.stats.extended += 1
+
+    async def _delete(self, entry: _Entry) -> None:
+        # Deleted rather than left to expire, as storage is billed by the hour.
+        try:
+            async with self.http_client.request(
+                "DELETE", f"{CACHE_URL}/{entry.name.rpartition('/')[2]}?key={entry.key}", pool="ai"
+            ) as response:
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug(f"Could not delete the Gemini cache {entry.name}: {e}")
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """
+        Wait up to ``timeout`` seconds for the pending deletes and extensions, then cancel
+        the rest. Call it before the HTTP client is closed.
+        """
+        self._closed = True
+        tasks = list(self._background)
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if pending:
+            logger.info(f"Cancelled {len(pending)} Gemini context cache requests at shutdown")
+
+    def _spawn(self, coro) -> None:
+        if self._closed:
+            # Shutting down: the cache expires by itself.
+            coro.close()
+            return
+        task = asyncio.create_task(coro, name="gemini-context")
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
@@ -0,0 +1,210 @@
+"""
+Uploads of large attachments through the Gemini Files API.
+
+Inline attachments travel base64-encoded in the JSON body of the request, a third larger
+than the file, and are held in memory whole. Attachments of ``FILES_API_THRESHOLD`` bytes
+or more are uploaded once instead, with the resumable upload protocol, and referred to by
+their file URI::
+
+    part = await self.bot.gemini_files.part(lease, attachment)
+    # {"file_data": {"mime_type": "video/mp4", "file_uri": "https://..."}}
+
+- The upload is streamed from the Discord CDN to Gemini in ``CHUNK_SIZE`` chunks, so the
+  file is never buffered in memory.
+- Files belong to the project of the API key that uploaded them. Handles are kept per key
+  and per SHA-256 of the content (hashed while streaming), along with which content each
+  Discord attachment had, so an attachment used again is neither downloaded nor uploaded
+  again while its file is valid (48 hours, less ``EXPIRY_MARGIN``). Handles are kept in
+  the state store and survive restarts.
+- Videos are processed by Gemini after the upload; ``part`` waits until the file is
+  ``ACTIVE``, up to ``PROCESSING_TIMEOUT`` seconds.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from helpers.http import UpstreamError
+from helpers.singleflight import SingleFlight
+
+logger = logging.getLogger("Neurodivergence")
+
+FILES_API_THRESHOLD = 4 * 1024 * 1024
+# The Files API takes files of up to 2GB; attachments of Discord are far smaller.
+MAX_FILE_BYTES = 500 * 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+EXPIRY_MARGIN = 3600
+PROCESSING_TIMEOUT = 120.0
+
+UPLOAD_URL = "https://generativelanguage.googleapis.com/upload/v1beta/files"
+FILES_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+# Handles kept in memory before the expired ones are dropped.
+_MAX_HANDLES = 1024
+
+
+@dataclass(frozen=True)
+class RemoteAttachment:
+    """
+    An attachment to upload through the Files API rather than send inline.
+    """
+
+    id: int
+    url: str
+    size: int
+    mime_type: str
+    filename: str
+
+
+def _expires_at(value: Optional[str]) -> float:
+    # UTC, e.g. "2025-01-01T12:00:00.123456789Z". The fraction is dropped: it can have
+    # more digits than fromisoformat takes.
+    try:
+        stamp = (value or "").rstrip("Z").partition(".")[0]
+        return datetime.fromisoformat(stamp + "+00:00").timestamp()
+    except ValueError:
+        return time.time() + 47 * 3600
+
+
+class GeminiFiles:
+    """
+    :param http_client: The bot's ``HTTPClient``.
+    :param store: Optional state store the handles are kept in.
+    """
+
+    def __init__(self, http_client, *, store=None) -> None:
+        self.http_client = http_client
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.reused = 0
+        self._state = store.namespace("gemini_files") if store is not None else None
+        # attachment ID -> SHA-256 of its content
+        self._digests: Dict[int, str] = {}
+        # "key fingerprint:SHA-256" -> (file URI, mime type, expiry as a Unix timestamp)
+        self._handles: Dict[str, Tuple[str, str, float]] = {}
+        self._uploading = SingleFlight("gemini_files")
+
+    async def part(self, lease, attachment: RemoteAttachment) -> dict:
+        """
+        The ``file_data`` part for ``attachment`` in a request made with ``lease``'s key,
+        uploading it unless a valid handle exists.
+
+        :raises UpstreamError: If the upload or the processing failed, with the status of
+            the Files API (429 when the key is throttled).
+        """
+        fingerprint = lease.state.fingerprint
+        handle = await self._lookup(fingerprint, attachment.id)
+        if handle is not None:
+            self.reused += 1
+        else:
+            handle = await self._uploading.do(
+                (fingerprint, attachment.id), lambda: self._upload(lease.key, fingerprint, attachment)
+            )
+        uri, mime_type, _ = handle
+        return {"file_data": {"mime_type": mime_type, "file_uri": uri}}
+
+    async def _lookup(self, fingerprint: str, attachment_id: int) -> Optional[Tuple[str, str, float]]:
+        digest = self._digests.get(attachment_id)
+        if digest is None and self._state is not None:
+            digest = await self._state.get(f"attachment:{attachment_id}")
+        if digest is None:
+            return None
+        name = f"{fingerprint}:{digest}"
+        handle = self._handles.get(name)
+        if handle is None and self._state is not None:
+            saved = await self._state.get(name)
+            handle = tuple(saved) if saved else None
+        if handle is None or handle[2] - EXPIRY_MARGIN <= time.time():
+            return None
+        self._digests[attachment_id] = digest
+        self._handles[name] = handle
+        return handle
+
+    def _remember(self, fingerprint: str, attachment_id: int, digest: str, handle: Tuple[str, str, float]) -> None:
+        if len(self._handles) >= _MAX_HANDLES:
+            now = time.time()
+            self._handles = {name: kept for name, kept in self._handles.items() if kept[2] - EXPIRY_MARGIN > now}
+            if len(self._digests) >= _MAX_HANDLES:
+                self._digests.clear()
+        name = f"{fingerprint}:{digest}"
+        self._digests[attachment_id] = digest
+        self._handles[name] = handle
+        if self._state is not None:
+            ttl = max(0.0, handle[2] - EXPIRY_MARGIN - time.time())
+            self._state.set(f"attachment:{attachment_id}", digest, ttl=ttl)
+            self._state.set(name, list(handle), ttl=ttl)
+
+    async def _upload(self, key: str, fingerprint: str, attachment: RemoteAttachment) -> Tuple[str, str, float]:
+        if attachment.size > MAX_FILE_BYTES:
+            raise UpstreamError(413, f"{attachment.filename} is over {MAX_FILE_BYTES} bytes")
+        headers = {
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(attachment.size),
+            "X-Goog-Upload-Header-Content-Type": attachment.mime_type,
+        }
+        async with self.http_client.post(
+            f"{UPLOAD_URL}?key={key}", json={"file": {"display_name": attachment.filename}}, headers=headers, pool="ai"
+        ) as response:
+            if response.status != 200:
+                raise UpstreamError(response.status, await response.text())
+            upload_url = response.headers.get("X-Goog-Upload-URL")
+        if not upload_url:
+            raise UpstreamError(502, "The Files API did not return an upload URL")
+
+        digest = hashlib.sha256()
+        async with self.http_client.get(attachment.url, pool="ai") as source:
+            if source.status != 200:
+                raise UpstreamError(source.status, f"Could not download {attachment.filename}")
+            if source.content_length is not None and source.content_length != attachment.size:
+                status = 413 if source.content_length > attachment.size else 502
+                raise UpstreamError(status, f"{source.content_length} bytes, expected {attachment.size}")
+
+            async def body():
+                sent = 0
+                async for chunk in source.content.iter_chunked(CHUNK_SIZE):
+                    sent += len(chunk)
+                    if sent > attachment.size:
+                        raise UpstreamError(413, f"more than the expected {attachment.size} bytes")
+                    digest.update(chunk)
+                    yield chunk
+
+            headers = {
+                "Content-Length": str(attachment.size),
+                "X-Goog-Upload-Offset": "0",
+                "X-Goog-Upload-Command": "upload, finalize",
+            }
+            async with self.http_client.post(upload_url, data=body(), headers=headers, pool="ai") as response:
+                if response.status != 200:
+                    raise UpstreamError(response.status, await response.text())
+                file = (await response.json())["file"]
+        self.uploads += 1
+        self.uploaded_bytes += attachment.size
+
+        file = await self._wait_active(key, file)
+        handle = (file["uri"], file.get("mimeType") or attachment.mime_type, _expires_at(file.get("expirationTime")))
+        self._remember(fingerprint, attachment.id, digest.hexdigest(), handle)
+        logger.debug(f"Uploaded {attachment.filename} ({attachment.size} bytes) to the Gemini Files API as {file['name']}")
+        return handle
+
+    async def _wait_active(self, key: str, file: dict) -> dict:
+        deadline = time.monotonic() + PROCESSING_TIMEOUT
+        delay = 0.5
+        while file.get("state") == "PROCESSING":
+            if time.monotonic() + delay > deadline:
+                raise UpstreamError(504, f"{file['name']} is still being processed")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5.0)
+            async with self.http_client.get(f"{FILES_URL}/{file['name']}?key={key}", pool="ai") as response:
+                if response.status != 200:
+                    raise UpstreamError(response.status, await response.text())
+                file = await response.json()
+        if file.get("state") == "FAILED":
+            raise UpstreamError(422, f"Gemini could not process {file['name']}")
+        return file
@@ -0,0 +1,201 @@
+"""
+Recent messages per channel, kept in memory for the AI context.
+
+``bot.history`` holds the last ``per_channel`` messages of the channels the AI was used in,
+so building the context of a "neuro" reply does not page through the channel history over
+the REST API each time::
+
+    context = await self.bot.history.text(message.channel, limit=50)
+
+- A channel is cold until it is first asked for. Its messages are then read once with
+  ``channel.history()`` (concurrent requests share that one backfill) and kept up to date
+  by the bot's ``on_message``, ``on_raw_message_edit`` and ``on_raw_message_delete``
+  events. Messages of cold channels are not kept.
+- Past ``max_channels``, the channel used least recently is dropped and becomes cold
+  again. The buffers are also a consumer of the memory budget (``MEMORY_BUDGET_MB``),
+  which evicts idle channels the same way.
+"""
+
+from __future__ import annotations
+
+import collections
+import time
+from typing import Iterable, List, Optional, Tuple
+
+import discord
+
+from helpers.singleflight import SingleFlight
+
+# Rough bytes of an entry besides its text: the tuple, the id and the dict slot.
+_ENTRY_OVERHEAD = 120
+
+
+class _Channel:
+    __slots__ = ("messages", "size", "used_at", "warm", "evicted")
+
+    def __init__(self) -> None:
+        # message id -> (author name, content), oldest first.
+        self.messages: "collections.OrderedDict[int, Tuple[str, str]]" = collections.OrderedDict()
+        self.size = 0
+        self.used_at = time.monotonic()
+        self.warm = False
+        self.evicted = False
+
+
+def _entry_size(author: str, content: str) -> int:
+    return _ENTRY_OVERHEAD + len(author) + len(content)
+
+
+class ChannelHistory:
+    """
+    :param per_channel: Messages kept per channel.
+    :param max_channels: Channels kept at once.
+    :param budget: Optional ``MemoryBudget`` the buffers are registered with.
+    """
+
+    def __init__(self, *, per_channel: int = 50, max_channels: int = 1000, budget=None) -> None:
+        self.per_channel = per_channel
+        self.max_channels = max_channels
+        self.size = 0
+        self.hits = 0
+        self.backfills = 0
+        self.evictions = 0
+        self.budget = budget
+        self._channels: "collections.OrderedDict[int, _Channel]" = collections.OrderedDict()
+        self._backfill = SingleFlight("history")
+        if budget is not None:
+            budget.register("channel history", self)
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    # Reads
+
+    async def messages(self, channel: discord.abc.Messageable, limit: Optional[int] = None) -> List[Tuple[str, str]]:
+        """
+        The last ``limit`` (at most ``per_channel``) messages of ``channel`` as
+        (author name, content), oldest first. Reads the channel once if it is cold.
+        """
+        return [(author, content) for _, author, content in await self.entries(channel, limit)]
+
+    async def entries(self, channel: discord.abc.Messageable, limit: Optional[int] = None) -> List[Tuple[int, str, str]]:
+        """
+        Like ``messages``, as (message ID, author name, content).
+        """
+        state = self._channels.get(channel.id)
+        if state is not None and state.warm:
+            self.hits += 1
+        else:
+            state = await self._backfill.do(channel.id, lambda: self._load(channel))
+        state.used_at = time.monotonic()
+        if channel.id in self._channels:
+            self._channels.move_to_end(channel.id)
+        entries = [(message_id, author, content) for message_id, (author, content) in state.messages.items()]
+        return entries[-limit:] if limit else entries
+
+    async def text(self, channel: discord.abc.Messageable, limit: Optional[int] = None) -> str:
+        """
+        The last messages of ``channel`` as "author: content" lines, oldest first.
+        """
+        return "\n".join(f"{author}: {content}" for author, content in await self.messages(channel, limit))
+
+    async def _load(self, channel: discord.abc.Messageable) -> _Channel:
+        # Messages that arrive during the backfill are kept and merged with it.
+        state = self._channels.get(channel.id) or self._track(channel.id)
+        self.backfills += 1
+        fetched = [message async for message in channel.history(limit=self.per_channel)]
+        merged = {message.id: (message.author.name, message.content) for message in fetched}
+        merged.update(state.messages)
+        self._resize(state, -state.size)
+        state.messages = collections.OrderedDict(
+            (message_id, merged[message_id]) for message_id in sorted(merged)[-self.per_channel:]
+        )
+        self._resize(state, sum(_entry_size(*entry) for entry in state.messages.values()))
+        state.warm = True
+        if self.budget is not None:
+            self.budget.enforce()
+        return state
+
+    # Writes, from the bot's events
+
+    def add(self, message: discord.Message) -> None:
+        """
+        Record a new message of a channel that is kept. ``on_message``.
+        """
+        state = self._channels.get(message.channel.id)
+        if state is None:
+            return
+        self._append(state, message.id, message.author.name, message.content)
+        while len(state.messages) > self.per_channel:
+            _, entry = state.messages.popitem(last=False)
+            self._resize(state, -_entry_size(*entry))
+        if self.budget is not None:
+            self.budget.enforce()
+
+    def edit(self, channel_id: int, message_id: int, content: str) -> None:
+        """
+        Update the content of an edited message. ``on_raw_message_edit``.
+        """
+        state = self._channels.get(channel_id)
+        if state is None or message_id not in state.messages:
+            return
+        author, old = state.messages[message_id]
+        state.messages[message_id] = (author, content)
+        self._resize(state, len(content) - len(old))
+
+    def delete(self, channel_id: int, message_ids: Iterable[int]) -> None:
+        """
+        Forget deleted messages. ``on_raw_message_delete`` and its bulk variant.
+        """
+        state = self._channels.get(channel_id)
+        if state is None:
+            return
+        for message_id in message_ids:
+            entry = state.messages.pop(message_id, None)
+            if entry is not None:
+                self._resize(state, -_entry_size(*entry))
+
+    def forget(self, channel_id: int) -> None:
+        """
+        Drop a deleted channel.
+        """
+        state = self._channels.pop(channel_id, None)
+        if state is not None:
+            state.evicted = True
+            self.size -= state.size
+
+    def _track(self, channel_id: int) -> _Channel:
+        state = _Channel()
+        self._channels[channel_id] = state
+        while len(self._channels) > self.max_channels:
+            self.evict_lru()
+        return state
+
+    def _append(self, state: _Channel, message_id: int, author: str, content: str) -> None:
+        previous = state.messages.pop(message_id, None)
+        if previous is not None:
+            self._resize(state, -_entry_size(*previous))
+        state.messages[message_id] = (author, content)
+        self._resize(state, _entry_size(author, content))
+
+    def _resize(self, state: _Channel, delta: int) -> None:
+        state.size += delta
+        # A channel evicted during its backfill no longer counts towards the total.
+        if not state.evicted:
+            self.size += delta
+
+    # Memory budget consumer
+
+    def lru_timestamp(self) -> Optional[float]:
+        for state in self._channels.values():
+            return state.used_at
+        return None
+
+    def evict_lru(self) -> int:
+        if not self._channels:
+            return 0
+        _, state = self._channels.popitem(last=False)
+        state.evicted = True
+        self.size -= state.size
+        self.evictions += 1
+        return state.size
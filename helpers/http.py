@@ -0,0 +1,214 @@
+"""
+Pooled HTTP client shared by the whole bot.
+
+Cogs must not open their own ``aiohttp.ClientSession``; use ``self.bot.http_client``
+instead. Sessions are created lazily (one per pool), keep connections alive between
+commands, cache DNS lookups and cap the number of connections per upstream host.
+JSON request bodies and ``response.json()`` use the codec selected by the runtime
+profile (see ``helpers/runtime.py``).
+
+``coalesce(key, fetch)`` lets concurrent callers share one in-flight lookup (see
+``helpers/singleflight.py``).
+
+``upstreams`` maps URL prefixes to replacements, so the same cog code can be pointed at
+local stand-ins, e.g. by the offline benchmarks in ``benchmarks/``.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Mapping, Optional, Sequence
+
+import aiohttp
+
+from helpers.singleflight import SingleFlight
+
+
+@dataclass(frozen=True)
+class PoolSettings:
+    """
+    Connection and timeout settings for one named session pool.
+    """
+
+    limit: int = 100
+    limit_per_host: int = 8
+    total_timeout: float = 60.0
+    connect_timeout: float = 10.0
+    sock_read_timeout: Optional[float] = None
+    keepalive_timeout: float = 30.0
+    dns_cache_ttl: int = 300
+
+
+# "default" serves scrapers and small JSON APIs, "ai" serves Gemini / LM Studio /
+# AUTO1111 where a single generation can legitimately take minutes.
+DEFAULT_POOLS: Dict[str, PoolSettings] = {
+    "default": PoolSettings(),
+    "ai": PoolSettings(
+        limit=64,
+        limit_per_host=16,
+        total_timeout=300.0,
+        connect_timeout=10.0,
+        sock_read_timeout=240.0,
+    ),
+}
+
+
+class UpstreamError(Exception):
+    """
+    Raised by the fetch helpers of the cogs when an upstream answers with an unexpected
+    status.
+
+    :param status: The HTTP status of the response.
+    :param message: The error message of the upstream, if any.
+    """
+
+    def __init__(self, status: int, message: str = "") -> None:
+        self.status = status
+        self.message = message
+        super().__init__(f"{status} {message}".strip())
+
+
+class JSONResponse(aiohttp.ClientResponse):
+    """
+    A response whose ``json()`` decodes with the client's codec unless ``loads`` is given.
+    The codec is handed the raw body bytes, which saves decoding multi-megabyte
+    payloads (e.g. base64 images) to ``str`` first.
+    """
+
+    json_loads: Callable[[bytes], Any] = staticmethod(json.loads)
+
+    async def json(self, *, encoding: Optional[str] = None, loads: Optional[Callable[[str], Any]] = None, content_type: Optional[str] = "application/json") -> Any:
+        if loads is not None or encoding is not None:
+            return await super().json(encoding=encoding, loads=loads, content_type=content_type)
+        body = await self.read()
+        if content_type:
+            response_type = self.headers.get("Content-Type", "").lower()
+            if content_type not in response_type and not (content_type == "application/json" and "+json" in response_type):
+                raise aiohttp.ContentTypeError(
+                    self.request_info,
+                    self.history,
+                    status=self.status,
+                    message=f"Attempt to decode JSON with unexpected mimetype: {response_type}",
+                    headers=self.headers,
+                )
+        body = body.strip()
+        if not body:
+            return None
+        return self.json_loads(body)
+
+
+class HTTPClient:
+    """
+    Owns one long-lived ``aiohttp.ClientSession`` per pool.
+
+    Usage from a cog::
+
+        async with self.bot.http_client.get(url, headers=headers) as response:
+            ...
+
+        async with self.bot.http_client.post(url, json=data, pool="ai") as response:
+            ...
+    """
+
+    def __init__(
+        self,
+        pools: Optional[Dict[str, PoolSettings]] = None,
+        *,
+        trace_configs: Sequence[aiohttp.TraceConfig] = (),
+        json_dumps: Callable[[Any], str] = json.dumps,
+        json_loads: Callable[[str], Any] = json.loads,
+        upstreams: Optional[Mapping[str, str]] = None,
+    ) -> None:
+        self.pools: Dict[str, PoolSettings] = dict(pools or DEFAULT_POOLS)
+        self.trace_configs: List[aiohttp.TraceConfig] = list(trace_configs)
+        self.json_dumps = json_dumps
+        self.response_class = aiohttp.ClientResponse
+        if json_loads is not json.loads:
+            self.response_class = type("JSONResponse", (JSONResponse,), {"json_loads": staticmethod(json_loads)})
+        self.upstreams: Dict[str, str] = dict(upstreams or {})
+        self.singleflight = SingleFlight("http")
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._closed = False
+
+    def _create_session(self, settings: PoolSettings) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=settings.limit,
+            limit_per_host=settings.limit_per_host,
+            ttl_dns_cache=settings.dns_cache_ttl,
+            keepalive_timeout=settings.keepalive_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=settings.total_timeout,
+            connect=settings.connect_timeout,
+            sock_read=settings.sock_read_timeout,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            trace_configs=self.trace_configs or None,
+            json_serialize=self.json_dumps,
+            response_class=self.response_class,
+        )
+
+    def session(self, pool: str = "default") -> aiohttp.ClientSession:
+        """
+        Return the pooled session for ``pool``, creating it on first use.
+
+        :param pool: The name of the pool, see ``DEFAULT_POOLS``.
+        """
+        if self._closed:
+            raise RuntimeError("HTTPClient has been closed")
+        session = self._sessions.get(pool)
+        if session is None or session.closed:
+            settings = self.pools.get(pool)
+            if settings is None:
+                raise KeyError(f"Unknown HTTP pool '{pool}'")
+            session = self._create_session(settings)
+            self._sessions[pool] = session
+        return session
+
+    def resolve(self, url: str) -> str:
+        """
+        Apply the ``upstreams`` overrides to ``url``.
+        """
+        if self.upstreams and isinstance(url, str):
+            for prefix, replacement in self.upstreams.items():
+                if url.startswith(prefix):
+                    return replacement + url[len(prefix):]
+        return url
+
+    def request(self, method: str, url: str, *, pool: str = "default", **kwargs: Any):
+        """
+        Start a request on the given pool. Returns aiohttp's request context manager,
+        so it can be used with ``async with`` exactly like ``session.request``.
+        """
+        return self.session(pool).request(method, self.resolve(url), **kwargs)
+
+    async def coalesce(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run ``fetch()`` unless a lookup with the same ``key`` is already running, in which
+        case wait for that one and return its result. ``fetch`` should request and parse,
+        so the callers share the parsed result rather than a half-read response.
+
+        :param key: Identifies the lookup, e.g. ``("shodan", query)``.
+        :param fetch: Performs the lookup.
+        """
+        return await self.singleflight.do(key, fetch)
+
+    def get(self, url: str, *, pool: str = "default", **kwargs: Any):
+        return self.request("GET", url, pool=pool, **kwargs)
+
+    def post(self, url: str, *, pool: str = "default", **kwargs: Any):
+        return self.request("POST", url, pool=pool, **kwargs)
+
+    async def close(self) -> None:
+        """
+        Close every pooled session. Safe to call more than once.
+        """
+        self._closed = True
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
@@ -0,0 +1,214 @@
+"""
+Small local IPC channel between the cluster launcher and its worker processes.
+
+``cluster.py`` runs an ``IPCHub`` on a loopback TCP port; each worker connects with an
+``IPCClient`` and authenticates with a token passed in its environment. Messages are
+newline-delimited JSON objects with an ``op``:
+
+- ``hello``: sent by a worker once connected (``cluster_id``, ``token``).
+- ``publish``: a worker broadcasts ``topic`` / ``data`` to every other worker, e.g.
+  ``config_reload``, ``cache_invalidate`` or ``triggers_changed``. Workers dispatch received messages as the
+  ``on_ipc_<topic>(data)`` bot event.
+- ``heartbeat``: a worker reports its state (shards, guilds, latency), kept by the hub.
+- ``request`` / ``response``: a worker asks the hub for ``status``, the last heartbeat
+  of every worker.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hmac
+import itertools
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger("Neurodivergence")
+
+MAX_MESSAGE_BYTES = 1024 * 1024
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+class IPCHub:
+    """
+    The launcher side: accepts worker connections and relays their messages.
+
+    :param token: The shared secret workers must present in their ``hello``.
+    :param host: The address to listen on; keep it on loopback.
+    :param port: The port to listen on, ``0`` picks a free one.
+    """
+
+    def __init__(self, token: str, *, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.token = token
+        self.host = host
+        self.port = port
+        self.workers: Dict[int, asyncio.StreamWriter] = {}
+        self.heartbeats: Dict[int, Dict[str, Any]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle, self.host, self.port, limit=MAX_MESSAGE_BYTES
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        for writer in list(self.workers.values()):
+            writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def broadcast(self, topic: str, data: Any = None, *, exclude: Optional[int] = None) -> None:
+        payload = _encode({"op": "publish", "topic": topic, "data": data})
+        for cluster_id, writer in list(self.workers.items()):
+            if cluster_id == exclude:
+                continue
+            try:
+                writer.write(payload)
+                await writer.drain()
+            except (ConnectionError, RuntimeError):
+                self.workers.pop(cluster_id, None)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        cluster_id: Optional[int] = None
+        try:
+            hello = json.loads(await asyncio.wait_for(reader.readline(), timeout=10))
+            if hello.get("op") != "hello" or not hmac.compare_digest(str(hello.get("token")), self.token):
+                logger.warning("Rejected an IPC connection with a bad hello")
+                return
+            cluster_id = int(hello["cluster_id"])
+            self.workers[cluster_id] = writer
+            logger.info(f"Cluster {cluster_id} connected to IPC")
+            while line := await reader.readline():
+                message = json.loads(line)
+                op = message.get("op")
+                if op == "publish":
+                    await self.broadcast(message["topic"], message.get("data"), exclude=cluster_id)
+                elif op == "heartbeat":
+                    self.heartbeats[cluster_id] = {**message.get("data", {}), "received_at": time.time()}
+                elif op == "request":
+                    writer.write(_encode({"op": "response", "id": message.get("id"), "data": self._answer(message)}))
+                    await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, ValueError, KeyError) as e:
+            logger.warning(f"IPC connection of cluster {cluster_id} failed: {type(e).__name__}: {e}")
+        except asyncio.CancelledError:
+            # The hub is shutting down; asyncio's stream callback would report a
+            # cancelled handler as an error.
+            pass
+        finally:
+            if cluster_id is not None and self.workers.get(cluster_id) is writer:
+                del self.workers[cluster_id]
+                logger.info(f"Cluster {cluster_id} disconnected from IPC")
+            writer.close()
+
+    def _answer(self, message: Dict[str, Any]) -> Any:
+        if message.get("topic") == "status":
+            return {
+                str(cluster_id): {**heartbeat, "connected": cluster_id in self.workers}
+                for cluster_id, heartbeat in sorted(self.heartbeats.items())
+            }
+        return None
+
+
+class IPCClient:
+    """
+    The worker side of the IPC channel.
+
+    :param address: ``host:port`` of the hub.
+    :param token: The shared secret of the cluster.
+    :param cluster_id: The ID of this worker.
+    :param on_message: Called with ``(topic, data)`` for every message published by another worker.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        token: str,
+        cluster_id: int,
+        on_message: Callable[[str, Any], None],
+    ) -> None:
+        host, _, port = address.rpartition(":")
+        self.host = host or "127.0.0.1"
+        self.port = int(port)
+        self.token = token
+        self.cluster_id = cluster_id
+        self.on_message = on_message
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self) -> None:
+        reader, self._writer = await asyncio.open_connection(self.host, self.port, limit=MAX_MESSAGE_BYTES)
+        await self._send({"op": "hello", "cluster_id": self.cluster_id, "token": self.token})
+        self._reader_task = asyncio.create_task(self._read(reader), name="ipc-reader")
+
+    async def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _send(self, message: Dict[str, Any]) -> None:
+        if not self.connected:
+            raise ConnectionError("Not connected to the cluster IPC hub")
+        self._writer.write(_encode(message))
+        await self._writer.drain()
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                if message.get("op") == "response":
+                    future = self._pending.pop(message.get("id"), None)
+                    if future is not None and not future.done():
+                        future.set_result(message.get("data"))
+                elif message.get("op") == "publish":
+                    self.on_message(message["topic"], message.get("data"))
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"Lost the cluster IPC connection: {type(e).__name__}: {e}")
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("IPC connection closed"))
+            self._pending.clear()
+            if self._writer is not None:
+                self._writer.close()
+
+    async def publish(self, topic: str, data: Any = None) -> None:
+        """
+        Send ``topic`` / ``data`` to every other worker of the cluster.
+        """
+        await self._send({"op": "publish", "topic": topic, "data": data})
+
+    async def heartbeat(self, data: Dict[str, Any]) -> None:
+        await self._send({"op": "heartbeat", "data": data})
+
+    async def request(self, topic: str, *, timeout: float = 5.0) -> Any:
+        """
+        Ask the hub for ``topic`` and wait for the answer.
+        """
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await self._send({"op": "request", "id": request_id, "topic": topic})
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            self._pending.pop(request_id, None)
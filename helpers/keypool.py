@@ -0,0 +1,386 @@
+"""
+Scheduling of upstream requests over a pool of API keys (``GEMINI_KEYS``).
+
+Every request leases a key from the pool and reports how it went::
+
+    lease = await self.bot.gemini_keys.acquire(tokens=estimate, exclude=tried)
+    ...
+    lease.succeeded(tokens=used)      # or lease.throttled(retry_after) / lease.failed(status)
+
+The pool remembers each key between requests:
+
+- A throttled key (429) cools down for its ``Retry-After``, or for an exponential
+  backoff when the upstream gives none, and is not picked again until then. Cooldowns
+  are saved in the state store, so a restart does not hammer a throttled key.
+- Each key has token buckets for its requests per minute and tokens per minute
+  (``GEMINI_KEY_RPM``, ``GEMINI_KEY_TPM``). A request takes its estimated tokens up
+  front; the difference with the actual usage is settled when it succeeds.
+- A key the upstream refuses (401/403: revoked, wrong project) is benched for an hour.
+
+``acquire`` picks the least loaded healthy key: fewest requests in flight, then the most
+request budget left, then the least recently used. When every key is cooling down or out
+of budget it waits for the first one to come back, up to ``max_wait`` seconds, and raises
+``KeyPoolExhausted`` otherwise. The owner ``keypool`` command shows the pool's health.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import hashlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger("Neurodivergence")
+
+# Seconds a key cools down after its first 429 without Retry-After, doubled for each
+# throttle in a row.
+BASE_COOLDOWN = 5.0
+MAX_COOLDOWN = 300.0
+# Seconds a key refused with 401/403 is left out.
+REFUSED_COOLDOWN = 3600.0
+
+
+class KeyPoolExhausted(Exception):
+    """
+    No key of the pool is available within ``max_wait``.
+    """
+
+    def __init__(self, retry_after: Optional[float]) -> None:
+        self.retry_after = retry_after
+        super().__init__(
+            "No API key available" + (f", the first is back in {retry_after:.0f}s" if retry_after is not None else "")
+        )
+
+
+class TokenBucket:
+    """
+    :param per_minute: The refill rate and the capacity, or ``None`` for no limit.
+    """
+
+    def __init__(self, per_minute: Optional[float]) -> None:
+        self.per_minute = per_minute
+        self.level = float(per_minute or 0)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level + (now - self.updated_at) * self.per_minute / 60)
+        self.updated_at = now
+
+    def _cost(self, amount: float) -> float:
+        # A request bigger than the whole bucket would otherwise never fit.
+        return min(amount, self.per_minute)
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Seconds until ``amount`` can be taken, 0 if it can be now.
+        """
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        missing = self._cost(amount) - self.level
+        return max(0.0, missing * 60 / self.per_minute)
+
+    def take(self, amount: float, now: float) -> None:
+        """
+        Take ``amount``; a negative amount gives back. The level may go below zero when
+        a request used more than was taken for it.
+        """
+        if self.per_minute:
+            self._refill(now)
+            self.level = min(self.per_minute, self.level - (self._cost(amount) if amount > 0 else amount))
+
+    @property
+    def fill(self) -> float:
+        """
+        The share of the bucket left, 1 without limit.
+        """
+        if not self.per_minute:
+            return 1.0
+        self._refill(time.monotonic())
+        return max(0.0, self.level / self.per_minute)
+
+
+@dataclass
+class KeyState:
+    key: str
+    requests: TokenBucket
+    tokens: TokenBucket
+    in_flight: int = 0
+    cooldown_until: float = 0.0
+    throttles_in_a_row: int = 0
+    successes: int = 0
+    throttled: int = 0
+    failures: int = 0
+    tokens_used: int = 0
+    last_used: float = 0.0
+    last_error: Optional[str] = None
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Identifies the key in the state store and the logs without revealing it.
+        """
+        return hashlib.sha256(self.key.encode()).hexdigest()[:12]
+
+    @property
+    def label(self) -> str:
+        return f"...{self.key[-4:]}"
+
+    def available_in(self, tokens: float, now: float) -> float:
+        """
+        Seconds until the key may take a request of ``tokens``, 0 if it may now.
+        """
+        return max(self.cooldown_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now), 0.0)
+
+
+@dataclass
+class KeyLease:
+    """
+    A key taken for one request. Exactly one of ``succeeded``, ``throttled``, ``failed``
+    or ``release`` must be called when the request is over.
+    """
+
+    pool: "KeyPool"
+    state: KeyState
+    estimated_tokens: int
+    released: bool = field(default=False, init=False)
+
+    @property
+    def key(self) -> str:
+        return self.state.key
+
+    @property
+    def label(self) -> str:
+        return self.state.label
+
+    def release(self) -> None:
+        """
+        Give the key back without an outcome, e.g. the request was cancelled.
+        """
+        if not self.released:
+            self.released = True
+            self.state.in_flight -= 1
+            self.pool._wake()
+
+    def succeeded(self, tokens: Optional[int] = None) -> None:
+        """
+        :param tokens: The tokens the request actually used, if the upstream said.
+        """
+        state = self.state
+        state.successes += 1
+        state.throttles_in_a_row = 0
+        if tokens is not None:
+            state.tokens_used += tokens
+            state.tokens.take(tokens - self.estimated_tokens, time.monotonic())
+        self.pool._count(state, "success")
+        self.release()
+
+    def throttled(self, retry_after: Optional[float] = None) -> None:
+        """
+        :param retry_after: Seconds the upstream asked to wait, if it said.
+        """
+        state = self.state
+        state.throttled += 1
+        state.throttles_in_a_row += 1
+        if retry_after is None:
+            retry_after = min(MAX_COOLDOWN, BASE_COOLDOWN * 2 ** (state.throttles_in_a_row - 1))
+        state.last_error = "429 Too Many Requests"
+        self.pool._cool_down(state, retry_after)
+        self.pool._count(state, "throttled")
+        self.release()
+
+    def failed(self, status: Optional[int] = None, error: Optional[str] = None) -> None:
+        """
+        :param status: The HTTP status, if there was a response. 401 and 403 bench the key.
+        """
+        state = self.state
+        state.failures += 1
+        state.last_error = error or (f"HTTP {status}" if status is not None else "request failed")
+        if status in (401, 403):
+            logger.warning(f"API key {state.label} was refused ({status}), leaving it out for {REFUSED_COOLDOWN / 60:.0f} minutes")
+            self.pool._cool_down(state, REFUSED_COOLDOWN)
+        self.pool._count(state, "failure")
+        self.release()
+
+
+class KeyPool:
+    """
+    :param name: Used in the logs, the metrics and the state store namespace.
+    :param keys: The API keys.
+    :param rpm: Requests per minute allowed per key, or ``None`` for no limit.
+    :param tpm: Tokens per minute allowed per key, or ``None`` for no limit.
+    :param max_wait: Seconds ``acquire`` waits for a key before giving up.
+    :param store: Optional ``Store`` the cooldowns are saved in.
+    :param metrics: Optional ``BotMetrics`` to count the outcomes per key in.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        keys: Iterable[str] = (),
+        *,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        max_wait: float = 10.0,
+        store=None,
+        metrics=None,
+    ) -> None:
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait = max_wait
+        self.states: Dict[str, KeyState] = {}
+        self._state = store.namespace(f"keypool:{name}") if store is not None else None
+        self._changed: Optional[asyncio.Event] = None
+        self._outcomes = None
+        if metrics is not None:
+            self._outcomes = metrics.registry.counter(
+                "bot_api_key_requests_total", "Upstream requests by key pool, key fingerprint and outcome.", ("pool", "key", "outcome")
+            )
+        self.update(keys, rpm=rpm, tpm=tpm)
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def update(self, keys: Iterable[str], *, rpm: Optional[int] = None, tpm: Optional[int] = None) -> None:
+        """
+        Apply a new set of keys and limits, keeping the state of the keys that stay.
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        states = {}
+        for key in dict.fromkeys(keys):
+            state = self.states.get(key)
+            if state is None:
+                state = KeyState(key, TokenBucket(rpm), TokenBucket(tpm))
+            if state.requests.per_minute != rpm:
+                state.requests = TokenBucket(rpm)
+            if state.tokens.per_minute != tpm:
+                state.tokens = TokenBucket(tpm)
+            states[key] = state
+        self.states = states
+        self._wake()
+
+    async def restore(self) -> None:
+        """
+        Load the cooldowns saved before the last restart. Call once the store is open.
+        """
+        if self._state is None:
+            return
+        saved = await self._state.items()
+        now_wall, now = time.time(), time.monotonic()
+        for state in self.states.values():
+            until = saved.get(state.fingerprint)
+            if until is not None and until > now_wall:
+                state.cooldown_until = max(state.cooldown_until, now + until - now_wall)
+                logger.info(f"API key {state.label} of {self.name} is still cooling down for {until - now_wall:.0f}s")
+
+    def estimate_tokens(self, *texts: str, attachments: int = 0) -> int:
+        """
+        A rough count of the tokens of a request: four characters per token, plus a fixed
+        cost per attachment.
+        """
+        return sum(len(text) for text in texts) // 4 + 258 * attachments
+
+    async def acquire(self, *, tokens: int = 0, exclude: Iterable[str] = (), prefer: Iterable[str] = ()) -> KeyLease:
+        """
+        Lease the least loaded key that can take a request of ``tokens`` now, waiting for
+        one up to ``max_wait`` seconds.
+
+        :param exclude: Keys not to pick, e.g. those already tried for this request.
+        :param prefer: Keys picked first when they can take the request now, e.g. those
+            holding a cached context for it.
+        :raises KeyPoolExhausted: If no key is available in time, or none is left.
+        """
+        exclude = set(exclude)
+        prefer = set(prefer)
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            now = time.monotonic()
+            candidates = [state for key, state in self.states.items() if key not in exclude]
+            if not candidates:
+                raise KeyPoolExhausted(None)
+            ready = [state for state in candidates if state.available_in(tokens, now) == 0]
+            if ready:
+                ready = [state for state in ready if state.key in prefer] or ready
+                state = min(ready, key=lambda s: (s.in_flight, -s.requests.fill, -s.tokens.fill, s.last_used))
+                state.in_flight += 1
+                state.last_used = now
+                state.requests.take(1, now)
+                state.tokens.take(tokens, now)
+                return KeyLease(self, state, tokens)
+
+            wait = min(state.available_in(tokens, now) for state in candidates)
+            if now + wait > deadline:
+                raise KeyPoolExhausted(wait)
+            # Wake up when the first key comes back, or earlier when a key is released.
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _wake(self) -> None:
+        if self._changed is not None:
+            self._changed.set()
+
+    def _cool_down(self, state: KeyState, seconds: float) -> None:
+        state.cooldown_until = max(state.cooldown_until, time.monotonic() + seconds)
+        if self._state is not None:
+            self._state.set(state.fingerprint, time.time() + seconds, ttl=seconds)
+
+    def _count(self, state: KeyState, outcome: str) -> None:
+        if self._outcomes is not None:
+            self._outcomes.inc(pool=self.name, key=state.fingerprint, outcome=outcome)
+
+    def health(self) -> List[Dict[str, object]]:
+        """
+        The status and counters of every key, for the owner ``keypool`` command.
+        """
+        now = time.monotonic()
+        rows = []
+        for state in self.states.values():
+            if state.cooldown_until > now:
+                status = f"cooling down {state.cooldown_until - now:.0f}s"
+            elif state.available_in(0, now) > 0:
+                status = "out of budget"
+            else:
+                status = "ok"
+            rows.append({
+                "key": state.label,
+                "status": status,
+                "in_flight": state.in_flight,
+                "successes": state.successes,
+                "throttled": state.throttled,
+                "failures": state.failures,
+                "tokens_used": state.tokens_used,
+                "requests_left": state.requests.fill,
+                "tokens_left": state.tokens.fill,
+                "last_error": state.last_error,
+            })
+        return rows
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Seconds from a ``Retry-After`` header (delta seconds or an HTTP date), or from a
+    duration such as Google's ``RetryInfo.retryDelay`` (``"37s"``).
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value[:-1] if value.endswith("s") else value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
@@ -0,0 +1,153 @@
+"""
+Tracking of in-flight work and the graceful shutdown of the bot.
+
+Every command runs in a task that ``TaskTracker.track_command`` registers from the
+``before_invoke`` hook; trigger handlers are registered by ``TriggerDispatcher`` and
+other background work can be started with ``bot.tasks.spawn(coro, label=...)``.
+
+On SIGTERM ``DiscordBot.shutdown()``:
+
+1. stops accepting work: new and queued commands are rejected by admission control and
+   triggers are no longer dispatched;
+2. waits up to ``SHUTDOWN_TIMEOUT`` seconds for the tracked tasks to finish;
+3. edits the last message of every command still running (usually its "Please wait..."
+   embed) to say it was interrupted, then cancels it;
+4. closes the bot as usual: audit log, Discord connection, caches, state store, HTTP pools.
+
+Commands get a ``TrackedContext``, which remembers the messages they sent, so cogs do not
+have to register their progress messages themselves.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Coroutine, Dict, List, Optional
+
+import discord
+from discord.ext import commands
+
+logger = logging.getLogger("Neurodivergence")
+
+INTERRUPTED_MESSAGE = "Interrupted: the bot is restarting. Please try again in a minute."
+
+
+class TrackedContext(commands.Context):
+    """
+    A command context that remembers the messages the command sent.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.sent_messages: List[discord.Message] = []
+
+    async def send(self, *args, **kwargs):
+        message = await super().send(*args, **kwargs)
+        if message is not None:
+            self.sent_messages.append(message)
+        return message
+
+
+@dataclass
+class _Tracked:
+    label: str
+    started_at: float = field(default_factory=time.perf_counter)
+    context: Optional[commands.Context] = None
+
+
+class TaskTracker:
+    """
+    The commands, triggers and background tasks currently running.
+    """
+
+    def __init__(self) -> None:
+        self.draining = False
+        self._tasks: Dict[asyncio.Task, _Tracked] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def track(self, task: asyncio.Task, label: str, *, context: Optional[commands.Context] = None) -> asyncio.Task:
+        """
+        Wait for ``task`` on shutdown.
+        """
+        if task.done():
+            return task
+        if task not in self._tasks:
+            task.add_done_callback(self._discard)
+        self._tasks[task] = _Tracked(label, context=context)
+        return task
+
+    def track_command(self, context: commands.Context) -> None:
+        """
+        Track the task running ``context``'s command. Called from ``before_invoke``.
+        """
+        task = asyncio.current_task()
+        if task is not None:
+            self.track(task, f"command {context.command.qualified_name}", context=context)
+
+    def spawn(self, coro: Coroutine, *, label: str) -> asyncio.Task:
+        """
+        Start ``coro`` in a tracked task.
+        """
+        return self.track(asyncio.create_task(coro, name=label), label)
+
+    def _discard(self, task: asyncio.Task) -> None:
+        self._tasks.pop(task, None)
+
+    def running(self) -> List[str]:
+        """
+        The labels of the running tasks, longest running first.
+        """
+        tracked = sorted(self._tasks.values(), key=lambda entry: entry.started_at)
+        now = time.perf_counter()
+        return [f"{entry.label} ({now - entry.started_at:.0f}s)" for entry in tracked]
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Stop accepting work, wait up to ``timeout`` seconds for the running tasks, then
+        mark the commands still running as interrupted and cancel every leftover task.
+        Returns the number of tasks that were cancelled.
+        """
+        self.draining = True
+        pending = set(self._tasks)
+        current = asyncio.current_task()
+        pending.discard(current)
+        if pending:
+            logger.info(f"Waiting up to {timeout:.0f}s for {len(pending)} running tasks: {', '.join(self.running()[:10])}")
+            _, pending = await asyncio.wait(pending, timeout=timeout)
+        if not pending:
+            return 0
+
+        leftovers = [(task, self._tasks.get(task)) for task in pending]
+        logger.warning(f"Interrupting {len(leftovers)} tasks still running: {', '.join(entry.label for _, entry in leftovers if entry)}")
+        await asyncio.gather(
+            *(self._mark_interrupted(entry.context) for _, entry in leftovers if entry is not None and entry.context is not None),
+            return_exceptions=True,
+        )
+        for task, _ in leftovers:
+            task.cancel()
+        await asyncio.wait(pending, timeout=5)
+        return len(leftovers)
+
+    @staticmethod
+    async def _mark_interrupted(context: commands.Context) -> None:
+        """
+        Edit the last message the command sent, keeping its title, or reply if it sent
+        none (e.g. a deferred interaction).
+        """
+        messages = getattr(context, "sent_messages", None)
+        message = messages[-1] if messages else None
+        title = None
+        if message is not None and message.embeds:
+            title = message.embeds[0].title
+        embed = discord.Embed(title=title, description=INTERRUPTED_MESSAGE, color=0xE02B2B)
+        try:
+            if message is not None:
+                await message.edit(content=None, embed=embed, attachments=[], view=None)
+            else:
+                await context.send(embed=embed)
+        except discord.HTTPException as e:
+            logger.warning(f"Could not mark /{context.command} as interrupted: {e}")
@@ -0,0 +1,314 @@
+"""
+Admission control for commands: concurrency bulkheads and priority classes.
+
+Commands (or whole cogs) declare an ``AdmissionPolicy`` with the ``admission``
+decorator::
+
+    @commands.hybrid_command(name="sd", ...)
+    @admission(per_command=4, per_user=1, queue=10, priority=Priority.BULK)
+    async def sd(self, context, ...): ...
+
+``AdmissionController.acquire`` runs as the bot's ``before_invoke`` hook, after the
+command's checks passed. A command that fits in its limits (in flight per command, per
+user and per guild, plus the bot-wide ``ADMISSION_MAX_IN_FLIGHT`` budget) starts right
+away; otherwise it waits in a bounded queue and the user is told their position. Waiting
+commands are admitted by priority class, then in arrival order: owner commands never wait
+on the bot-wide budget, and bulk commands (AI, fun) may only use part of it so moderation
+and everyday commands still get through while the AI hosts are saturated.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import enum
+import itertools
+import logging
+import time
+import weakref
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import discord
+from discord.ext import commands
+
+logger = logging.getLogger("Neurodivergence")
+
+# Share of the bot-wide budget that BULK commands may occupy.
+BULK_SHARE = 0.75
+
+
+class Priority(enum.IntEnum):
+    OWNER = 0
+    MODERATION = 1
+    DEFAULT = 2
+    BULK = 3
+
+
+@dataclass(frozen=True)
+class AdmissionPolicy:
+    """
+    :param per_command: Maximum executions of the command in flight, across everyone.
+    :param per_user: Maximum executions of the command in flight for a single user.
+    :param per_guild: Maximum executions of the command in flight in a single guild.
+    :param queue: Maximum number of invocations of the command waiting for a slot.
+    :param priority: The priority class of the command.
+    :param timeout: Seconds an invocation may wait before it is rejected.
+    """
+
+    per_command: Optional[int] = None
+    per_user: Optional[int] = None
+    per_guild: Optional[int] = None
+    queue: int = 10
+    priority: Priority = Priority.DEFAULT
+    timeout: float = 120.0
+
+
+DEFAULT_POLICY = AdmissionPolicy()
+
+
+def admission(**kwargs):
+    """
+    Declare the ``AdmissionPolicy`` of a command or, when applied to a cog class, the
+    default policy of every command of that cog. Works above or below the command
+    decorator.
+    """
+    policy = AdmissionPolicy(**kwargs)
+
+    def decorator(obj):
+        target = obj.callback if isinstance(obj, commands.Command) else obj
+        target.__admission_policy__ = policy
+        return obj
+
+    return decorator
+
+
+class AdmissionRejected(commands.CommandError):
+    """
+    Raised from the ``before_invoke`` hook when a command cannot be admitted.
+    """
+
+    def __init__(self, command_name: str, reason: str) -> None:
+        self.command_name = command_name
+        self.reason = reason
+        super().__init__(f"/{command_name} is busy: {reason}")
+
+
+@dataclass
+class _Ticket:
+    command: str
+    policy: AdmissionPolicy
+    user_id: int
+    guild_id: Optional[int]
+    seq: int
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    future: Optional[asyncio.Future] = None
+
+    @property
+    def keys(self) -> Tuple[tuple, ...]:
+        keys = [("command", self.command), ("user", self.command, self.user_id)]
+        if self.guild_id is not None:
+            keys.append(("guild", self.command, self.guild_id))
+        return tuple(keys)
+
+    def sort_key(self) -> Tuple[int, int]:
+        return self.policy.priority, self.seq
+
+
+class AdmissionController:
+    """
+    Tracks running commands and admits waiting ones by priority.
+
+    :param max_in_flight: The bot-wide number of admitted commands, or ``0`` for no limit.
+    :param metrics: Optional ``BotMetrics`` to record wait times and rejections in.
+    """
+
+    def __init__(self, max_in_flight: int = 50, *, metrics=None) -> None:
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._counts: Dict[tuple, int] = {}
+        self._waiting: List[_Ticket] = []
+        self._running: "weakref.WeakKeyDictionary[commands.Context, _Ticket]" = weakref.WeakKeyDictionary()
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.rejected = 0
+        self.closed_reason: Optional[str] = None
+        self._wait_time = self._rejections = None
+        if metrics is not None:
+            self._wait_time = metrics.registry.histogram(
+                "bot_admission_wait_seconds", "Time commands waited for an admission slot.", ("command",)
+            )
+            self._rejections = metrics.registry.counter(
+                "bot_admission_rejected_total", "Commands rejected by admission control.", ("command", "reason")
+            )
+
+    @staticmethod
+    def policy_for(command: commands.Command) -> AdmissionPolicy:
+        root = command.root_parent or command
+        policy = getattr(root.callback, "__admission_policy__", None)
+        if policy is None and root.cog is not None:
+            policy = getattr(type(root.cog), "__admission_policy__", None)
+        return policy or DEFAULT_POLICY
+
+    def _budget(self, priority: Priority) -> Optional[int]:
+        if not self.max_in_flight or priority == Priority.OWNER:
+            return None
+        if priority == Priority.BULK:
+            return max(1, int(self.max_in_flight * BULK_SHARE))
+        return self.max_in_flight
+
+    def _fits(self, ticket: _Ticket) -> bool:
+        policy = ticket.policy
+        limits = (policy.per_command, policy.per_user, policy.per_guild)
+        for key, limit in zip(ticket.keys, limits):
+            if limit is not None and self._counts.get(key, 0) >= limit:
+                return False
+        return True
+
+    def _admit(self, ticket: _Ticket) -> None:
+        for key in ticket.keys:
+            self._counts[key] = self._counts.get(key, 0) + 1
+        self.in_flight += 1
+        self.admitted += 1
+
+    def _pump(self) -> None:
+        """
+        Admit every waiting ticket that fits, highest priority first. Once a ticket is
+        held back by the bot-wide budget, lower priority tickets may not take a slot
+        from the budget ahead of it.
+        """
+        budget_blocked_at: Optional[Priority] = None
+        for ticket in sorted(self._waiting, key=_Ticket.sort_key):
+            if ticket.future is not None and ticket.future.done():
+                continue
+            budget = self._budget(ticket.policy.priority)
+            if budget is not None:
+                if budget_blocked_at is not None and ticket.policy.priority >= budget_blocked_at:
+                    continue
+                if self.in_flight >= budget:
+                    budget_blocked_at = ticket.policy.priority
+                    continue
+            if not self._fits(ticket):
+                continue
+            self._waiting.remove(ticket)
+            self._admit(ticket)
+            if ticket.future is not None:
+                ticket.future.set_result(None)
+
+    def position(self, ticket: _Ticket) -> int:
+        return sorted(self._waiting, key=_Ticket.sort_key).index(ticket) + 1
+
+    def _reject(self, ticket: _Ticket, reason: str, label: str) -> AdmissionRejected:
+        self.rejected += 1
+        if self._rejections is not None:
+            self._rejections.inc(command=ticket.command, reason=label)
+        return AdmissionRejected(ticket.command, reason)
+
+    async def acquire(self, context: commands.Context) -> None:
+        """
+        The ``before_invoke`` hook: admit the command or wait in the queue for a slot.
+
+        :raises AdmissionRejected: If the queue is full or the wait timed out.
+        """
+        command = context.command
+        if command is None or command.extras.get("lazy_stub") or context in self._running:
+            return
+        policy = self.policy_for(command)
+        if self.closed_reason is not None:
+            raise AdmissionRejected((command.root_parent or command).qualified_name, self.closed_reason)
+        ticket = _Ticket(
+            command=(command.root_parent or command).qualified_name,
+            policy=policy,
+            user_id=context.author.id,
+            guild_id=context.guild.id if context.guild else None,
+            seq=next(self._seq),
+        )
+
+        self._waiting.append(ticket)
+        self._pump()
+        if ticket not in self._waiting:
+            self._running[context] = ticket
+            return
+
+        queued_for_command = sum(1 for waiting in self._waiting if waiting.command == ticket.command)
+        if queued_for_command > policy.queue:
+            self._waiting.remove(ticket)
+            raise self._reject(ticket, "too many requests are already queued, try again later.", "queue_full")
+
+        ticket.future = asyncio.get_running_loop().create_future()
+        notice = await self._notify_queued(context, ticket)
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=policy.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Admitted at the same moment; give the slot back.
+                self._release_ticket(ticket)
+            else:
+                ticket.future.cancel()
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._reject(ticket, f"no slot became free within {policy.timeout:.0f} seconds.", "timeout")
+        finally:
+            if notice is not None:
+                try:
+                    await notice.delete()
+                except discord.HTTPException:
+                    pass
+
+        self._running[context] = ticket
+        if self._wait_time is not None:
+            self._wait_time.observe(time.perf_counter() - ticket.enqueued_at, command=ticket.command)
+
+    async def _notify_queued(self, context: commands.Context, ticket: _Ticket) -> Optional[discord.Message]:
+        if context.interaction is not None and not context.interaction.response.is_done():
+            # Interactions must be acknowledged within 3 seconds.
+            await context.defer()
+        embed = discord.Embed(
+            description=f"The bot is busy, you are **#{self.position(ticket)}** in the queue for `/{ticket.command}`.",
+            color=0xBEBEFE,
+        )
+        try:
+            return await context.send(embed=embed)
+        except discord.HTTPException:
+            return None
+
+    def close(self, reason: str) -> None:
+        """
+        Stop admitting commands: reject the waiting ones and every new one with ``reason``.
+        Commands already running are not affected.
+        """
+        self.closed_reason = reason
+        for ticket in list(self._waiting):
+            self._waiting.remove(ticket)
+            if ticket.future is not None and not ticket.future.done():
+                ticket.future.set_exception(self._reject(ticket, reason, "shutdown"))
+
+    def _release_ticket(self, ticket: _Ticket) -> None:
+        for key in ticket.keys:
+            remaining = self._counts.get(key, 0) - 1
+            if remaining > 0:
+                self._counts[key] = remaining
+            else:
+                self._counts.pop(key, None)
+        self.in_flight -= 1
+        self._pump()
+
+    async def release(self, context: commands.Context) -> None:
+        """
+        The ``after_invoke`` hook. Also called from ``on_command_error``, since hybrid
+        commands invoked as slash commands skip ``after_invoke`` when they fail; releasing
+        twice is a no-op.
+        """
+        ticket = self._running.pop(context, None)
+        if ticket is not None:
+            self._release_ticket(ticket)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "waiting": len(self._waiting),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
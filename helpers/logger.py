@@ -0,0 +1,209 @@
+"""
+Non-blocking logging pipeline for the "Neurodivergence" logger.
+
+Records are put on a bounded queue by ``DroppingQueueHandler`` (which never blocks the
+event loop) and written by a ``QueueListener`` on a background thread, so file writes,
+rotation and compression all happen off the loop. When the queue is full the record is
+dropped and counted; the next record that makes it through is preceded by a warning
+that says how many were lost.
+"""
+
+from __future__ import annotations
+
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+from typing import Dict, Optional
+
+
+class LoggingFormatter(logging.Formatter):
+    # Colors
+    black = "\x1b[30m"
+    red = "\x1b[31m"
+    green = "\x1b[32m"
+    yellow = "\x1b[33m"
+    blue = "\x1b[34m"
+    gray = "\x1b[38m"
+    # Styles
+    reset = "\x1b[0m"
+    bold = "\x1b[1m"
+
+    COLORS = {
+        logging.DEBUG: gray + bold,
+        logging.INFO: blue + bold,
+        logging.WARNING: yellow + bold,
+        logging.ERROR: red,
+        logging.CRITICAL: red + bold,
+    }
+
+    def format(self, record):
+        log_color = self.COLORS[record.levelno]
+        format = "(black){asctime}(reset) (levelcolor){levelname:<8}(reset) (green){name}(reset) {message}"
+        format = format.replace("(black)", self.black + self.bold)
+        format = format.replace("(reset)", self.reset)
+        format = format.replace("(levelcolor)", log_color)
+        format = format.replace("(green)", self.green + self.bold)
+        formatter = logging.Formatter(format, "%Y-%m-%d %H:%M:%S", style="{")
+        return formatter.format(record)
+
+
+FILE_FORMATTER = logging.Formatter(
+    "[{asctime}] [{levelname:<8}] {name}: {message}", "%Y-%m-%d %H:%M:%S", style="{"
+)
+
+
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    A ``QueueHandler`` that uses ``put_nowait`` on a bounded queue and counts drops
+    instead of blocking the caller.
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]") -> None:
+        super().__init__(log_queue)
+        self._lock = threading.Lock()
+        self.dropped_total = 0
+        self.dropped_by_level: Dict[str, int] = {}
+        self._pending_drops = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        with self._lock:
+            pending = self._pending_drops
+        if pending:
+            notice = logging.LogRecord(
+                record.name, logging.WARNING, __file__, 0,
+                f"Logging queue overflowed, dropped {pending} record(s)", None, None,
+            )
+            try:
+                self.queue.put_nowait(notice)
+            except queue.Full:
+                pass
+            else:
+                with self._lock:
+                    self._pending_drops -= pending
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped_total += 1
+                self._pending_drops += 1
+                self.dropped_by_level[record.levelname] = self.dropped_by_level.get(record.levelname, 0) + 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # The queue is bounded, so wait for the listener to make room instead of
+        # raising queue.Full like the stdlib ``put_nowait`` would.
+        self.queue.put(self._sentinel)
+
+
+class LoggingPipeline:
+    """
+    Owns the queue, the queue handler attached to the logger and the listener thread.
+    """
+
+    def __init__(self, logger: logging.Logger, handler: DroppingQueueHandler, listener: _QueueListener) -> None:
+        self.logger = logger
+        self.handler = handler
+        self.listener = listener
+        self._running = False
+
+    def start(self) -> None:
+        if not self._running:
+            self.listener.start()
+            self._running = True
+
+    def stop(self) -> None:
+        """
+        Flush everything that is still queued and stop the listener thread.
+        """
+        if self._running:
+            self._running = False
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.flush()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "queued": self.handler.queue.qsize(),
+            "capacity": self.handler.queue.maxsize,
+            "dropped": self.handler.dropped_total,
+            "dropped_by_level": dict(self.handler.dropped_by_level),
+        }
+
+
+def create_file_handler(
+    filename: str,
+    *,
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    when: Optional[str] = None,
+    compress: bool = False,
+) -> logging.Handler:
+    """
+    Create the rotating file handler. ``when`` (e.g. ``"midnight"`` or ``"H"``) selects
+    time-based rotation, otherwise the file rotates once it reaches ``max_bytes``.
+    A ``max_bytes`` of ``0`` together with no ``when`` disables rotation.
+    """
+    if when:
+        handler: logging.Handler = logging.handlers.TimedRotatingFileHandler(
+            filename, when=when, backupCount=backup_count, encoding="utf-8"
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            filename, mode="a", maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+    if compress:
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
+    handler.setFormatter(FILE_FORMATTER)
+    return handler
+
+
+def setup_logging(
+    logger: logging.Logger,
+    *,
+    filename: str = "discord.log",
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    when: Optional[str] = None,
+    compress: bool = False,
+    queue_size: int = 10000,
+) -> LoggingPipeline:
+    """
+    Replace the handlers of ``logger`` with a queue handler feeding a console handler
+    and a rotating file handler on a background thread. The pipeline is started before
+    it is returned.
+    """
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(LoggingFormatter())
+    file_handler = create_file_handler(
+        filename, max_bytes=max_bytes, backup_count=backup_count, when=when, compress=compress
+    )
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    listener = _QueueListener(
+        log_queue, console_handler, file_handler, respect_handler_level=True
+    )
+
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+
+    pipeline = LoggingPipeline(logger, queue_handler, listener)
+    pipeline.start()
+    return pipeline
@@ -0,0 +1,201 @@
+"""
+Event loop health: scheduling lag and stack traces of callbacks that block the loop.
+
+``LoopMonitor`` runs two probes:
+
+- A sampler task on the loop sleeps for ``interval`` seconds and measures how late it
+  wakes up. The difference is the scheduling lag every other coroutine (including the
+  gateway heartbeat) suffers at that moment.
+- A watchdog thread watches the sampler. When the loop has not run the sampler for
+  longer than ``threshold``, something is blocking it, and the watchdog captures the
+  stack of the loop thread through ``sys._current_frames()`` while it is still blocked.
+
+Each stall is attributed to the task that was running: commands label their task in
+the bot's ``before_invoke`` hook, listeners are recognised by discord.py's task names
+(``discord.py: on_message``) and other tasks by their name and coroutine. Stalls are
+logged, counted in the metrics and shown by the owner ``loophealth`` command.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+import re
+import sys
+import threading
+import time
+import traceback
+import weakref
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger("Neurodivergence")
+
+# Frames kept from the captured stack (the innermost ones).
+STACK_DEPTH = 12
+# The name asyncio gives tasks created without one.
+_DEFAULT_TASK_NAME = re.compile(r"Task-\d+")
+
+
+@dataclass
+class Stall:
+    label: str
+    started_at: float
+    duration: float
+    stack: List[str]
+
+    @property
+    def location(self) -> str:
+        """
+        The innermost frame of the captured stack, e.g. ``cogs/fun.py:41 in wanted``.
+        """
+        return self.stack[-1].strip().splitlines()[0] if self.stack else "unknown"
+
+
+class LoopMonitor:
+    """
+    :param interval: Seconds between lag samples.
+    :param threshold: Seconds the loop may be blocked before the stall is captured.
+    :param history: Number of recent samples and stalls kept.
+    :param metrics: Optional ``BotMetrics`` to record lag and stalls in.
+    """
+
+    def __init__(self, *, interval: float = 0.1, threshold: float = 0.25, history: int = 600, metrics=None) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.samples: Deque[float] = collections.deque(maxlen=history)
+        self.stalls: Deque[Stall] = collections.deque(maxlen=50)
+        self.stall_counts: Dict[str, int] = collections.Counter()
+        self.max_lag = 0.0
+        self._labels: "weakref.WeakKeyDictionary[asyncio.Task, str]" = weakref.WeakKeyDictionary()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._beat = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._lag = self._stall_total = None
+        if metrics is not None:
+            self._lag = metrics.registry.histogram(
+                "bot_event_loop_lag_seconds", "How late the event loop ran a timer.", (),
+                (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+            )
+            self._stall_total = metrics.registry.counter(
+                "bot_event_loop_stalls_total", "Times the event loop was blocked longer than the threshold.", ("label",)
+            )
+
+    def start(self) -> None:
+        """
+        Start the sampler and the watchdog. Must be called from the running loop.
+        """
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._sample(), name="loop-monitor")
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join, 1.0)
+            self._thread = None
+
+    def label_current_task(self, label: str) -> None:
+        """
+        Attribute stalls in the current task to ``label``, e.g. ``command weather``.
+        """
+        task = asyncio.current_task()
+        if task is not None:
+            self._labels[task] = label
+
+    async def _sample(self) -> None:
+        while True:
+            started = time.perf_counter()
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self._beat = time.monotonic()
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if self._lag is not None:
+                self._lag.observe(lag)
+
+    def _describe_running_task(self) -> str:
+        # Only a dict lookup, so it is safe enough to do from the watchdog thread.
+        task = asyncio.current_task(self._loop)
+        if task is None:
+            return "loop callback"
+        label = self._labels.get(task)
+        if label:
+            return label
+        qualname = getattr(task.get_coro(), "__qualname__", None)
+        name = task.get_name()
+        if _DEFAULT_TASK_NAME.fullmatch(name):
+            # "Task-1234" is unique per task; the label is a metric label, so it must not be.
+            return qualname or "task"
+        return f"{name} ({qualname})" if qualname and qualname not in name else name
+
+    def _capture_stack(self) -> List[str]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return []
+        frames = traceback.extract_stack(frame)
+        # Drop the event loop machinery: everything up to the Handle that runs the callback.
+        for index in range(len(frames) - 1, -1, -1):
+            if frames[index].filename.endswith(("asyncio/events.py", "asyncio\\events.py")):
+                frames = frames[index + 1:]
+                break
+        return traceback.format_list(frames[-STACK_DEPTH:])
+
+    def _watch(self) -> None:
+        poll = max(self.threshold / 4, 0.01)
+        stall: Optional[Stall] = None
+        while not self._stopping.wait(poll):
+            now = time.monotonic()
+            blocked_for = now - self._beat - self.interval
+            if blocked_for > self.threshold:
+                if stall is None:
+                    stall = Stall(
+                        label=self._describe_running_task(),
+                        started_at=time.time() - blocked_for,
+                        duration=blocked_for,
+                        stack=self._capture_stack(),
+                    )
+                else:
+                    stall.duration = blocked_for
+            elif stall is not None:
+                # Recorded on the loop, where loophealth reads the stalls.
+                try:
+                    self._loop.call_soon_threadsafe(self._record, stall)
+                except RuntimeError:
+                    # The loop was closed meanwhile.
+                    pass
+                stall = None
+
+    def _record(self, stall: Stall) -> None:
+        self.stalls.append(stall)
+        self.stall_counts[stall.label] += 1
+        if self._stall_total is not None:
+            self._stall_total.inc(label=stall.label)
+        logger.warning(
+            f"Event loop blocked for {stall.duration * 1000:.0f}ms by {stall.label} at {stall.location}\n"
+            + "".join(stall.stack)
+        )
+
+    def lag_percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
@@ -0,0 +1,113 @@
+"""
+Preparation of attachments before they are sent inline to Gemini.
+
+Gemini reads images in tiles of 768x768 pixels, so a 4000x3000 photo costs many times
+the tokens and the upload of what the model can use. ``MediaProcessor.prepare``:
+
+- downscales images so their long side is at most ``MAX_IMAGE_SIDE`` pixels, after
+  applying their EXIF orientation;
+- re-encodes them as JPEG, or as WebP when they have transparency, without metadata
+  (EXIF, GPS, ICC profiles);
+- replaces animated GIFs, WebPs and PNGs with up to ``ANIMATION_FRAMES`` frames spread
+  over the animation;
+- base64-encodes the result.
+
+Videos, audio, PDFs and images Pillow cannot read are only base64-encoded. The work runs
+in a pool of ``MEDIA_WORKERS`` threads of its own (Pillow releases the GIL while decoding,
+resizing and encoding), so a burst of attachments neither blocks the event loop nor
+holds up the default executor that aiohttp resolves host names in.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger("Neurodivergence")
+
+MAX_IMAGE_SIDE = 1536
+JPEG_QUALITY = 85
+ANIMATION_FRAMES = 4
+
+
+def _encode(image: Image.Image) -> Tuple[str, bytes]:
+    transparent = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+    # Converted first: palette images would be resized with nearest neighbour.
+    image = image.convert("RGBA" if transparent else "RGB")
+    image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    if transparent:
+        image.save(out, "WEBP", quality=JPEG_QUALITY)
+        return "image/webp", out.getvalue()
+    image.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    return "image/jpeg", out.getvalue()
+
+
+def prepare_media(data: bytes, mime_type: str) -> List[Tuple[str, str]]:
+    """
+    The parts to send for an attachment, as (mime type, base64 data). Blocking.
+    """
+    parts = None
+    if mime_type.startswith("image/"):
+        try:
+            parts = _prepare_image(data)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.debug(f"Sending a {mime_type} attachment as is, Pillow could not read it: {e}")
+    if parts is None:
+        parts = [(mime_type, data)]
+    return [(mime, base64.b64encode(payload).decode("ascii")) for mime, payload in parts]
+
+
+def _prepare_image(data: bytes) -> List[Tuple[str, bytes]]:
+    with Image.open(io.BytesIO(data)) as image:
+        frames = getattr(image, "n_frames", 1)
+        if frames <= 1:
+            scale = MAX_IMAGE_SIDE / max(image.size)
+            if scale < 1:
+                # JPEGs are then decoded at a reduced scale no smaller than the target,
+                # which is much cheaper than decoding them whole.
+                image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+            return [_encode(ImageOps.exif_transpose(image))]
+        indexes = sorted({round(index * (frames - 1) / (ANIMATION_FRAMES - 1)) for index in range(ANIMATION_FRAMES)})
+        parts = []
+        for index in indexes:
+            image.seek(index)
+            parts.append(_encode(image))
+        return parts
+
+
+class MediaProcessor:
+    """
+    :param workers: Threads preparing attachments at the same time.
+    """
+
+    def __init__(self, workers: int = 2) -> None:
+        self.workers = workers
+        self.prepared = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    async def prepare(self, data: bytes, mime_type: str) -> List[Tuple[str, str]]:
+        """
+        See ``prepare_media``.
+        """
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="media")
+        parts = await asyncio.get_running_loop().run_in_executor(self._pool, prepare_media, data, mime_type)
+        self.prepared += 1
+        self.bytes_in += len(data)
+        # Decoded size of the base64 data.
+        self.bytes_out += sum(len(encoded) * 3 // 4 for _, encoded in parts)
+        return parts
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,118 @@
+"""
+A global byte budget for the buffers the bot itself keeps in memory.
+
+Each buffer (every upstream cache, the channel history) registers with ``bot.memory`` as
+a consumer that reports its estimated ``size`` and can drop its least recently used item.
+Once the consumers together exceed ``MEMORY_BUDGET_MB``, the least recently used item
+across all of them is evicted until they fit again, so a burst of Shodan searches pushes
+out old weather lookups instead of growing the process.
+
+discord.py's own caches are sized through the configuration instead (``MAX_MESSAGES``,
+``MEMBER_CACHE``). The owner ``memory`` command shows the RSS, the budget per consumer,
+the discord.py caches and, while tracemalloc is tracing, the top allocating lines.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import tracemalloc
+from typing import Dict, List, Optional, Protocol, Tuple
+
+logger = logging.getLogger("Neurodivergence")
+
+
+class BudgetConsumer(Protocol):
+    size: int
+
+    def lru_timestamp(self) -> Optional[float]:
+        """
+        ``time.monotonic()`` of the last use of the least recently used item, or ``None``
+        when empty.
+        """
+
+    def evict_lru(self) -> int:
+        """
+        Drop the least recently used item, returning the bytes freed.
+        """
+
+
+def rss_bytes() -> int:
+    """
+    The resident set size of this process.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        # Peak instead of current RSS where /proc is not available; KiB on Linux, bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def top_allocations(limit: int = 10) -> List[Tuple[str, int, int]]:
+    """
+    The lines that allocated the most memory still alive, as (location, bytes, blocks).
+    Only available while tracemalloc is tracing; slow, run it in a thread.
+    """
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"))
+    )
+    stats = snapshot.statistics("lineno")[:limit]
+    return [(f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", stat.size, stat.count) for stat in stats]
+
+
+class MemoryBudget:
+    """
+    :param limit: The byte budget shared by the consumers, or ``None`` for no budget
+        (each consumer still applies its own limits).
+    """
+
+    def __init__(self, limit: Optional[int] = None) -> None:
+        self.limit = limit
+        self.evictions = 0
+        self.consumers: Dict[str, BudgetConsumer] = {}
+
+    def register(self, name: str, consumer: BudgetConsumer) -> None:
+        self.consumers[name] = consumer
+        self.enforce()
+
+    def unregister(self, name: str) -> None:
+        self.consumers.pop(name, None)
+
+    @property
+    def used(self) -> int:
+        return sum(consumer.size for consumer in self.consumers.values())
+
+    def enforce(self, *, reserve: int = 0) -> int:
+        """
+        Evict the least recently used items across the consumers until they fit in the
+        budget, with ``reserve`` bytes to spare for an item about to be added. Returns
+        the bytes freed.
+        """
+        if self.limit is None:
+            return 0
+        used = self.used + reserve
+        freed = 0
+        while used > self.limit:
+            oldest: Optional[Tuple[float, BudgetConsumer]] = None
+            for consumer in self.consumers.values():
+                timestamp = consumer.lru_timestamp()
+                if timestamp is not None and (oldest is None or timestamp < oldest[0]):
+                    oldest = (timestamp, consumer)
+            if oldest is None:
+                break
+            released = oldest[1].evict_lru()
+            used -= released
+            freed += released
+            self.evictions += 1
+        return freed
+
+    def usage(self) -> List[Tuple[str, int]]:
+        """
+        The size of every consumer, largest first.
+        """
+        return sorted(((name, consumer.size) for name, consumer in self.consumers.items()), key=lambda item: item[1], reverse=True)
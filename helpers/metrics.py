@@ -0,0 +1,268 @@
+"""
+Command and upstream HTTP metrics in the Prometheus text format.
+
+``BotMetrics`` is fed by the bot's ``on_command`` / ``on_command_completion`` /
+``on_command_error`` events and by an aiohttp ``TraceConfig`` attached to the pooled
+HTTP sessions. When ``METRICS_PORT`` is set the metrics are served on
+``http://METRICS_HOST:METRICS_PORT/metrics`` (``127.0.0.1`` by default).
+
+Only the small subset of the Prometheus data model the bot needs is implemented
+(counters, gauges and histograms with labels), so no client library is required.
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import math
+import time
+import weakref
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import aiohttp
+from aiohttp import web
+from discord.ext import commands
+
+logger = logging.getLogger("Neurodivergence")
+
+LabelValues = Tuple[str, ...]
+
+COMMAND_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+HTTP_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self.samples()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = COMMAND_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def count(self, **labels: str) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def quantile(self, q: float, **labels: str) -> Optional[float]:
+        """
+        Estimate a quantile from the buckets (upper bound of the bucket it falls in).
+        """
+        counts = self._counts.get(self._key(labels))
+        if not counts:
+            return None
+        target = q * sum(counts)
+        running = 0
+        for bound, count in zip((*self.buckets, math.inf), counts):
+            running += count
+            if running >= target:
+                return bound
+        return math.inf
+
+    def samples(self) -> Iterable[str]:
+        for key in sorted(self._counts):
+            running = 0
+            for bound, count in zip((*self.buckets, math.inf), self._counts[key]):
+                running += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {running}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(self._sums[key])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {running}"
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = COMMAND_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class BotMetrics:
+    """
+    The bot's metrics: per-command latency/in-flight/errors and upstream HTTP timings.
+    """
+
+    def __init__(self) -> None:
+        self.registry = MetricsRegistry()
+        self.command_latency = self.registry.histogram(
+            "bot_command_duration_seconds", "Time from invoke to completion or error.", ("command", "outcome")
+        )
+        self.commands_in_flight = self.registry.gauge(
+            "bot_commands_in_flight", "Commands currently executing.", ("command",)
+        )
+        self.command_errors = self.registry.counter(
+            "bot_command_errors_total", "Command errors by exception type.", ("command", "error")
+        )
+        self.http_latency = self.registry.histogram(
+            "bot_http_request_duration_seconds", "Outbound HTTP request time by upstream host.",
+            ("host", "method", "status"), HTTP_BUCKETS,
+        )
+        self.http_errors = self.registry.counter(
+            "bot_http_request_errors_total", "Outbound HTTP requests that raised, by upstream host.", ("host", "error")
+        )
+        self.started_at = time.time()
+        self._started: "weakref.WeakKeyDictionary[commands.Context, float]" = weakref.WeakKeyDictionary()
+        self._runner: Optional[web.AppRunner] = None
+
+    @staticmethod
+    def _command_name(context: commands.Context) -> str:
+        return context.command.qualified_name if context.command else "unknown"
+
+    def command_started(self, context: commands.Context) -> None:
+        self._started[context] = time.perf_counter()
+        self.commands_in_flight.inc(command=self._command_name(context))
+
+    def command_finished(self, context: commands.Context, error: Optional[BaseException] = None) -> None:
+        name = self._command_name(context)
+        started = self._started.pop(context, None)
+        if error is not None:
+            original = getattr(error, "original", error)
+            self.command_errors.inc(command=name, error=type(original).__name__)
+        if started is None:
+            # Failed before it was invoked (unknown command, failed check, ...).
+            return
+        self.commands_in_flight.dec(command=name)
+        self.command_latency.observe(
+            time.perf_counter() - started, command=name, outcome="error" if error is not None else "success"
+        )
+
+    def http_trace_config(self) -> aiohttp.TraceConfig:
+        """
+        A ``TraceConfig`` recording the duration of every request made by a session.
+        """
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, trace_context, params) -> None:
+            trace_context.started = time.perf_counter()
+
+        async def on_request_end(session, trace_context, params) -> None:
+            self.http_latency.observe(
+                time.perf_counter() - trace_context.started,
+                host=params.url.host or "", method=params.method, status=str(params.response.status),
+            )
+
+        async def on_request_exception(session, trace_context, params) -> None:
+            self.http_errors.inc(host=params.url.host or "", error=type(params.exception).__name__)
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+    def render(self) -> str:
+        return self.registry.render()
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=self.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def serve(self, host: str, port: int) -> None:
+        """
+        Serve ``/metrics`` on ``host:port``.
+        """
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
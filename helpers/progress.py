@@ -0,0 +1,102 @@
+"""
+Progressive display of a growing text, such as a streamed AI answer, in a Discord message.
+
+``ThrottledEdit`` shows the first text at once and coalesces the updates after it into at
+most one edit per ``interval`` seconds, so a fast stream shows up within a few hundred
+milliseconds without running into Discord's edit rate limit (5 edits per 5 seconds per
+channel)::
+
+    async def show(text):
+        await msg.edit(embed=discord.Embed(title="Gemini", description=text[:4096]))
+
+    async with ThrottledEdit(show) as progress:
+        answer = await self.gemini_request(prompt, on_text=progress.update)
+        await progress.finish(answer)
+
+Only the latest text is ever shown: the updates that arrive while an edit waits or runs
+replace each other.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+import discord
+
+logger = logging.getLogger("Neurodivergence")
+
+
+class ThrottledEdit:
+    """
+    :param show: Displays a text; usually sends the message on its first call and edits
+        it afterwards.
+    :param interval: Minimum seconds between two calls of ``show``.
+    """
+
+    def __init__(self, show: Callable[[str], Awaitable[None]], *, interval: float = 1.0) -> None:
+        self.show = show
+        self.interval = interval
+        self.edits = 0
+        self._text: Optional[str] = None
+        self._shown: Optional[str] = None
+        self._shown_at = float("-inf")
+        self._showing = False
+        self._finishing = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "ThrottledEdit":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.cancel()
+
+    def update(self, text: str) -> None:
+        """
+        Show ``text`` as soon as the interval allows. Returns at once.
+        """
+        self._text = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush(), name="throttled-edit")
+
+    async def finish(self, text: str) -> None:
+        """
+        Show the final ``text`` now, after the edit already running if any.
+        """
+        self._text = text
+        self._finishing = True
+        if self._task is not None and not self._task.done():
+            if self._showing:
+                await asyncio.shield(self._task)
+            else:
+                self._task.cancel()
+        if text != self._shown:
+            await self._show(text)
+
+    def cancel(self) -> None:
+        """
+        Drop the pending updates.
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    async def _flush(self) -> None:
+        while self._text != self._shown and not self._finishing:
+            delay = self._shown_at + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._show(self._text)
+
+    async def _show(self, text: str) -> None:
+        self._showing = True
+        self._shown = text
+        self._shown_at = time.monotonic()
+        try:
+            await self.show(text)
+            self.edits += 1
+        except discord.HTTPException as e:
+            logger.warning(f"Could not show the progress of a message: {e}")
+        finally:
+            self._showing = False
@@ -0,0 +1,78 @@
+"""
+Opt-in "fast runtime" profile: uvloop as the event loop and orjson as the JSON codec.
+
+``install_runtime(fast=True)`` (``FAST_RUNTIME=true``) must run before the event loop is
+created. Each acceleration is optional: when uvloop or orjson is not installed (uvloop
+does not exist on Windows) the bot falls back to the stdlib and the startup report says
+so. Install them with ``pip install -r requirements-fast.txt``.
+
+The selected codec is used by ``bot.http_client`` for every ``json=`` request body and
+every ``response.json()``. discord.py already switches to orjson on its own whenever it
+is importable.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Callable, List
+
+
+def _orjson_dumps(orjson) -> Callable[[Any], str]:
+    def dumps(obj: Any) -> str:
+        # aiohttp expects ``json_serialize`` to return str; orjson returns UTF-8 bytes.
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            # Values orjson refuses (e.g. integers over 64 bits) still go through json.
+            return json.dumps(obj)
+
+    return dumps
+
+
+@dataclass
+class RuntimeProfile:
+    fast: bool = False
+    event_loop: str = "asyncio"
+    json_codec: str = "json"
+    json_dumps: Callable[[Any], str] = json.dumps
+    json_loads: Callable[[Any], Any] = json.loads
+    notes: List[str] = field(default_factory=list)
+
+    def describe(self) -> str:
+        return f"event loop {self.event_loop}, JSON {self.json_codec}"
+
+
+def install_runtime(fast: bool) -> RuntimeProfile:
+    """
+    Select the event loop policy and JSON codec. Call it before ``asyncio.run`` /
+    ``bot.run`` so the new policy is used for the bot's loop.
+
+    :param fast: Whether to try uvloop and orjson.
+    """
+    profile = RuntimeProfile(fast=fast)
+    if not fast:
+        return profile
+
+    if sys.platform == "win32":
+        profile.notes.append("uvloop is not available on Windows, using the default asyncio loop")
+    else:
+        try:
+            import uvloop
+        except ImportError:
+            profile.notes.append("uvloop is not installed, using the default asyncio loop")
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            profile.event_loop = f"uvloop {uvloop.__version__}"
+
+    try:
+        import orjson
+    except ImportError:
+        profile.notes.append("orjson is not installed, using the stdlib json module")
+    else:
+        profile.json_dumps = _orjson_dumps(orjson)
+        profile.json_loads = orjson.loads
+        profile.json_codec = f"orjson {orjson.__version__}"
+    return profile
@@ -0,0 +1,81 @@
+"""
+Single-flight coalescing of identical concurrent lookups.
+
+When several callers ask for the same key while a lookup for it is still running, they
+all wait for that one lookup and get its result (or its exception) instead of starting
+their own::
+
+    forecast = await self.bot.http_client.coalesce(("weather", town, state), lambda: self.fetch(town, state))
+
+The lookup runs in its own task and each caller waits on it through ``asyncio.shield``,
+so a caller that is cancelled (a timed out command, a deleted interaction) only stops
+waiting. The lookup is cancelled once nobody is waiting for it any more.
+
+The result is shared, not copied: callers must not modify it.
+
+``@cached`` (``helpers/cache.py``) coalesces its misses the same way, so concurrent
+``/weather adelaide`` invocations share one scrape whether the cache is enabled or not.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Runs at most one lookup per key at a time.
+
+    :param name: Used in the name of the lookup tasks, e.g. ``singleflight:http``.
+    """
+
+    def __init__(self, name: str = "singleflight") -> None:
+        self.name = name
+        self.started = 0
+        self.shared = 0
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def pending(self, key: Hashable) -> bool:
+        """
+        Whether a lookup for ``key`` is running, i.e. whether ``do`` would join it.
+        """
+        return key in self._calls
+
+    async def do(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the result of ``fetch()``, or of the running lookup for ``key``.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(fetch(), name=f"singleflight:{self.name}"))
+            call.task.add_done_callback(lambda _, key=key, call=call: self._forget(key, call))
+            self._calls[key] = call
+            self.started += 1
+        else:
+            self.shared += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Every caller gave up: stop the lookup, the next caller starts a new one.
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
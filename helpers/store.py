@@ -0,0 +1,355 @@
+"""
+Persistent key/value store shared by the cogs, backed by SQLite in WAL mode.
+
+State that should survive a restart or a redeploy of the container goes here instead of
+an attribute of the cog::
+
+    state = self.bot.store.namespace("sidepipe")
+    state.set("players:play.example.com", ["Steve", "Alex"])
+    players = await state.get("players:play.example.com", [])
+
+    cached = self.bot.store.namespace("cache:weather")
+    cached.set('["adelaide", "sa"]', forecast, ttl=1800)
+
+- Every namespace is a set of JSON values by string key, in one ``kv`` table. Values
+  with a ``ttl`` expire; expired rows are never returned and are purged periodically.
+- ``set``/``delete``/``clear`` return at once. A single thread owns the connection,
+  takes the queued writes in batches and commits each batch as one transaction, so the
+  event loop never waits on the disk and a burst of writes costs one commit.
+- Reads are queued behind the writes before them, so a ``get`` always sees the last
+  ``set`` of the same process. Other processes (cluster workers) see it once committed.
+- Values are encoded in the writer thread: do not modify a value after passing it to
+  ``set``.
+
+The database is ``STATE_DB`` (``state/bot.db`` in the repo by default, a mounted volume
+in ``docker-compose.yml``). ``STATE_DB=:memory:`` keeps everything in memory.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("Neurodivergence")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at) WHERE expires_at IS NOT NULL;
+"""
+
+_STOP = object()
+
+# Read from a row whose value is not valid JSON.
+_CORRUPT = object()
+
+
+class Namespace:
+    """
+    The keys of one cog or cache, see ``Store.namespace``.
+    """
+
+    def __init__(self, store: "Store", name: str) -> None:
+        self.store = store
+        self.name = name
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        return await self.store.get(self.name, key, default)
+
+    async def items(self) -> Dict[str, Any]:
+        return await self.store.items(self.name)
+
+    def set(self, key: str, value: Any, *, ttl: Optional[float] = None) -> None:
+        self.store.set(self.name, key, value, ttl=ttl)
+
+    def delete(self, key: str) -> None:
+        self.store.delete(self.name, key)
+
+    def clear(self, key_prefix: Optional[str] = None) -> None:
+        self.store.clear(self.name, key_prefix)
+
+
+class Store:
+    """
+    :param path: The SQLite database file, created with its directory if missing, or
+        ``:memory:``.
+    :param batch_interval: Seconds the writer waits for more writes before committing.
+    :param batch_size: Most operations committed in one transaction.
+    :param purge_interval: Seconds between deletions of expired rows.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        batch_interval: float = 0.05,
+        batch_size: int = 500,
+        purge_interval: float = 300.0,
+    ) -> None:
+        self.path = path
+        self.batch_interval = batch_interval
+        self.batch_size = batch_size
+        self.purge_interval = purge_interval
+        self.batches = 0
+        self.writes = 0
+        self.reads = 0
+        self.errors = 0
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def namespace(self, name: str) -> Namespace:
+        return Namespace(self, name)
+
+    async def open(self) -> None:
+        """
+        Open the database and start the writer thread.
+        """
+        if self._thread is not None:
+            return
+        ready = asyncio.get_running_loop().create_future()
+        self._thread = threading.Thread(
+            target=self._run, args=(asyncio.get_running_loop(), ready), name="state-store", daemon=True
+        )
+        self._thread.start()
+        try:
+            await ready
+        except Exception:
+            self._thread = None
+            raise
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    # Writes: queued, committed in batches by the thread.
+
+    def set(self, namespace: str, key: str, value: Any, *, ttl: Optional[float] = None) -> None:
+        """
+        Store ``value`` (anything ``json`` can encode) under ``namespace``/``key``.
+
+        :param ttl: Seconds until the value expires, or ``None`` to keep it.
+        """
+        expires_at = time.time() + ttl if ttl is not None else None
+        self._put(("set", namespace, key, value, expires_at))
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._put(("delete", namespace, key))
+
+    def clear(self, namespace: str, key_prefix: Optional[str] = None) -> None:
+        """
+        Delete every key of ``namespace``, or only those starting with ``key_prefix``.
+        """
+        self._put(("clear", namespace, key_prefix))
+
+    def _put(self, op: Tuple) -> None:
+        if self._closed or self._thread is None:
+            logger.warning(f"State store is not open, dropped a {op[0]} of {op[1]}")
+            return
+        self._queue.put(op)
+
+    # Reads: queued behind the writes before them, answered through a future.
+
+    async def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        value = await self._request("get", namespace, key)
+        return default if value is None else value
+
+    async def items(self, namespace: str) -> Dict[str, Any]:
+        return await self._request("items", namespace)
+
+    async def flush(self) -> None:
+        """
+        Wait until every write queued so far is committed.
+        """
+        await self._request("flush")
+
+    async def _request(self, op: str, *args: Any) -> Any:
+        if self._closed or self._thread is None:
+            raise RuntimeError("State store is not open")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put((op, future) + args)
+        return await future
+
+    async def close(self) -> None:
+        """
+        Commit the queued writes and close the database. Safe to call more than once.
+        """
+        if self._closed or self._thread is None:
+            self._closed = True
+            return
+        self._closed = True
+        self._queue.put((_STOP,))
+        await asyncio.to_thread(self._thread.join)
+
+    # The writer thread.
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL with synchronous=NORMAL only syncs at checkpoints: a commit may be lost in
+        # a power cut but the database is never corrupted.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Cluster workers share the file.
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _run(self, loop: asyncio.AbstractEventLoop, ready: asyncio.Future) -> None:
+        try:
+            conn = self._connect()
+        except Exception as e:
+            loop.call_soon_threadsafe(_resolve, ready, None, e)
+            return
+        loop.call_soon_threadsafe(_resolve, ready, None, None)
+        next_purge = time.monotonic() + self.purge_interval
+        try:
+            while True:
+                try:
+                    first = self._queue.get(timeout=max(0.0, next_purge - time.monotonic()))
+                except queue.Empty:
+                    first = None
+                if time.monotonic() >= next_purge:
+                    self._purge(conn)
+                    next_purge = time.monotonic() + self.purge_interval
+                if first is None:
+                    continue
+                batch = self._collect(first)
+                stop = batch[-1][0] is _STOP
+                self._apply(conn, loop, [op for op in batch if op[0] is not _STOP])
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _collect(self, first: Tuple) -> List[Tuple]:
+        """
+        ``first`` and the operations queued after it, waiting up to ``batch_interval`` for
+        more writes. A read or a stop ends the batch at once.
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size and batch[-1][0] in ("set", "delete", "clear"):
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _apply(self, conn: sqlite3.Connection, loop: asyncio.AbstractEventLoop, batch: List[Tuple]) -> None:
+        if not batch:
+            return
+        results = []
+        now = time.time()
+        try:
+            conn.execute("BEGIN")
+            for op in batch:
+                kind = op[0]
+                if kind == "set":
+                    _, namespace, key, value, expires_at = op
+                    try:
+                        encoded = json.dumps(value, separators=(",", ":"))
+                    except (TypeError, ValueError) as e:
+                        self.errors += 1
+                        logger.warning(f"Could not store {namespace}/{key}: {e}")
+                        continue
+                    conn.execute(
+                        "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                        (namespace, key, encoded, expires_at, now),
+                    )
+                    self.writes += 1
+                elif kind == "delete":
+                    conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (op[1], op[2]))
+                    self.writes += 1
+                elif kind == "clear":
+                    _, namespace, prefix = op
+                    if prefix is None:
+                        conn.execute("DELETE FROM kv WHERE namespace = ?", (namespace,))
+                    else:
+                        conn.execute(
+                            "DELETE FROM kv WHERE namespace = ? AND substr(key, 1, ?) = ?",
+                            (namespace, len(prefix), prefix),
+                        )
+                    self.writes += 1
+                elif kind == "get":
+                    _, future, namespace, key = op
+                    row = conn.execute(
+                        "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                        (namespace, key, now),
+                    ).fetchone()
+                    decoded = self._decode(namespace, key, row[0]) if row else None
+                    results.append((future, None if decoded is _CORRUPT else decoded))
+                    self.reads += 1
+                elif kind == "items":
+                    _, future, namespace = op
+                    rows = conn.execute(
+                        "SELECT key, value FROM kv WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+                        (namespace, now),
+                    ).fetchall()
+                    items = {}
+                    for key, value in rows:
+                        decoded = self._decode(namespace, key, value)
+                        if decoded is not _CORRUPT:
+                            items[key] = decoded
+                    results.append((future, items))
+                    self.reads += 1
+                elif kind == "flush":
+                    results.append((op[1], None))
+            conn.execute("COMMIT")
+            self.batches += 1
+        except Exception as e:
+            # Anything else would end the writer thread and leave every future unresolved.
+            self.errors += 1
+            logger.error(f"State store batch of {len(batch)} operations failed: {type(e).__name__}: {e}")
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            except sqlite3.Error as rollback_error:
+                logger.error(f"Rolling back the state store batch failed: {rollback_error}")
+            for op in batch:
+                if op[0] in ("get", "items", "flush"):
+                    loop.call_soon_threadsafe(_resolve, op[1], None, e)
+            return
+        for future, value in results:
+            loop.call_soon_threadsafe(_resolve, future, value, None)
+
+    def _decode(self, namespace: str, key: str, value: str) -> Any:
+        try:
+            return json.loads(value)
+        except ValueError as e:
+            # A corrupt row reads as missing; the next set replaces it.
+            self.errors += 1
+            logger.warning(f"Could not read {namespace}/{key} from the state store: {e}")
+            return _CORRUPT
+
+    def _purge(self, conn: sqlite3.Connection) -> None:
+        try:
+            deleted = conn.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),)).rowcount
+            if deleted:
+                logger.debug(f"Purged {deleted} expired rows from the state store")
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.error(f"Purging the state store failed: {e}")
+
+
+def _resolve(future: asyncio.Future, value: Any, error: Optional[BaseException]) -> None:
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(value)
@@ -0,0 +1,403 @@
+"""
+Keyword and regex triggers for incoming messages, matched once per message.
+
+Cogs register triggers on ``bot.triggers`` instead of scanning every message in their own
+``on_message`` listener::
+
+    self.bot.triggers.register("ai.neuro", self.on_neuro, keywords=["neuro"])
+
+A trigger is global, or scoped to a guild or a channel. For every scope, the keywords of
+all triggers that apply are compiled into one trie-shaped regex (a shared prefix is only
+tested once, much like Aho-Corasick) that runs over the lowercased message, and the regex
+triggers into one combined alternation. Both are cached until the triggers change, so a
+message that matches nothing costs a single scan however many triggers exist. Only when
+that prefilter hits are the individual triggers checked and their handlers scheduled.
+
+Guild triggers can be changed at runtime: moderators add keyword auto-responders and
+disable global triggers per guild with the ``trigger*`` commands of the moderation cog.
+With a state store, each guild's auto-responders and disabled triggers are saved under
+its ID and restored at startup (``restore``). Cluster workers share the store and read a
+guild again when another worker announces a change (``reload_guild``).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+import re
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Pattern, Set, Tuple
+
+import discord
+
+logger = logging.getLogger("Neurodivergence")
+
+TriggerHandler = Callable[[discord.Message, "re.Match[str]"], Awaitable[None]]
+ScopeKey = Tuple[Optional[int], Optional[int]]
+
+# Number of compiled per-scope matchers kept.
+MATCHER_CACHE_SIZE = 1024
+
+
+@dataclass(frozen=True)
+class Trigger:
+    name: str
+    pattern: Pattern[str]
+    handler: TriggerHandler
+    keywords: Tuple[str, ...] = ()
+    regex: Optional[str] = None
+    guild_id: Optional[int] = None
+    channel_id: Optional[int] = None
+    response: Optional[str] = None
+
+    @property
+    def scope(self) -> ScopeKey:
+        return self.guild_id, self.channel_id
+
+
+def compile_pattern(
+    keywords: Iterable[str] = (),
+    regex: Optional[str] = None,
+    *,
+    ignore_case: bool = True,
+    whole_word: bool = False,
+) -> Pattern[str]:
+    """
+    Build the pattern of a trigger from literal keywords and/or a regex.
+    """
+    alternatives = []
+    escaped = sorted((re.escape(keyword) for keyword in keywords if keyword), key=len, reverse=True)
+    if escaped:
+        keyword_pattern = "|".join(escaped)
+        alternatives.append(rf"\b(?:{keyword_pattern})\b" if whole_word else keyword_pattern)
+    if regex:
+        alternatives.append(regex)
+    if not alternatives:
+        raise ValueError("A trigger needs at least one keyword or a regex")
+    return re.compile("|".join(f"(?:{alternative})" for alternative in alternatives), re.IGNORECASE if ignore_case else 0)
+
+
+def trie_pattern(words: Iterable[str]) -> str:
+    """
+    Build a regex matching any of ``words`` whose alternations share common prefixes,
+    e.g. ``neuro``, ``neurodivergence`` and ``news`` become ``ne(?:uro(?:divergence)?|ws)``.
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        optional = "" in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if optional else group
+
+    return build(trie)
+
+
+class _ScopeMatcher:
+    def __init__(self, triggers: List[Trigger]) -> None:
+        self.triggers = triggers
+        # The prefilter only has to be a superset of the real matches: keywords are
+        # looked up case-insensitively and without word boundaries, then every trigger
+        # is checked with its own pattern.
+        keywords = {keyword.lower() for trigger in triggers for keyword in trigger.keywords if keyword}
+        self.keywords: Optional[Pattern[str]] = re.compile(trie_pattern(keywords)) if keywords else None
+        regexes = [
+            f"(?{'i' if trigger.pattern.flags & re.IGNORECASE else '-i'}:{trigger.regex})"
+            for trigger in triggers if trigger.regex
+        ]
+        self.regexes: Optional[Pattern[str]] = re.compile("|".join(regexes)) if regexes else None
+
+    def match(self, content: str) -> List[Tuple[Trigger, "re.Match[str]"]]:
+        keyword_hit = self.keywords is not None and self.keywords.search(content.lower()) is not None
+        if not keyword_hit and (self.regexes is None or self.regexes.search(content) is None):
+            return []
+        matches = []
+        for trigger in self.triggers:
+            match = trigger.pattern.search(content)
+            if match is not None:
+                matches.append((trigger, match))
+        return matches
+
+
+class TriggerDispatcher:
+    """
+    Holds every trigger of the bot and schedules the handlers of matching ones.
+
+    :param tracker: Optional ``TaskTracker`` the handler tasks are registered with, so a
+        shutdown waits for them. Nothing is dispatched once it is draining.
+    :param store: Optional state store the guild auto-responders and disabled triggers
+        are kept in.
+    """
+
+    def __init__(self, *, tracker=None, store=None) -> None:
+        self._triggers: Dict[ScopeKey, Dict[str, Trigger]] = collections.defaultdict(dict)
+        self._disabled: Dict[int, Set[str]] = collections.defaultdict(set)
+        self._guild_scopes: Set[int] = set()
+        self._channel_scopes: Set[int] = set()
+        self._matchers: "collections.OrderedDict[ScopeKey, _ScopeMatcher]" = collections.OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+        self.tracker = tracker
+        self.dispatched = 0
+        self._state = store.namespace("triggers") if store is not None else None
+
+    def _changed(self) -> None:
+        self._matchers.clear()
+        self._guild_scopes = {guild_id for guild_id, channel_id in self._triggers if guild_id is not None and channel_id is None}
+        self._guild_scopes |= set(self._disabled)
+        self._channel_scopes = {channel_id for _, channel_id in self._triggers if channel_id is not None}
+
+    def register(
+        self,
+        name: str,
+        handler: TriggerHandler,
+        *,
+        keywords: Iterable[str] = (),
+        regex: Optional[str] = None,
+        guild_id: Optional[int] = None,
+        channel_id: Optional[int] = None,
+        ignore_case: bool = True,
+        whole_word: bool = False,
+        response: Optional[str] = None,
+    ) -> Trigger:
+        """
+        Register (or replace) a trigger.
+
+        :param name: The name of the trigger, unique within its scope, e.g. ``"ai.neuro"``.
+        :param handler: Coroutine called with the message and the match.
+        :param keywords: Literal substrings to look for.
+        :param regex: A regular expression to look for, in addition to the keywords.
+        :param guild_id: Only match messages in this guild.
+        :param channel_id: Only match messages in this channel.
+        :param ignore_case: Match case-insensitively.
+        :param whole_word: Only match keywords on word boundaries.
+        :param response: For auto-responders, the text that is replied.
+        :raises ValueError: If there is nothing to match or the regex is invalid.
+        """
+        try:
+            pattern = compile_pattern(keywords, regex, ignore_case=ignore_case, whole_word=whole_word)
+        except re.error as e:
+            raise ValueError(f"Invalid regex: {e}") from e
+        trigger = Trigger(
+            name=name,
+            pattern=pattern,
+            handler=handler,
+            keywords=tuple(keywords),
+            regex=regex,
+            guild_id=guild_id,
+            channel_id=channel_id,
+            response=response,
+        )
+        self._triggers[trigger.scope][name] = trigger
+        self._changed()
+        return trigger
+
+    def unregister(self, name: str, *, guild_id: Optional[int] = None, channel_id: Optional[int] = None) -> bool:
+        scope = self._triggers.get((guild_id, channel_id))
+        if not scope or scope.pop(name, None) is None:
+            return False
+        if not scope:
+            del self._triggers[(guild_id, channel_id)]
+        self._changed()
+        return True
+
+    def unregister_prefix(self, prefix: str) -> int:
+        """
+        Remove every trigger whose name starts with ``prefix``, in every scope. Used by
+        cogs on unload.
+        """
+        removed = 0
+        for scope in list(self._triggers):
+            for name in [name for name in self._triggers[scope] if name.startswith(prefix)]:
+                del self._triggers[scope][name]
+                removed += 1
+            if not self._triggers[scope]:
+                del self._triggers[scope]
+        if removed:
+            self._changed()
+        return removed
+
+    def add_responder(self, guild_id: int, keyword: str, response: str, *, channel_id: Optional[int] = None) -> Trigger:
+        """
+        Add an auto-responder that replies ``response`` to messages containing ``keyword``.
+        """
+        trigger = self._add_responder(guild_id, keyword, response, channel_id)
+        self._save(guild_id)
+        return trigger
+
+    def remove_responder(self, guild_id: int, keyword: str, *, channel_id: Optional[int] = None) -> bool:
+        """
+        Remove the auto-responder of ``keyword``, returning whether there was one.
+        """
+        removed = self.unregister(f"responder:{keyword.lower()}", guild_id=guild_id, channel_id=channel_id)
+        if removed:
+            self._save(guild_id)
+        return removed
+
+    def _add_responder(self, guild_id: int, keyword: str, response: str, channel_id: Optional[int]) -> Trigger:
+        async def respond(message: discord.Message, match: "re.Match[str]") -> None:
+            await message.reply(response, allowed_mentions=discord.AllowedMentions.none())
+
+        return self.register(
+            f"responder:{keyword.lower()}",
+            respond,
+            keywords=[keyword],
+            guild_id=guild_id,
+            channel_id=channel_id,
+            whole_word=True,
+            response=response,
+        )
+
+    def set_enabled(self, guild_id: int, name: str, enabled: bool) -> None:
+        """
+        Enable or disable a global trigger in one guild.
+        """
+        if enabled:
+            self._disabled[guild_id].discard(name)
+            if not self._disabled[guild_id]:
+                del self._disabled[guild_id]
+        else:
+            self._disabled[guild_id].add(name)
+        self._changed()
+        self._save(guild_id)
+
+    async def restore(self) -> None:
+        """
+        Load the auto-responders and disabled triggers of every guild saved in the state
+        store. Call once the store is open.
+        """
+        if self._state is None:
+            return
+        saved = await self._state.items()
+        for key, value in saved.items():
+            try:
+                guild_id = int(key)
+            except ValueError:
+                logger.warning(f"Ignoring saved triggers under '{key}', not a guild ID")
+                continue
+            self._load_guild(guild_id, value)
+        if saved:
+            logger.info(f"Restored the triggers of {len(saved)} guilds")
+
+    async def reload_guild(self, guild_id: int) -> None:
+        """
+        Read the triggers of a guild from the state store again, after another cluster
+        worker changed them.
+        """
+        if self._state is None:
+            return
+        self._load_guild(guild_id, await self._state.get(str(guild_id)))
+
+    def _load_guild(self, guild_id: int, saved) -> None:
+        for scope in [scope for scope in self._triggers if scope[0] == guild_id]:
+            for name in [name for name in self._triggers[scope] if name.startswith("responder:")]:
+                del self._triggers[scope][name]
+            if not self._triggers[scope]:
+                del self._triggers[scope]
+        self._disabled.pop(guild_id, None)
+        if saved is not None and not isinstance(saved, dict):
+            logger.warning(f"Ignoring the saved triggers of guild {guild_id}: {saved!r:.100}")
+            saved = None
+        for responder in (saved or {}).get("responders", ()):
+            try:
+                channel_id = responder.get("channel_id")
+                self._add_responder(guild_id, responder["keyword"], responder["response"], int(channel_id) if channel_id else None)
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Ignoring a saved auto-responder of guild {guild_id}: {responder!r:.100} ({e})")
+        disabled = {name for name in (saved or {}).get("disabled", ()) if isinstance(name, str)}
+        if disabled:
+            self._disabled[guild_id] = disabled
+        self._changed()
+
+    def _save(self, guild_id: int) -> None:
+        if self._state is None:
+            return
+        responders = [
+            {"keyword": trigger.keywords[0], "response": trigger.response, "channel_id": trigger.channel_id}
+            for trigger in self.guild_triggers(guild_id)
+            if trigger.name.startswith("responder:") and trigger.response is not None
+        ]
+        disabled = sorted(self._disabled.get(guild_id, ()))
+        if responders or disabled:
+            self._state.set(str(guild_id), {"responders": responders, "disabled": disabled})
+        else:
+            self._state.delete(str(guild_id))
+
+    def triggers_for(self, guild_id: Optional[int], channel_id: Optional[int] = None) -> List[Trigger]:
+        """
+        Every trigger that applies to a message in the given guild and channel.
+        """
+        disabled = self._disabled.get(guild_id, set()) if guild_id is not None else set()
+        triggers = [trigger for trigger in self._triggers.get((None, None), {}).values() if trigger.name not in disabled]
+        if guild_id is not None:
+            triggers.extend(self._triggers.get((guild_id, None), {}).values())
+        if channel_id is not None:
+            triggers.extend(self._triggers.get((guild_id, channel_id), {}).values())
+        return triggers
+
+    def disabled_in(self, guild_id: int) -> Set[str]:
+        return set(self._disabled.get(guild_id, ()))
+
+    def guild_triggers(self, guild_id: int) -> List[Trigger]:
+        """
+        The triggers registered for a guild or one of its channels.
+        """
+        return [
+            trigger
+            for (scope_guild, _), triggers in self._triggers.items()
+            if scope_guild == guild_id
+            for trigger in triggers.values()
+        ]
+
+    def _matcher(self, guild_id: Optional[int], channel_id: Optional[int]) -> _ScopeMatcher:
+        # Guilds and channels without triggers of their own share the global matcher.
+        key_guild = guild_id if guild_id in self._guild_scopes or channel_id in self._channel_scopes else None
+        key_channel = channel_id if channel_id in self._channel_scopes else None
+        key = (key_guild, key_channel)
+        matcher = self._matchers.get(key)
+        if matcher is None:
+            matcher = _ScopeMatcher(self.triggers_for(key_guild, key_channel))
+            self._matchers[key] = matcher
+            if len(self._matchers) > MATCHER_CACHE_SIZE:
+                self._matchers.popitem(last=False)
+        else:
+            self._matchers.move_to_end(key)
+        return matcher
+
+    def match(self, message: discord.Message) -> List[Tuple[Trigger, "re.Match[str]"]]:
+        if not message.content:
+            return []
+        guild_id = message.guild.id if message.guild else None
+        return self._matcher(guild_id, message.channel.id).match(message.content)
+
+    def dispatch(self, message: discord.Message) -> int:
+        """
+        Match a message against its triggers and schedule the handlers of those that
+        matched. Returns the number of handlers scheduled.
+        """
+        if self.tracker is not None and self.tracker.draining:
+            return 0
+        matches = self.match(message)
+        for trigger, match in matches:
+            task = asyncio.create_task(self._run(trigger, message, match), name=f"trigger:{trigger.name}")
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            if self.tracker is not None:
+                self.tracker.track(task, f"trigger {trigger.name}")
+        self.dispatched += len(matches)
+        return len(matches)
+
+    async def _run(self, trigger: Trigger, message: discord.Message, match: "re.Match[str]") -> None:
+        try:
+            await trigger.handler(message, match)
+        except Exception as e:
+            logger.error(f"Trigger '{trigger.name}' failed on message {message.id}: {type(e).__name__}: {e}")
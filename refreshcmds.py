@@ -8,8 +8,9 @@ This repo includes an owner-only `sync` command in `cogs/owner.py`, but sometime
 just want a simple script you can run locally/CI to sync the bot's slash commands.
 
 This script:
-- Loads `TOKEN` from `.env` in the repo root (no third-party dotenv dependency).
-- Ensures sane defaults for env vars that are accessed at import-time by some cogs.
+- Loads `TOKEN` from `.env` in the repo root via `helpers.config` (the same parser as `bot.py`).
+- Attaches the validated config as `bot.config`, which the cogs read instead of `os.environ`.
+- Opens the state store (`STATE_DB_PATH`) as `bot.store`, which some cogs read when they load.
 - Loads all cogs from `./cogs` so `@commands.hybrid_command(...)` commands register.
 - Syncs application commands either globally or to a specific guild.
 
@@ -24,77 +25,18 @@ from __future__ import annotations
 
 import argparse
 import asyncio
-import json
-import os
 from pathlib import Path
-from typing import Dict, Iterable, Optional
+from typing import Iterable, Optional
 
 import discord
 from discord.ext import commands
 
+from helpers.config import ConfigError, load_config
+from helpers.store import Store
+from helpers.triggers import TriggerDispatcher
 
-REPO_ROOT = Path(__file__).resolve().parent
-
-
-def _strip_quotes(value: str) -> str:
-    value = value.strip()
-    if len(value) >= 2 and ((value[0] == value[-1] == '"') or (value[0] == value[-1] == "'")):
-        return value[1:-1]
-    return value
-
-
-def load_env_file(env_path: Path) -> Dict[str, str]:
-    """
-    Minimal .env loader.
-
-    - Supports KEY=VALUE pairs
-    - Ignores empty lines and lines starting with '#'
-    - Strips surrounding single/double quotes from values
-    - Does not expand variables
-    """
-    if not env_path.exists():
-        return {}
-
-    loaded: Dict[str, str] = {}
-    for raw_line in env_path.read_text(encoding="utf-8").splitlines():
-        line = raw_line.strip()
-        if not line or line.startswith("#"):
-            continue
-        if "=" not in line:
-            continue
-        key, value = line.split("=", 1)
-        key = key.strip()
-        value = _strip_quotes(value)
-        if not key:
-            continue
-        loaded[key] = value
-    return loaded
-
-
-def apply_env(overrides: Dict[str, str]) -> None:
-    """
-    Apply loaded .env values into os.environ without overwriting existing vars.
-    """
-    for k, v in overrides.items():
-        os.environ.setdefault(k, v)
-
-
-def ensure_env_defaults() -> None:
-    """
-    Some cogs read env vars at import time (module top-level).
-
-    In particular, `cogs/ai.py` does:
-      auto1111_hosts = json.loads(os.environ['AUTO1111_HOSTS'])
-      lms_hosts = json.loads(os.environ['LMS_HOSTS'])
 
-    So we provide safe defaults here to avoid KeyError/JSON errors when you only
-    want to sync commands.
-    """
-    os.environ.setdefault("AUTO1111_HOSTS", "[]")
-    os.environ.setdefault("LMS_HOSTS", "[]")
-    os.environ.setdefault("GEMINI_KEYS", "[]")
-    os.environ.setdefault("STATUSES", json.dumps(["Neurodivergence"]))
-    os.environ.setdefault("MINECRAFT_SERVERS", "[]")
+REPO_ROOT = Path(__file__).resolve().parent
 
 
 async def load_all_cogs(bot: commands.Bot, cogs_dir: Path) -> None:
@@ -141,17 +83,24 @@ def build_parser() -> argparse.ArgumentParser:
 
 
 async def run(scope: str, guild_id: Optional[int], env_file: Path) -> int:
-    env_values = load_env_file(env_file)
-    apply_env(env_values)
-    ensure_env_defaults()
+    try:
+        config = load_config(env_file)
+    except ConfigError as e:
+        print("Error: invalid configuration:\n- " + "\n- ".join(e.problems))
+        return 2
 
-    token = os.getenv("TOKEN")
+    token = config.token
     if not token:
         print(f"Error: TOKEN was not found. Expected it in {env_file} or your environment.")
         return 2
 
     intents = discord.Intents.none()
     bot = commands.Bot(command_prefix="!", intents=intents)
+    bot.config = config
+    # Cogs register their message triggers on load.
+    bot.triggers = TriggerDispatcher()
+    # Cogs restore their state on load, e.g. sidepipe's Minecraft server status.
+    bot.store = Store(config.state_db_path)
 
     @bot.event
     async def setup_hook() -> None:
@@ -176,11 +125,14 @@ async def run(scope: str, guild_id: Optional[int], env_file: Path) -> int:
         await bot.close()
 
     try:
+        await bot.store.open()
         await bot.start(token)
         return 0
     except discord.LoginFailure:
         print("Error: Discord login failed. Is TOKEN correct?")
         return 3
+    finally:
+        await bot.store.close()
 
 
 def main(argv: Optional[Iterable[str]] = None) -> int: